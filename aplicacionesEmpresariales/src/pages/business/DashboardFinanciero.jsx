@@ -119,7 +119,7 @@ const DashboardFinanciero = () => {
       }]
     },
     tendencia: {
-      labels: ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul'],
+      labels: data.ingresos.labels,
       datasets: [{
         label: 'Crecimiento',
         data: data.suscripciones.tendencia,
@@ -105,24 +105,22 @@ const Suscriptores = () => {
       const token = localStorage.getItem('access_token');
       
       const response = await axios.get('http://localhost:5000/api/business/subscribers/export', {
+        params: { format: 'csv' },
+        responseType: 'blob',
         headers: {
           'Authorization': `Bearer ${token}`
         }
       });
       
-      // En un sistema real, aquí descargarías el archivo
-      // Para este ejemplo, mostramos los datos en un alert
-      Swal.fire({
-        title: 'Datos para exportación',
-        html: `
-          <div class="text-left">
-            <p>Formato: ${response.data.format}</p>
-            <p>Registros: ${response.data.count}</p>
-            <pre class="mt-4 p-2 bg-gray-100 rounded text-xs">${JSON.stringify(response.data.data, null, 2)}</pre>
-          </div>
-        `,
-        confirmButtonText: 'Cerrar'
-      });
+      // Descargar el archivo generado por el backend
+      const url = window.URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = 'suscriptores.csv';
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
       
     } catch (err) {
       console.error('Error exporting subscribers:', err);
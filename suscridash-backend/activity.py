@@ -0,0 +1,271 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from models import DB_FILE
+
+# Registro de actividad del panel de administración. Las escrituras llaman a
+# emit() y el evento se agrega a un log de solo agregado: un archivo NDJSON por
+# día (UTC, según el timestamp del evento) en ACTIVITY_DIR. emit() solo encola
+# el evento; un hilo en segundo plano los escribe en lote, así el request no
+# espera al disco. Si el disco falla el evento se pierde, pero la escritura
+# que lo generó no.
+#
+# Todos los workers agregan a los mismos archivos (una escritura O_APPEND por
+# lote) y cada uno lee de forma incremental lo que se agregó desde su última
+# lectura hacia un buffer circular con los últimos ACTIVITY_BUFFER_SIZE
+# eventos; la vista "reciente" se arma desde ahí. Las consultas que van más
+# atrás recorren los archivos de los días del rango. Se borran los archivos
+# de más de ACTIVITY_RETENTION_DAYS días.
+ACTIVITY_DIR = os.getenv('ACTIVITY_DIR', DB_FILE + '.activity')
+ACTIVITY_BUFFER_SIZE = int(os.getenv('ACTIVITY_BUFFER_SIZE', '500'))
+ACTIVITY_RETENTION_DAYS = int(os.getenv('ACTIVITY_RETENTION_DAYS', '90'))
+# Espera del hilo escritor después del primer evento, para juntar los que
+# lleguen en ese lapso en una sola escritura. Quien lee el log escribe antes
+# lo pendiente de su proceso (flush), así que no retrasa la vista propia.
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '0.2'))
+
+# tipo -> (título, ícono en AdminDashboard)
+EVENT_TYPES = {
+    'new_business': ('Nueva empresa registrada', 'business'),
+    'business_updated': ('Empresa actualizada', 'update'),
+    'business_deleted': ('Empresa eliminada', 'business'),
+    'user_signup': ('Nuevo usuario registrado', 'user'),
+    'user_updated': ('Usuario actualizado', 'update'),
+    'user_deleted': ('Usuario eliminado', 'user'),
+    'new_subscription': ('Nueva suscripción creada', 'subscription'),
+    'subscription_status': ('Estado de suscripción actualizado', 'subscription'),
+    'subscription_deleted': ('Suscripción eliminada', 'subscription'),
+    'new_plan': ('Nuevo plan creado', 'subscription'),
+    'plan_updated': ('Plan actualizado', 'update'),
+    'plan_status': ('Plan activado/desactivado', 'update'),
+    'plan_deleted': ('Plan eliminado', 'subscription'),
+    'settings_updated': ('Configuración actualizada', 'update'),
+}
+
+_queue = queue.SimpleQueue()
+_queued = threading.Event()
+_write_lock = threading.Lock()
+_writer_pid = None
+_last_day = None
+
+# (posición, evento) del más viejo al más nuevo. La posición es (día, offset
+# de la línea en el archivo del día): ordena los eventos igual que el log y
+# es lo que lleva el cursor de paginación.
+_ring = deque(maxlen=ACTIVITY_BUFFER_SIZE)
+_ring_lock = threading.Lock()
+_tail = None  # (día, offset) hasta donde se leyó el log
+
+def emit(event_type, description, **fields):
+    # Registra un evento; fields se agregan tal cual (ids relacionados, etc.)
+    title, icon = EVENT_TYPES[event_type]
+    _queue.put({
+        'id': uuid.uuid4().hex,
+        'type': event_type,
+        'title': title,
+        'description': description or '',
+        'timestamp': datetime.utcnow().isoformat(),
+        'icon': icon,
+        **fields,
+    })
+    _queued.set()
+    if _writer_pid != os.getpid():
+        _start_writer()
+
+def _segment_path(day):
+    return os.path.join(ACTIVITY_DIR, day + '.ndjson')
+
+def _days():
+    try:
+        names = os.listdir(ACTIVITY_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len('.ndjson')] for name in names if name.endswith('.ndjson'))
+
+def _prune(today):
+    oldest = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=ACTIVITY_RETENTION_DAYS)).strftime('%Y-%m-%d')
+    for day in _days():
+        if day >= oldest:
+            break
+        try:
+            os.remove(_segment_path(day))
+        except FileNotFoundError:
+            # Lo borró otro worker
+            pass
+
+def _write_pending():
+    # Con _write_lock tomado: escribe todo lo que haya en la cola. Los eventos
+    # solo salen de la cola aquí, así flush() al salir no pierde ninguno.
+    global _last_day
+    events = []
+    while True:
+        try:
+            events.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not events:
+        return
+    by_day = {}
+    for event in events:
+        by_day.setdefault(event['timestamp'][:10], []).append(event)
+    os.makedirs(ACTIVITY_DIR, exist_ok=True)
+    for day, group in sorted(by_day.items()):
+        data = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in group)
+        fd = os.open(_segment_path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode('utf-8'))
+        finally:
+            os.close(fd)
+    if day != _last_day:
+        _last_day = day
+        _prune(day)
+
+def _write_loop():
+    while True:
+        _queued.wait()
+        time.sleep(ACTIVITY_FLUSH_INTERVAL)
+        _queued.clear()
+        flush()
+
+def _start_writer():
+    # Una vez por proceso: los hilos no sobreviven al fork de gunicorn
+    global _writer_pid
+    with _write_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+    threading.Thread(target=_write_loop, name='activity-writer', daemon=True).start()
+    atexit.register(flush)
+
+def flush():
+    # Escribe ya los eventos encolados en este proceso
+    try:
+        with _write_lock:
+            _write_pending()
+    except OSError:
+        pass
+
+def _read_segment(day, start=0):
+    # [(posición, evento)] de las líneas completas desde start, y el offset en
+    # que terminan (una línea a medio escribir se lee la próxima vez)
+    try:
+        with open(_segment_path(day), 'rb') as f:
+            f.seek(start)
+            data = f.read()
+    except FileNotFoundError:
+        return [], start
+    end = data.rfind(b'\n') + 1
+    events = []
+    offset = start
+    for line in data[:end].split(b'\n')[:-1]:
+        try:
+            events.append(((day, offset), json.loads(line)))
+        except ValueError:
+            pass
+        offset += len(line) + 1
+    return events, start + end
+
+def _catch_up():
+    # Pasa al buffer lo que se agregó al log (en cualquier worker) desde la
+    # última lectura; la primera vez lo llena con los días más recientes
+    global _tail
+    with _ring_lock:
+        days = _days()
+        if _tail is None:
+            _tail = (days[-1], 0) if days else ('', 0)
+            loaded = []
+            for day in reversed(days):
+                events, end = _read_segment(day)
+                if day == _tail[0]:
+                    _tail = (day, end)
+                loaded.append(events)
+                if sum(len(events) for events in loaded) >= ACTIVITY_BUFFER_SIZE:
+                    break
+            for events in reversed(loaded):
+                _ring.extend(events)
+            return
+        for day in days:
+            if day < _tail[0]:
+                continue
+            events, end = _read_segment(day, _tail[1] if day == _tail[0] else 0)
+            _ring.extend(events)
+            _tail = (day, end)
+
+def _parse_cursor(cursor):
+    try:
+        day, offset = cursor.split(':')
+        datetime.strptime(day, '%Y-%m-%d')
+        return day, int(offset)
+    except ValueError:
+        raise ValueError('Cursor no válido')
+
+def _parse_time(name, value):
+    if value is None:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} debe ser una fecha ISO 8601 (UTC)')
+    return value
+
+def list_activity(types=None, since=None, until=None, cursor=None, limit=20):
+    # Eventos del más nuevo al más viejo. types: tipos aceptados; since y
+    # until: fechas ISO en UTC, inclusive ('2024-05-01' incluye todo el día);
+    # cursor: el next_cursor de la página anterior. Devuelve (eventos,
+    # next_cursor). Lanza ValueError si algún filtro no es válido.
+    since = _parse_time('since', since)
+    until = _parse_time('until', until)
+    before = _parse_cursor(cursor) if cursor else None
+    flush()
+    _catch_up()
+
+    def matches(event):
+        timestamp = event.get('timestamp', '')
+        return ((not types or event.get('type') in types)
+                and (until is None or timestamp[:len(until)] <= until))
+
+    page = []
+
+    def collect(events, bound):
+        # Agrega a page los eventos anteriores a bound; False si ya no hace
+        # falta seguir
+        for position, event in reversed(events):
+            if bound is not None and position >= bound:
+                continue
+            if since is not None and event.get('timestamp', '') < since:
+                return False
+            if matches(event):
+                page.append((position, event))
+                if len(page) > limit:
+                    return False
+        return True
+
+    with _ring_lock:
+        ring = list(_ring)
+        complete = len(ring) < ACTIVITY_BUFFER_SIZE
+    # Si el buffer no llegó a llenarse tiene todo el log; si no, lo anterior
+    # a su primer evento se busca en los archivos
+    if collect(ring, before) and not complete:
+        bound = ring[0][0] if ring else None
+        if before is not None and (bound is None or before < bound):
+            bound = before
+        for day in reversed(_days()):
+            if (bound is not None and day > bound[0]) or (until is not None and day > until[:10]):
+                continue
+            if since is not None and day < since[:10]:
+                break
+            if not collect(_read_segment(day)[0], bound):
+                break
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        day, offset = page[-1][0]
+        next_cursor = f'{day}:{offset}'
+    return [event for _, event in page], next_cursor
@@ -1,4 +1,5 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import jwt
 from datetime import datetime, timedelta
@@ -9,7 +10,26 @@ from dotenv import load_dotenv
 # Primero cargar configuración
 load_dotenv()
 
+from records import Record
+from tracing import span
+
+# Los registros de models se guardan como records.Record; se pasan a dict
+# recién al responder
+class RecordJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        with span('json.dumps') as current:
+            text = super().dumps(obj, **kwargs)
+            current.set_attribute('bytes', len(text))
+            return text
+
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 CORS(app, supports_credentials=True, resources={
     r"/api/*": {
         "origins": ["http://localhost:5173",
@@ -37,12 +57,51 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
 # Importar después de crear app para evitar circularidad
-from models import init_db, get_db, save_db
-from auth import authenticate_user, register_user, get_current_user
+from models import (init_db, refresh_db, get_record, find_records, iter_records, list_records,
+                    recent_records, insert_record, update_record, delete_record, get_settings,
+                    update_settings)
+from auth import authenticate_user, register_user, get_current_user, require_role
+from utils import fetch_page, project, conditional, MAX_PAGE_SIZE
+from stats import get_stats, check_stats
+from finance import get_financial_stats
+from exports import export_response
+from search import search_subscribers
+from catalog import catalog_response
+from activity import emit, list_activity
+from compress import compress_response
+import metrics
+import profiler
+import tracing
+
+# Trace id y spans de cada request (ver tracing); va primero para que el span
+# raíz cubra los demás hooks
+tracing.init_app(app)
+
+# Perfilado de requests a pedido (X-Profile) o por muestreo; va antes que
+# métricas y compresión para cubrirlas
+profiler.init_app(app)
+
+# Latencia, tamaño y estado de cada request (ver /metrics). Va antes de la
+# compresión para medir lo que sale por la red
+metrics.init_app(app)
+
+# Compresión gzip/br de las respuestas JSON, CSV y NDJSON
+app.after_request(compress_response)
 
 # Inicializar base de datos
 init_db()
 
+# Cada worker de gunicorn tiene su propia copia en memoria: antes de atender
+# se incorporan los cambios que otros workers dejaron en el journal
+@app.before_request
+def sync_db():
+    refresh_db()
+
+# Métricas de todos los workers en formato Prometheus
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return metrics.metrics_response()
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -133,1182 +192,776 @@ def register():
         return jsonify({'error': str(e)}), 400
 
 @app.route('/api/auth/me', methods=['GET'])
-def get_me():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
-    
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user = get_current_user(payload['user_id'])
-        if not user:
-            return jsonify({'error': 'Usuario no encontrado'}), 404
-            
-        return jsonify({
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'name': user['name'],
-                'user_type': user['user_type'],
-                'business_name': user.get('business_name', ''),
-                'tax_id': user.get('tax_id', '')
-            }
-        })
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+@require_role()
+@conditional('users:tenant')
+def get_me(payload):
+    user = get_current_user(payload['user_id'])
+    if not user:
+        return jsonify({'error': 'Usuario no encontrado'}), 404
+        
+    return jsonify({
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'name': user['name'],
+            'user_type': user['user_type'],
+            'business_name': user.get('business_name', ''),
+            'tax_id': user.get('tax_id', '')
+        }
+    })
     
 @app.route('/api/admin/stats', methods=['GET'])
-def get_admin_stats():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
-    
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Contar empresas (user_type = 'business')
-        total_businesses = len([u for u in db['users'] if u['user_type'] == 'business'])
-        
-        # En un sistema real, estos valores vendrían de la base de datos
-        active_subscriptions = 156  # Simulado por ahora
-        total_revenue = 12543000    # Simulado por ahora
-        new_customers = 23          # Simulado por ahora
-        
-        return jsonify({
-            'total_businesses': total_businesses,
-            'active_subscriptions': active_subscriptions,
-            'total_revenue': total_revenue,
-            'new_customers': new_customers
-        })
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+@require_role('admin')
+def get_admin_stats(payload):
+    # Contadores que se actualizan con cada cambio (stats.py): el costo no
+    # depende de la cantidad de datos
+    stats = get_stats()
+    response = {
+        'total_businesses': stats['total_businesses'],
+        'businesses_by_status': stats['businesses_by_status'],
+        'active_subscriptions': stats['active_subscriptions'],
+        'total_revenue': stats['mrr'],  # MRR: suma de monthly_amount de las activas
+        'new_customers': stats['new_customers'],
+        'new_customers_days': stats['new_customers_days']
+    }
+    # ?check=1: compara con un recálculo completo (recorre todos los datos)
+    if request.args.get('check') == '1':
+        response['inconsistencies'] = {name: {'counter': counter, 'recomputed': recomputed}
+                                       for name, (counter, recomputed) in check_stats().items()}
+    return jsonify(response)
 
 @app.route('/api/admin/recent-businesses', methods=['GET'])
-def get_recent_businesses():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
-    
-    token = auth_header.split(' ')[1]
+@require_role('admin')
+@conditional('users')
+def get_recent_businesses(payload):
+    # Obtener las últimas n empresas registradas (?n=, 5 por defecto)
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Obtener las últimas 5 empresas registradas
-        businesses = [u for u in db['users'] if u['user_type'] == 'business']
-        recent_businesses = sorted(businesses, key=lambda x: x.get('created_at', ''), reverse=True)[:5]
-        
-        # Formatear la respuesta
-        formatted_businesses = []
-        for business in recent_businesses:
-            formatted_businesses.append({
-                'id': business['id'],
-                'name': business.get('business_name', 'Sin nombre'),
-                'email': business['email'],
-                'subscriptions': business.get('subscriptions', 0),
-                'status': business.get('status', 'active')
-            })
-        
-        return jsonify({'businesses': formatted_businesses})
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        n = int(request.args.get('n', 5))
+    except ValueError:
+        return jsonify({'error': 'n debe ser un número'}), 400
+    if n < 1:
+        return jsonify({'error': 'n debe ser mayor que 0'}), 400
+    recent_businesses = recent_records('users', min(n, MAX_PAGE_SIZE), 'business')
     
-@app.route('/api/admin/businesses', methods=['GET'])
-def get_all_businesses():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+    # Formatear la respuesta
+    formatted_businesses = []
+    for business in recent_businesses:
+        formatted_businesses.append({
+            'id': business['id'],
+            'name': business.get('business_name', 'Sin nombre'),
+            'email': business['email'],
+            'subscriptions': business.get('subscriptions', 0),
+            'status': business.get('status', 'active')
+        })
     
-    token = auth_header.split(' ')[1]
+    return jsonify({'businesses': formatted_businesses})
+    
+@app.route('/api/admin/businesses', methods=['GET'])
+@require_role('admin')
+@conditional('users')
+def get_all_businesses(payload):
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Obtener todas las empresas (user_type = 'business')
-        businesses = [u for u in db['users'] if u['user_type'] == 'business']
-        
-        # Formatear la respuesta
-        formatted_businesses = []
-        for business in businesses:
-            formatted_businesses.append({
-                'id': business['id'],
-                'business_name': business.get('business_name', 'Sin nombre'),
-                'email': business['email'],
-                'status': business.get('status', 'active'),
-                'subscriptions': business.get('subscriptions', 0),
-                'created_at': business.get('created_at', '')
-            })
-        
-        return jsonify({'businesses': formatted_businesses})
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        businesses, next_cursor = fetch_page('users', 'business')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if businesses is None:
+        # Sin paginar: todas las empresas (user_type = 'business')
+        businesses = find_records('users', 'user_type', 'business')
+    
+    # Formatear la respuesta
+    formatted_businesses = []
+    for business in businesses:
+        formatted_businesses.append({
+            'id': business['id'],
+            'business_name': business.get('business_name', 'Sin nombre'),
+            'email': business['email'],
+            'status': business.get('status', 'active'),
+            'subscriptions': business.get('subscriptions', 0),
+            'created_at': business.get('created_at', '')
+        })
+    
+    return jsonify({'businesses': project(formatted_businesses), 'next_cursor': next_cursor})
 
 @app.route('/api/admin/businesses/<business_id>', methods=['DELETE'])
-def delete_business(business_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+def delete_business(business_id, payload):
+    # Buscar y eliminar la empresa
+    user = get_record('users', business_id)
+    if user and user['user_type'] == 'business':
+        delete_record('users', business_id)
+        emit('business_deleted', user.get('business_name') or user['email'], business_id=business_id)
+        return jsonify({'message': 'Empresa eliminada correctamente'})
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Buscar y eliminar la empresa
-        for i, user in enumerate(db['users']):
-            if user['id'] == business_id and user['user_type'] == 'business':
-                del db['users'][i]
-                save_db()
-                return jsonify({'message': 'Empresa eliminada correctamente'})
-        
-        return jsonify({'error': 'Empresa no encontrada'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+    return jsonify({'error': 'Empresa no encontrada'}), 404
     
-@app.route('/api/admin/users', methods=['GET'])
-def get_all_users():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
     
-    token = auth_header.split(' ')[1]
+@app.route('/api/admin/users', methods=['GET'])
+@require_role('admin')
+@conditional('users')
+def get_all_users(payload):
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Obtener solo los usuarios tipo customer (excluyendo businesses y admin)
-        users = [u for u in db['users'] if u['user_type'] == 'customer']
-        
-        # Formatear la respuesta
-        formatted_users = []
-        for user in users:
-            user_data = {
-                'id': user['id'],
-                'name': user['name'],
-                'email': user['email'],
-                'user_type': user['user_type'],
-                'created_at': user.get('created_at', '')
-            }
-            formatted_users.append(user_data)
-        
-        return jsonify({'users': formatted_users})
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        users, next_cursor = fetch_page('users', 'customer')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if users is None:
+        # Sin paginar: solo los usuarios tipo customer (excluyendo businesses y admin)
+        users = find_records('users', 'user_type', 'customer')
+    
+    # Formatear la respuesta
+    formatted_users = []
+    for user in users:
+        user_data = {
+            'id': user['id'],
+            'name': user['name'],
+            'email': user['email'],
+            'user_type': user['user_type'],
+            'created_at': user.get('created_at', '')
+        }
+        formatted_users.append(user_data)
+    
+    return jsonify({'users': project(formatted_users), 'next_cursor': next_cursor})
 
 @app.route('/api/admin/users/<user_id>', methods=['DELETE'])
-def delete_user(user_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+def delete_user(user_id, payload):
+    # Buscar y eliminar el usuario (no permitir eliminar admin)
+    user = get_record('users', user_id)
+    if user and user['user_type'] != 'admin':
+        delete_record('users', user_id)
+        emit('user_deleted', user['email'], user_id=user_id)
+        return jsonify({'message': 'Usuario eliminado correctamente'})
+    
+    return jsonify({'error': 'Usuario no encontrado o no se puede eliminar'}), 404
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Buscar y eliminar el usuario (no permitir eliminar admin)
-        for i, user in enumerate(db['users']):
-            if user['id'] == user_id and user['user_type'] != 'admin':
-                del db['users'][i]
-                save_db()
-                return jsonify({'message': 'Usuario eliminado correctamente'})
-        
-        return jsonify({'error': 'Usuario no encontrado o no se puede eliminar'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
     
 @app.route('/api/admin/users/<user_id>', methods=['GET'])
-def get_user_details(user_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+@conditional('users')
+def get_user_details(user_id, payload):
+    # Buscar usuario
+    user = get_record('users', user_id)
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Buscar usuario
-        user = None
-        for u in db['users']:
-            if u['id'] == user_id:
-                user = u
-                break
+    if not user:
+        return jsonify({'error': 'Usuario no encontrado'}), 404
         
-        if not user:
-            return jsonify({'error': 'Usuario no encontrado'}), 404
-            
+    return jsonify({
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'name': user['name'],
+            'user_type': user['user_type'],
+            'created_at': user.get('created_at', ''),
+            'business_name': user.get('business_name', ''),
+            'tax_id': user.get('tax_id', '')
+        }
+    })
+
+@app.route('/api/admin/users/<user_id>', methods=['PUT'])
+@require_role('admin')
+def update_user(user_id, payload):
+    data = request.get_json()
+    
+    # Buscar y actualizar usuario
+    user = get_record('users', user_id)
+    if user:
+        changes = {}
+        if 'name' in data:
+            changes['name'] = data['name']
+        if 'email' in data:
+            # Verificar que el nuevo email no exista
+            for u in find_records('users', 'email', data['email']):
+                if u['id'] != user_id:
+                    return jsonify({'error': 'El email ya está en uso'}), 400
+            changes['email'] = data['email']
+        if 'user_type' in data:
+            changes['user_type'] = data['user_type']
+        if 'business_name' in data:
+            changes['business_name'] = data['business_name']
+        if 'tax_id' in data:
+            changes['tax_id'] = data['tax_id']
+        
+        user = update_record('users', user_id, changes)
+        emit('user_updated', user['email'], user_id=user_id)
         return jsonify({
+            'message': 'Usuario actualizado correctamente',
             'user': {
                 'id': user['id'],
                 'email': user['email'],
                 'name': user['name'],
                 'user_type': user['user_type'],
-                'created_at': user.get('created_at', ''),
                 'business_name': user.get('business_name', ''),
                 'tax_id': user.get('tax_id', '')
             }
         })
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
-
-@app.route('/api/admin/users/<user_id>', methods=['PUT'])
-def update_user(user_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        db = get_db()
-        
-        # Buscar y actualizar usuario
-        for user in db['users']:
-            if user['id'] == user_id:
-                if 'name' in data:
-                    user['name'] = data['name']
-                if 'email' in data:
-                    # Verificar que el nuevo email no exista
-                    for u in db['users']:
-                        if u['id'] != user_id and u['email'] == data['email']:
-                            return jsonify({'error': 'El email ya está en uso'}), 400
-                    user['email'] = data['email']
-                if 'user_type' in data:
-                    user['user_type'] = data['user_type']
-                if 'business_name' in data:
-                    user['business_name'] = data['business_name']
-                if 'tax_id' in data:
-                    user['tax_id'] = data['tax_id']
-                
-                save_db()
-                return jsonify({
-                    'message': 'Usuario actualizado correctamente',
-                    'user': {
-                        'id': user['id'],
-                        'email': user['email'],
-                        'name': user['name'],
-                        'user_type': user['user_type'],
-                        'business_name': user.get('business_name', ''),
-                        'tax_id': user.get('tax_id', '')
-                    }
-                })
-        
-        return jsonify({'error': 'Usuario no encontrado'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+    return jsonify({'error': 'Usuario no encontrado'}), 404
+    
     
 @app.route('/api/admin/businesses/<business_id>', methods=['GET'])
-def get_business_details(business_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+@conditional('users')
+def get_business_details(business_id, payload):
+    # Buscar empresa
+    business = get_record('users', business_id)
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Buscar empresa
-        business = None
-        for u in db['users']:
-            if u['id'] == business_id and u['user_type'] == 'business':
-                business = u
-                break
+    if not business or business['user_type'] != 'business':
+        return jsonify({'error': 'Empresa no encontrada'}), 404
         
-        if not business:
-            return jsonify({'error': 'Empresa no encontrada'}), 404
-            
+    return jsonify({
+        'business': {
+            'id': business['id'],
+            'email': business['email'],
+            'name': business['name'],
+            'business_name': business.get('business_name', ''),
+            'tax_id': business.get('tax_id', ''),
+            'subscriptions': business.get('subscriptions', 0),
+            'status': business.get('status', 'active'),
+            'created_at': business.get('created_at', '')
+        }
+    })
+
+@app.route('/api/admin/businesses/<business_id>', methods=['PUT'])
+@require_role('admin')
+def update_business(business_id, payload):
+    data = request.get_json()
+    
+    # Buscar y actualizar empresa
+    user = get_record('users', business_id)
+    if user and user['user_type'] == 'business':
+        changes = {}
+        if 'name' in data:
+            changes['name'] = data['name']
+        if 'email' in data:
+            # Verificar que el nuevo email no exista
+            for u in find_records('users', 'email', data['email']):
+                if u['id'] != business_id:
+                    return jsonify({'error': 'El email ya está en uso'}), 400
+            changes['email'] = data['email']
+        if 'business_name' in data:
+            changes['business_name'] = data['business_name']
+        if 'tax_id' in data:
+            changes['tax_id'] = data['tax_id']
+        if 'status' in data:
+            changes['status'] = data['status']
+        
+        user = update_record('users', business_id, changes)
+        emit('business_updated', user.get('business_name') or user['email'], business_id=business_id)
         return jsonify({
+            'message': 'Empresa actualizada correctamente',
             'business': {
-                'id': business['id'],
-                'email': business['email'],
-                'name': business['name'],
-                'business_name': business.get('business_name', ''),
-                'tax_id': business.get('tax_id', ''),
-                'subscriptions': business.get('subscriptions', 0),
-                'status': business.get('status', 'active'),
-                'created_at': business.get('created_at', '')
+                'id': user['id'],
+                'email': user['email'],
+                'name': user['name'],
+                'business_name': user.get('business_name', ''),
+                'tax_id': user.get('tax_id', ''),
+                'subscriptions': user.get('subscriptions', 0),
+                'status': user.get('status', 'active'),
+                'created_at': user.get('created_at', '')
             }
         })
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
-
-@app.route('/api/admin/businesses/<business_id>', methods=['PUT'])
-def update_business(business_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        db = get_db()
-        
-        # Buscar y actualizar empresa
-        for user in db['users']:
-            if user['id'] == business_id and user['user_type'] == 'business':
-                if 'name' in data:
-                    user['name'] = data['name']
-                if 'email' in data:
-                    # Verificar que el nuevo email no exista
-                    for u in db['users']:
-                        if u['id'] != business_id and u['email'] == data['email']:
-                            return jsonify({'error': 'El email ya está en uso'}), 400
-                    user['email'] = data['email']
-                if 'business_name' in data:
-                    user['business_name'] = data['business_name']
-                if 'tax_id' in data:
-                    user['tax_id'] = data['tax_id']
-                if 'status' in data:
-                    user['status'] = data['status']
-                
-                save_db()
-                return jsonify({
-                    'message': 'Empresa actualizada correctamente',
-                    'business': {
-                        'id': user['id'],
-                        'email': user['email'],
-                        'name': user['name'],
-                        'business_name': user.get('business_name', ''),
-                        'tax_id': user.get('tax_id', ''),
-                        'subscriptions': user.get('subscriptions', 0),
-                        'status': user.get('status', 'active'),
-                        'created_at': user.get('created_at', '')
-                    }
-                })
-        
-        return jsonify({'error': 'Empresa no encontrada'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+    return jsonify({'error': 'Empresa no encontrada'}), 404
     
-@app.route('/api/admin/recent-activity', methods=['GET'])
-def get_recent_activity():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
     
-    token = auth_header.split(' ')[1]
+@app.route('/api/admin/recent-activity', methods=['GET'])
+@require_role('admin')
+def get_recent_activity(payload):
+    # Eventos del registro de actividad, del más nuevo al más viejo. Filtros:
+    # ?type=new_business,user_signup&since=2024-05-01&until=2024-05-31T12:00
+    # (UTC); ?limit y ?cursor=next_cursor para paginar.
+    types = request.args.get('type')
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        # Datos simulados de actividad - en un sistema real esto vendría de la base de datos
-        recent_activity = [
-            {
-                'id': '1',
-                'type': 'new_business',
-                'title': 'Nueva empresa registrada',
-                'description': 'Tech Solutions SA',
-                'timestamp': '2023-11-15T10:30:00',
-                'icon': 'business'
-            },
-            {
-                'id': '2',
-                'type': 'new_subscription',
-                'title': 'Nueva suscripción creada',
-                'description': 'Plan Premium',
-                'timestamp': '2023-11-15T09:15:00',
-                'icon': 'subscription'
-            },
-            {
-                'id': '3',
-                'type': 'payment',
-                'title': 'Pago procesado',
-                'description': '$120,000 CLP',
-                'timestamp': '2023-11-14T16:45:00',
-                'icon': 'payment'
-            },
-            {
-                'id': '4',
-                'type': 'user_signup',
-                'title': 'Nuevo usuario registrado',
-                'description': 'cliente@nuevo.cl',
-                'timestamp': '2023-11-14T14:20:00',
-                'icon': 'user'
-            },
-            {
-                'id': '5',
-                'type': 'business_updated',
-                'title': 'Empresa actualizada',
-                'description': 'Marketing Digital SpA',
-                'timestamp': '2023-11-14T11:10:00',
-                'icon': 'update'
-            }
-        ]
-        
-        return jsonify({'activity': recent_activity})
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            raise ValueError('limit debe ser un número')
+        if limit < 1:
+            raise ValueError('limit debe ser mayor que 0')
+        activity, next_cursor = list_activity(
+            types=set(types.split(',')) if types else None,
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            cursor=request.args.get('cursor'),
+            limit=min(limit, 200))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-@app.route('/api/admin/subscriptions', methods=['GET'])
-def get_all_subscriptions():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+    return jsonify({'activity': activity, 'next_cursor': next_cursor})
     
-    token = auth_header.split(' ')[1]
+@app.route('/api/admin/subscriptions', methods=['GET'])
+@require_role('admin')
+@conditional('subscriptions')
+def get_all_subscriptions(payload):
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        return jsonify({'subscriptions': db.get('subscriptions', [])})
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        subscriptions, next_cursor = fetch_page('subscriptions')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if subscriptions is None:
+        subscriptions = list_records('subscriptions')
+    return jsonify({'subscriptions': project(subscriptions), 'next_cursor': next_cursor})
 
 @app.route('/api/admin/subscriptions/<subscription_id>', methods=['DELETE'])
-def delete_subscription(subscription_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+def delete_subscription(subscription_id, payload):
+    # Buscar y eliminar la suscripción
+    sub = get_record('subscriptions', subscription_id)
+    if delete_record('subscriptions', subscription_id):
+        emit('subscription_deleted', sub.get('plan_name', '') if sub else '',
+             subscription_id=subscription_id)
+        return jsonify({'message': 'Suscripción eliminada correctamente'})
+    
+    return jsonify({'error': 'Suscripción no encontrada'}), 404
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        subscriptions = db.get('subscriptions', [])
-        
-        # Buscar y eliminar la suscripción
-        for i, sub in enumerate(subscriptions):
-            if sub['id'] == subscription_id:
-                del subscriptions[i]
-                save_db()
-                return jsonify({'message': 'Suscripción eliminada correctamente'})
-        
-        return jsonify({'error': 'Suscripción no encontrada'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
     
+def _cancellation_changes(sub, new_status):
+    # Fecha de baja para las series de finance: se guarda al pasar a
+    # cancelada y se descarta si se reactiva
+    if sub is None:
+        return {}
+    if new_status == 'cancelled' and sub.get('status') != 'cancelled':
+        return {'cancelled_at': datetime.utcnow().isoformat()}
+    if new_status != 'cancelled' and sub.get('cancelled_at'):
+        return {'cancelled_at': None}
+    return {}
+
 @app.route('/api/admin/subscriptions/<subscription_id>', methods=['PUT'])
-def update_subscription(subscription_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+def update_subscription(subscription_id, payload):
+    data = request.get_json()
+    
+    # Validar datos de entrada
+    required_fields = ['plan_name', 'status', 'monthly_amount']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'Falta el campo requerido: {field}'}), 400
+    
+    # Validar estados permitidos
+    valid_statuses = ['active', 'pending', 'cancelled']
+    if data['status'] not in valid_statuses:
+        return jsonify({'error': f'Estado no válido. Debe ser uno de: {", ".join(valid_statuses)}'}), 400
+    
+    # Validar monto positivo
+    if not isinstance(data['monthly_amount'], (int, float)) or data['monthly_amount'] <= 0:
+        return jsonify({'error': 'El monto mensual debe ser un número positivo'}), 400
+    
+    # Buscar y actualizar suscripción
+    changes = {
+        'plan_name': data['plan_name'],
+        'status': data['status'],
+        'monthly_amount': data['monthly_amount']
+    }
+    changes.update(_cancellation_changes(get_record('subscriptions', subscription_id), data['status']))
+    sub = update_record('subscriptions', subscription_id, changes)
+    if sub:
+        emit('subscription_status', f"{sub.get('plan_name', '')}: {sub['status']}",
+             subscription_id=subscription_id)
+        return jsonify({
+            'message': 'Suscripción actualizada correctamente',
+            'subscription': sub
+        })
+    
+    return jsonify({'error': 'Suscripción no encontrada'}), 404
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        
-        # Validar datos de entrada
-        required_fields = ['plan_name', 'status', 'monthly_amount']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Falta el campo requerido: {field}'}), 400
-        
-        # Validar estados permitidos
-        valid_statuses = ['active', 'pending', 'cancelled']
-        if data['status'] not in valid_statuses:
-            return jsonify({'error': f'Estado no válido. Debe ser uno de: {", ".join(valid_statuses)}'}), 400
-        
-        # Validar monto positivo
-        if not isinstance(data['monthly_amount'], (int, float)) or data['monthly_amount'] <= 0:
-            return jsonify({'error': 'El monto mensual debe ser un número positivo'}), 400
-        
-        db = get_db()
-        subscriptions = db.get('subscriptions', [])
-        
-        # Buscar y actualizar suscripción
-        for sub in subscriptions:
-            if sub['id'] == subscription_id:
-                sub.update({
-                    'plan_name': data['plan_name'],
-                    'status': data['status'],
-                    'monthly_amount': data['monthly_amount']
-                })
-                save_db()
-                return jsonify({
-                    'message': 'Suscripción actualizada correctamente',
-                    'subscription': sub
-                })
-        
-        return jsonify({'error': 'Suscripción no encontrada'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/admin/subscriptions', methods=['POST'])
-def create_subscription():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+def create_subscription(payload):
+    data = request.get_json()
+    
+    # Validar datos de entrada
+    required_fields = ['business_id', 'plan_name', 'status', 'monthly_amount', 'start_date']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'Falta el campo requerido: {field}'}), 400
+    
+    # Validar estados permitidos
+    valid_statuses = ['active', 'pending']
+    if data['status'] not in valid_statuses:
+        return jsonify({'error': f'Estado no válido. Debe ser uno de: {", ".join(valid_statuses)}'}), 400
+    
+    # Validar monto positivo
+    if not isinstance(data['monthly_amount'], (int, float)) or data['monthly_amount'] <= 0:
+        return jsonify({'error': 'El monto debe ser un número positivo'}), 400
     
-    token = auth_header.split(' ')[1]
+    # Validar fecha
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        
-        # Validar datos de entrada
-        required_fields = ['business_id', 'plan_name', 'status', 'monthly_amount', 'start_date']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Falta el campo requerido: {field}'}), 400
-        
-        # Validar estados permitidos
-        valid_statuses = ['active', 'pending']
-        if data['status'] not in valid_statuses:
-            return jsonify({'error': f'Estado no válido. Debe ser uno de: {", ".join(valid_statuses)}'}), 400
-        
-        # Validar monto positivo
-        if not isinstance(data['monthly_amount'], (int, float)) or data['monthly_amount'] <= 0:
-            return jsonify({'error': 'El monto debe ser un número positivo'}), 400
-        
-        # Validar fecha
-        try:
-            start_date = datetime.strptime(data['start_date'], '%Y-%m-%d')
-        except ValueError:
-            return jsonify({'error': 'Formato de fecha inválido. Use YYYY-MM-DD'}), 400
-        
-        # Calcular fecha de renovación (1 año después)
-        renewal_date = start_date + timedelta(days=365)
-        
-        db = get_db()
-        
-        # Obtener nombre de la empresa
-        business_name = ""
-        for user in db['users']:
-            if user['id'] == data['business_id'] and user['user_type'] == 'business':
-                business_name = user.get('business_name', '')
-                break
-        
-        # Crear nueva suscripción
-        new_subscription = {
-            'id': str(uuid.uuid4()),
-            'business_id': data['business_id'],
-            'business_name': business_name,
-            'plan_name': data['plan_name'],
-            'start_date': data['start_date'],
-            'renewal_date': renewal_date.strftime('%Y-%m-%d'),
-            'status': data['status'],
-            'monthly_amount': data['monthly_amount'],
-            'payment_method': 'credit_card',  # Valor por defecto
-            'created_at': datetime.utcnow().isoformat()
-        }
-        
-        # Agregar a la base de datos
-        if 'subscriptions' not in db:
-            db['subscriptions'] = []
-        db['subscriptions'].append(new_subscription)
-        save_db()
-        
-        return jsonify({
-            'message': 'Suscripción creada correctamente',
-            'subscription': new_subscription
-        }), 201
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        start_date = datetime.strptime(data['start_date'], '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido. Use YYYY-MM-DD'}), 400
+    
+    # Calcular fecha de renovación (1 año después)
+    renewal_date = start_date + timedelta(days=365)
+    
+    # Obtener nombre de la empresa
+    business_name = ""
+    business = get_record('users', data['business_id'])
+    if business and business['user_type'] == 'business':
+        business_name = business.get('business_name', '')
+    
+    # Crear nueva suscripción
+    new_subscription = {
+        'id': str(uuid.uuid4()),
+        'business_id': data['business_id'],
+        'business_name': business_name,
+        'plan_name': data['plan_name'],
+        'start_date': data['start_date'],
+        'renewal_date': renewal_date.strftime('%Y-%m-%d'),
+        'status': data['status'],
+        'monthly_amount': data['monthly_amount'],
+        'payment_method': 'credit_card',  # Valor por defecto
+        'created_at': datetime.utcnow().isoformat()
+    }
+    
+    # Agregar a la base de datos
+    insert_record('subscriptions', new_subscription)
+    emit('new_subscription', f"{data['plan_name']} - {business_name}" if business_name else data['plan_name'],
+         subscription_id=new_subscription['id'], business_id=data['business_id'])
+    
+    return jsonify({
+        'message': 'Suscripción creada correctamente',
+        'subscription': new_subscription
+    }), 201
+    
     
 @app.route('/api/customer/subscription', methods=['GET'])
-def check_customer_subscription():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('customer')
+@conditional('subscriptions')
+def check_customer_subscription(payload):
+    # Verificar si el usuario tiene suscripciones activas
+    user_subscriptions = find_records('subscriptions', 'customer_id', payload['user_id'], status='active')
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'customer':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        # Verificar si el usuario tiene suscripciones activas
-        subscriptions = db.get('subscriptions', [])
-        user_subscriptions = [s for s in subscriptions 
-                            if s.get('customer_id') == payload['user_id'] 
-                            and s.get('status') == 'active']
-        
-        return jsonify({
-            'hasSubscription': len(user_subscriptions) > 0,
-            'subscriptions': user_subscriptions
-        })
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+    return jsonify({
+        'hasSubscription': len(user_subscriptions) > 0,
+        'subscriptions': user_subscriptions
+    })
     
 @app.route('/api/business/financial-stats', methods=['GET'])
-def get_business_financial_stats():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
-    
-    token = auth_header.split(' ')[1]
+@require_role('business')
+def get_business_financial_stats(payload):
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
         # Obtener el rango de tiempo del query param (default: mensual)
         time_range = request.args.get('range', 'mensual')
         
-        # Datos simulados - en un sistema real esto vendría de la base de datos
-        # Basado en el business_id del usuario (payload['user_id'])
+        stats = get_financial_stats(payload['user_id'], time_range)
         
-        # Datos para diferentes rangos de tiempo
-        data = {
-            'ingresos': {
-                'mensual': {
-                    'labels': ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul'],
-                    'data': [12000, 19000, 15000, 18000, 22000, 25000, 21000]
-                },
-                'trimestral': {
-                    'labels': ['Q1', 'Q2', 'Q3'],
-                    'data': [45000, 52000, 68000]
-                },
-                'anual': {
-                    'labels': ['2021', '2022', '2023'],
-                    'data': [250000, 280000, 310000]
-                }
+        # Todavía no se registran gastos: se mantienen los valores de referencia
+        gastos = {
+            'mensual': {
+                'labels': ['Suscripciones', 'Nóminas', 'Servicios', 'Otros'],
+                'data': [5000, 8000, 3000, 2000]
             },
-            'gastos': {
-                'mensual': {
-                    'labels': ['Suscripciones', 'Nóminas', 'Servicios', 'Otros'],
-                    'data': [5000, 8000, 3000, 2000]
-                },
-                'trimestral': {
-                    'labels': ['Suscripciones', 'Nóminas', 'Servicios', 'Otros'],
-                    'data': [15000, 24000, 9000, 6000]
-                },
-                'anual': {
-                    'labels': ['Suscripciones', 'Nóminas', 'Servicios', 'Otros'],
-                    'data': [60000, 96000, 36000, 24000]
-                }
+            'trimestral': {
+                'labels': ['Suscripciones', 'Nóminas', 'Servicios', 'Otros'],
+                'data': [15000, 24000, 9000, 6000]
             },
+            'anual': {
+                'labels': ['Suscripciones', 'Nóminas', 'Servicios', 'Otros'],
+                'data': [60000, 96000, 36000, 24000]
+            }
+        }[time_range]
+        
+        ingresos = sum(stats['ingresos'])
+        total_gastos = sum(gastos['data'])
+        colores = ['rgba(79, 70, 229, 0.7)', 'rgba(99, 102, 241, 0.7)', 'rgba(129, 140, 248, 0.7)',
+                   'rgba(165, 180, 252, 0.7)']
+        planes = sorted(stats['planes'].items(), key=lambda p: -p[1])
+        
+        return jsonify({
+            'ingresos': {'labels': stats['labels'], 'data': stats['ingresos']},
+            'gastos': gastos,
             'resumen': {
-                'mensual': {
-                    'ingresos': sum([12000, 19000, 15000, 18000, 22000, 25000, 21000]),
-                    'gastos': sum([5000, 8000, 3000, 2000]),
-                    'beneficio': sum([12000, 19000, 15000, 18000, 22000, 25000, 21000]) - sum([5000, 8000, 3000, 2000]),
-                    'margen': ((sum([12000, 19000, 15000, 18000, 22000, 25000, 21000]) - sum([5000, 8000, 3000, 2000])) / 
-                              sum([12000, 19000, 15000, 18000, 22000, 25000, 21000])) * 100
-                },
-                'trimestral': {
-                    'ingresos': sum([45000, 52000, 68000]),
-                    'gastos': sum([15000, 24000, 9000, 6000]),
-                    'beneficio': sum([45000, 52000, 68000]) - sum([15000, 24000, 9000, 6000]),
-                    'margen': ((sum([45000, 52000, 68000]) - sum([15000, 24000, 9000, 6000])) / 
-                              sum([45000, 52000, 68000])) * 100
-                },
-                'anual': {
-                    'ingresos': sum([250000, 280000, 310000]),
-                    'gastos': sum([60000, 96000, 36000, 24000]),
-                    'beneficio': sum([250000, 280000, 310000]) - sum([60000, 96000, 36000, 24000]),
-                    'margen': ((sum([250000, 280000, 310000]) - sum([60000, 96000, 36000, 24000])) / 
-                              sum([250000, 280000, 310000])) * 100
-                }
+                'ingresos': ingresos,
+                'gastos': total_gastos,
+                'beneficio': ingresos - total_gastos,
+                'margen': (ingresos - total_gastos) / ingresos * 100 if ingresos else 0
             },
             'suscripciones': {
-                'total': 1245,
-                'activas': 892,
-                'canceladas': 353,
-                'crecimiento': 12.5,
+                'total': stats['total'],
+                'activas': stats['activas'],
+                'canceladas': stats['canceladas'],
+                'crecimiento': stats['crecimiento'],
                 'planes': [
-                    {'nombre': 'Básico', 'cantidad': 512, 'color': 'rgba(79, 70, 229, 0.7)'},
-                    {'nombre': 'Premium', 'cantidad': 380, 'color': 'rgba(99, 102, 241, 0.7)'},
-                    {'nombre': 'Empresarial', 'cantidad': 353, 'color': 'rgba(129, 140, 248, 0.7)'}
+                    {'nombre': nombre, 'cantidad': cantidad, 'color': colores[i % len(colores)]}
+                    for i, (nombre, cantidad) in enumerate(planes)
                 ],
-                'tendencia': [65, 59, 80, 81, 56, 55, 90]
-            }
-        }
-        
-        return jsonify({
-            'ingresos': data['ingresos'][time_range],
-            'gastos': data['gastos'][time_range],
-            'resumen': data['resumen'][time_range],
-            'suscripciones': data['suscripciones'],
+                'tendencia': stats['tendencia'],
+                'nuevas': stats['nuevas'],
+                'bajas': stats['bajas']
+            },
             'time_range': time_range
         })
         
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
     except KeyError:
         return jsonify({'error': 'Rango de tiempo no válido'}), 400
     
 @app.route('/api/business/plans', methods=['GET'])
-def get_business_plans():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+@conditional('subscription_plans:tenant')
+def get_business_plans(payload):
+    business_id = payload['user_id']
+    
+    # Filtrar planes por business_id
+    plans = find_records('subscription_plans', 'business_id', business_id)
+    
+    return jsonify({'plans': plans})
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        business_id = payload['user_id']
-        
-        # Filtrar planes por business_id (en un sistema real)
-        # Aquí simulamos que todos los planes pertenecen a la empresa actual
-        plans = db.get('subscription_plans', [])
-        
-        return jsonify({'plans': plans})
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/business/plans', methods=['POST'])
-def create_business_plan():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+def create_business_plan(payload):
+    data = request.get_json()
+    
+    # Validar datos requeridos
+    required_fields = ['nombre', 'precio', 'moneda', 'periodo', 'descripcion']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'Falta el campo requerido: {field}'}), 400
+    
+    # Validar precio positivo
+    if not isinstance(data['precio'], (int, float)) or data['precio'] <= 0:
+        return jsonify({'error': 'El precio debe ser un número positivo'}), 400
+    
+    new_plan = {
+        'id': str(uuid.uuid4()),
+        'business_id': payload['user_id'],
+        'nombre': data['nombre'],
+        'precio': data['precio'],
+        'moneda': data['moneda'],
+        'periodo': data['periodo'],
+        'descripcion': data['descripcion'],
+        'caracteristicas': data.get('caracteristicas', []),
+        'estado': data.get('estado', 'activo'),
+        'created_at': datetime.utcnow().isoformat()
+    }
+    
+    insert_record('subscription_plans', new_plan)
+    emit('new_plan', new_plan['nombre'], plan_id=new_plan['id'], business_id=payload['user_id'])
+    
+    return jsonify({
+        'message': 'Plan creado correctamente',
+        'plan': new_plan
+    }), 201
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        
-        # Validar datos requeridos
-        required_fields = ['nombre', 'precio', 'moneda', 'periodo', 'descripcion']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Falta el campo requerido: {field}'}), 400
-        
-        # Validar precio positivo
-        if not isinstance(data['precio'], (int, float)) or data['precio'] <= 0:
-            return jsonify({'error': 'El precio debe ser un número positivo'}), 400
-        
-        db = get_db()
-        if 'subscription_plans' not in db:
-            db['subscription_plans'] = []
-            
-        new_plan = {
-            'id': str(uuid.uuid4()),
-            'business_id': payload['user_id'],
-            'nombre': data['nombre'],
-            'precio': data['precio'],
-            'moneda': data['moneda'],
-            'periodo': data['periodo'],
-            'descripcion': data['descripcion'],
-            'caracteristicas': data.get('caracteristicas', []),
-            'estado': data.get('estado', 'activo'),
-            'created_at': datetime.utcnow().isoformat()
-        }
-        
-        db['subscription_plans'].append(new_plan)
-        save_db()
-        
-        return jsonify({
-            'message': 'Plan creado correctamente',
-            'plan': new_plan
-        }), 201
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/business/plans/<plan_id>', methods=['PUT'])
-def update_business_plan(plan_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+def update_business_plan(plan_id, payload):
+    data = request.get_json()
+    
+    # Buscar y actualizar plan
+    plan = get_record('subscription_plans', plan_id)
+    if plan and plan['business_id'] == payload['user_id']:
+        changes = {}
+        if 'nombre' in data:
+            changes['nombre'] = data['nombre']
+        if 'precio' in data:
+            if not isinstance(data['precio'], (int, float)) or data['precio'] <= 0:
+                return jsonify({'error': 'El precio debe ser un número positivo'}), 400
+            changes['precio'] = data['precio']
+        if 'moneda' in data:
+            changes['moneda'] = data['moneda']
+        if 'periodo' in data:
+            changes['periodo'] = data['periodo']
+        if 'descripcion' in data:
+            changes['descripcion'] = data['descripcion']
+        if 'caracteristicas' in data:
+            changes['caracteristicas'] = data['caracteristicas']
+        if 'estado' in data:
+            changes['estado'] = data['estado']
+        
+        plan = update_record('subscription_plans', plan_id, changes)
+        emit('plan_updated', plan['nombre'], plan_id=plan_id, business_id=payload['user_id'])
+        return jsonify({
+            'message': 'Plan actualizado correctamente',
+            'plan': plan
+        })
+    
+    return jsonify({'error': 'Plan no encontrado'}), 404
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        
-        db = get_db()
-        plans = db.get('subscription_plans', [])
-        
-        # Buscar y actualizar plan
-        for plan in plans:
-            if plan['id'] == plan_id and plan['business_id'] == payload['user_id']:
-                if 'nombre' in data:
-                    plan['nombre'] = data['nombre']
-                if 'precio' in data:
-                    if not isinstance(data['precio'], (int, float)) or data['precio'] <= 0:
-                        return jsonify({'error': 'El precio debe ser un número positivo'}), 400
-                    plan['precio'] = data['precio']
-                if 'moneda' in data:
-                    plan['moneda'] = data['moneda']
-                if 'periodo' in data:
-                    plan['periodo'] = data['periodo']
-                if 'descripcion' in data:
-                    plan['descripcion'] = data['descripcion']
-                if 'caracteristicas' in data:
-                    plan['caracteristicas'] = data['caracteristicas']
-                if 'estado' in data:
-                    plan['estado'] = data['estado']
-                
-                save_db()
-                return jsonify({
-                    'message': 'Plan actualizado correctamente',
-                    'plan': plan
-                })
-        
-        return jsonify({'error': 'Plan no encontrado'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/business/plans/<plan_id>', methods=['DELETE'])
-def delete_business_plan(plan_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+def delete_business_plan(plan_id, payload):
+    # Buscar y eliminar plan
+    plan = get_record('subscription_plans', plan_id)
+    if plan and plan['business_id'] == payload['user_id']:
+        delete_record('subscription_plans', plan_id)
+        emit('plan_deleted', plan['nombre'], plan_id=plan_id, business_id=payload['user_id'])
+        return jsonify({'message': 'Plan eliminado correctamente'})
+    
+    return jsonify({'error': 'Plan no encontrado'}), 404
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        plans = db.get('subscription_plans', [])
-        
-        # Buscar y eliminar plan
-        for i, plan in enumerate(plans):
-            if plan['id'] == plan_id and plan['business_id'] == payload['user_id']:
-                del plans[i]
-                save_db()
-                return jsonify({'message': 'Plan eliminado correctamente'})
-        
-        return jsonify({'error': 'Plan no encontrado'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/business/plans/<plan_id>/toggle-status', methods=['PUT'])
-def toggle_business_plan_status(plan_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+def toggle_business_plan_status(plan_id, payload):
+    # Buscar y cambiar estado del plan
+    plan = get_record('subscription_plans', plan_id)
+    if plan and plan['business_id'] == payload['user_id']:
+        plan = update_record('subscription_plans', plan_id, {
+            'estado': 'activo' if plan['estado'] == 'inactivo' else 'inactivo'
+        })
+        emit('plan_status', f"{plan['nombre']}: {plan['estado']}", plan_id=plan_id,
+             business_id=payload['user_id'])
+        return jsonify({
+            'message': 'Estado del plan actualizado',
+            'plan': plan
+        })
+    
+    return jsonify({'error': 'Plan no encontrado'}), 404
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        plans = db.get('subscription_plans', [])
-        
-        # Buscar y cambiar estado del plan
-        for plan in plans:
-            if plan['id'] == plan_id and plan['business_id'] == payload['user_id']:
-                plan['estado'] = 'activo' if plan['estado'] == 'inactivo' else 'inactivo'
-                save_db()
-                return jsonify({
-                    'message': 'Estado del plan actualizado',
-                    'plan': plan
-                })
-        
-        return jsonify({'error': 'Plan no encontrado'}), 404
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
     
 @app.route('/api/business/subscribers', methods=['GET'])
-def get_business_subscribers():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+@conditional('subscriptions:tenant', 'subscription_plans:tenant', 'users')
+def get_business_subscribers(payload):
+    # Obtener parámetros de filtrado
+    status_filter = request.args.get('status', 'all')
+    search_query = request.args.get('search', '')
+    
+    business_id = payload['user_id']
+    
+    # Filtrar suscriptores por business_id y estado; la búsqueda usa el
+    # índice de nombre y email de los clientes de la empresa
+    if search_query:
+        subscriptions = search_subscribers(business_id, search_query,
+                                           None if status_filter == 'all' else status_filter)
+    elif status_filter == 'all':
+        subscriptions = find_records('subscriptions', 'business_id', business_id)
+    else:
+        subscriptions = find_records('subscriptions', 'business_id', business_id, status=status_filter)
+    
+    # Obtener planes de la empresa
+    business_plans = find_records('subscription_plans', 'business_id', business_id)
+    plans_dict = {p['id']: p for p in business_plans}
+    
+    subscribers = []
+    for sub in subscriptions:
+        user = get_record('users', sub.get('customer_id'))
+        plan = plans_dict.get(sub.get('plan_id'))
+        
+        if user and user['user_type'] == 'customer' and plan:
+            subscriber_data = {
+                'id': sub['id'],
+                'customer_id': sub['customer_id'],
+                'nombre': user['name'],
+                'email': user['email'],
+                'telefono': user.get('phone', ''),
+                'plan_id': sub['plan_id'],
+                'plan': plan['nombre'],
+                'fechaInicio': sub['start_date'],
+                'proximoPago': sub['renewal_date'],
+                'estado': sub['status'],
+                'metodoPago': sub['payment_method'],
+                'created_at': sub['created_at']
+            }
+            subscribers.append(subscriber_data)
+    
+    # Ordenar por fecha de creación (más recientes primero)
+    subscribers.sort(key=lambda x: x['created_at'], reverse=True)
+    
+    return jsonify({'subscribers': subscribers})
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        # Obtener parámetros de filtrado
-        status_filter = request.args.get('status', 'all')
-        search_query = request.args.get('search', '')
-        
-        db = get_db()
-        business_id = payload['user_id']
-        
-        # Filtrar suscriptores por business_id y estado
-        subscriptions = db.get('subscriptions', [])
-        users = db.get('users', [])
-        
-        # Crear diccionario de usuarios para búsqueda rápida
-        users_dict = {u['id']: u for u in users if u['user_type'] == 'customer'}
-        
-        # Obtener planes de la empresa
-        business_plans = [p for p in db.get('subscription_plans', []) 
-                         if p['business_id'] == business_id]
-        plans_dict = {p['id']: p for p in business_plans}
-        
-        subscribers = []
-        for sub in subscriptions:
-            if sub['business_id'] == business_id:
-                user = users_dict.get(sub['customer_id'])
-                plan = plans_dict.get(sub['plan_id'])
-                
-                if user and plan:
-                    subscriber_data = {
-                        'id': sub['id'],
-                        'customer_id': sub['customer_id'],
-                        'nombre': user['name'],
-                        'email': user['email'],
-                        'telefono': user.get('phone', ''),
-                        'plan_id': sub['plan_id'],
-                        'plan': plan['nombre'],
-                        'fechaInicio': sub['start_date'],
-                        'proximoPago': sub['renewal_date'],
-                        'estado': sub['status'],
-                        'metodoPago': sub['payment_method'],
-                        'created_at': sub['created_at']
-                    }
-                    
-                    # Aplicar filtros
-                    if status_filter == 'all' or sub['status'] == status_filter:
-                        if search_query.lower() in user['name'].lower() or \
-                           search_query.lower() in user['email'].lower():
-                            subscribers.append(subscriber_data)
-        
-        # Ordenar por fecha de creación (más recientes primero)
-        subscribers.sort(key=lambda x: x['created_at'], reverse=True)
-        
-        return jsonify({'subscribers': subscribers})
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/business/subscribers/<subscriber_id>', methods=['GET'])
-def get_subscriber_details(subscriber_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+@conditional('subscriptions:tenant', 'subscription_plans', 'users')
+def get_subscriber_details(subscriber_id, payload):
+    business_id = payload['user_id']
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        business_id = payload['user_id']
-        
-        # Buscar la suscripción
-        subscription = next((s for s in db.get('subscriptions', []) 
-                          if s['id'] == subscriber_id and s['business_id'] == business_id), None)
-        
-        if not subscription:
-            return jsonify({'error': 'Suscripción no encontrada'}), 404
-            
-        # Obtener datos del usuario
-        user = next((u for u in db.get('users', []) 
-                    if u['id'] == subscription['customer_id'] and u['user_type'] == 'customer'), None)
-        
-        if not user:
-            return jsonify({'error': 'Usuario no encontrado'}), 404
-            
-        # Obtener datos del plan
-        plan = next((p for p in db.get('subscription_plans', []) 
-                   if p['id'] == subscription['plan_id']), None)
+    # Buscar la suscripción
+    subscription = get_record('subscriptions', subscriber_id)
+    
+    if not subscription or subscription['business_id'] != business_id:
+        return jsonify({'error': 'Suscripción no encontrada'}), 404
         
-        if not plan:
-            return jsonify({'error': 'Plan no encontrado'}), 404
-            
-        # Datos completos del suscriptor
-        subscriber_data = {
-            'id': subscription['id'],
-            'customer_id': user['id'],
-            'nombre': user['name'],
-            'email': user['email'],
-            'telefono': user.get('phone', ''),
-            'plan_id': plan['id'],
-            'plan': plan['nombre'],
-            'descripcion_plan': plan['descripcion'],
-            'caracteristicas_plan': plan['caracteristicas'],
-            'fechaInicio': subscription['start_date'],
-            'proximoPago': subscription['renewal_date'],
-            'estado': subscription['status'],
-            'metodoPago': subscription['payment_method'],
-            'monto': subscription.get('monthly_amount', plan['precio']),
-            'moneda': plan['moneda'],
-            'periodo': plan['periodo'],
-            'created_at': subscription['created_at'],
-            'historial_pagos': []  # En un sistema real, esto vendría de otra tabla
-        }
+    # Obtener datos del usuario
+    user = get_record('users', subscription.get('customer_id'))
+    
+    if not user or user['user_type'] != 'customer':
+        return jsonify({'error': 'Usuario no encontrado'}), 404
         
-        return jsonify({'subscriber': subscriber_data})
+    # Obtener datos del plan
+    plan = get_record('subscription_plans', subscription.get('plan_id'))
+    
+    if not plan:
+        return jsonify({'error': 'Plan no encontrado'}), 404
         
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+    # Datos completos del suscriptor
+    subscriber_data = {
+        'id': subscription['id'],
+        'customer_id': user['id'],
+        'nombre': user['name'],
+        'email': user['email'],
+        'telefono': user.get('phone', ''),
+        'plan_id': plan['id'],
+        'plan': plan['nombre'],
+        'descripcion_plan': plan['descripcion'],
+        'caracteristicas_plan': plan['caracteristicas'],
+        'fechaInicio': subscription['start_date'],
+        'proximoPago': subscription['renewal_date'],
+        'estado': subscription['status'],
+        'metodoPago': subscription['payment_method'],
+        'monto': subscription.get('monthly_amount', plan['precio']),
+        'moneda': plan['moneda'],
+        'periodo': plan['periodo'],
+        'created_at': subscription['created_at'],
+        'historial_pagos': []  # En un sistema real, esto vendría de otra tabla
+    }
+    
+    return jsonify({'subscriber': subscriber_data})
+    
 
 @app.route('/api/business/subscribers/<subscriber_id>/status', methods=['PUT'])
-def update_subscriber_status(subscriber_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+def update_subscriber_status(subscriber_id, payload):
+    data = request.get_json()
+    new_status = data.get('status')
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        new_status = data.get('status')
-        
-        if new_status not in ['active', 'cancelled']:
-            return jsonify({'error': 'Estado no válido'}), 400
-        
-        db = get_db()
-        business_id = payload['user_id']
-        
-        # Buscar y actualizar suscripción
-        for sub in db.get('subscriptions', []):
-            if sub['id'] == subscriber_id and sub['business_id'] == business_id:
-                sub['status'] = new_status
-                save_db()
-                
-                # En un sistema real, aquí podrías registrar el cambio de estado
-                return jsonify({
-                    'message': f'Estado actualizado a {new_status}',
-                    'subscriber': {
-                        'id': sub['id'],
-                        'status': sub['status']
-                    }
-                })
-        
-        return jsonify({'error': 'Suscripción no encontrada'}), 404
+    if new_status not in ['active', 'cancelled']:
+        return jsonify({'error': 'Estado no válido'}), 400
+    
+    business_id = payload['user_id']
+    
+    # Buscar y actualizar suscripción
+    sub = get_record('subscriptions', subscriber_id)
+    if sub and sub['business_id'] == business_id:
+        changes = {'status': new_status}
+        changes.update(_cancellation_changes(sub, new_status))
+        sub = update_record('subscriptions', subscriber_id, changes)
+        emit('subscription_status', f"{sub.get('plan_name', '')}: {new_status}",
+             subscription_id=subscriber_id, business_id=business_id)
         
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+        return jsonify({
+            'message': f'Estado actualizado a {new_status}',
+            'subscriber': {
+                'id': sub['id'],
+                'status': sub['status']
+            }
+        })
+    
+    return jsonify({'error': 'Suscripción no encontrada'}), 404
+    
 
 @app.route('/api/business/subscribers/export', methods=['GET'])
-def export_subscribers():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('business')
+def export_subscribers(payload):
+    business_id = payload['user_id']
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'business':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        business_id = payload['user_id']
-        
-        # Obtener todos los suscriptores de la empresa
-        subscriptions = [s for s in db.get('subscriptions', []) 
-                        if s['business_id'] == business_id]
-        users = {u['id']: u for u in db.get('users', []) if u['user_type'] == 'customer'}
-        plans = {p['id']: p for p in db.get('subscription_plans', []) 
-                if p['business_id'] == business_id}
-        
-        # Preparar datos para exportación
-        export_data = []
-        for sub in subscriptions:
-            user = users.get(sub['customer_id'])
-            plan = plans.get(sub['plan_id'])
+    # Formato de la exportación: json (por defecto), csv, ndjson o xlsx
+    export_format = request.args.get('format', 'json')
+    plans = {p['id']: p for p in find_records('subscription_plans', 'business_id', business_id)}
+    columns = ['Nombre', 'Email', 'Teléfono', 'Plan', 'Estado', 'Fecha Inicio', 'Próximo Pago',
+               'Método de Pago', 'Monto']
+    
+    def rows():
+        # Se recorren las suscripciones de la empresa a medida que se envían
+        for sub in iter_records('subscriptions', 'business_id', business_id):
+            user = get_record('users', sub.get('customer_id'))
+            plan = plans.get(sub.get('plan_id'))
             
-            if user and plan:
-                export_data.append({
+            if user and user['user_type'] == 'customer' and plan:
+                yield {
                     'Nombre': user['name'],
                     'Email': user['email'],
                     'Teléfono': user.get('phone', ''),
@@ -1318,52 +971,34 @@ def export_subscribers():
                     'Próximo Pago': sub['renewal_date'],
                     'Método de Pago': sub['payment_method'],
                     'Monto': f"{plan['precio']} {plan['moneda']}"
-                })
-        
-        # En un sistema real, podrías generar un CSV o Excel aquí
-        # Por simplicidad, devolvemos los datos como JSON
-        return jsonify({
-            'message': 'Datos listos para exportación',
-            'format': 'csv',  # Podría ser 'excel' o 'pdf' en un sistema real
-            'data': export_data,
-            'count': len(export_data)
-        })
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
-    
-@app.route('/api/businesses/<business_id>', methods=['GET'])
-def get_business_details_public(business_id):
-    # Esta ruta es pública pero podrías querer validar el token para usuarios autenticados
-    auth_header = request.headers.get('Authorization')
+                }
     
-    # Verificar token si está presente, pero no requerirlo
-    if auth_header and auth_header.startswith('Bearer '):
-        try:
-            token = auth_header.split(' ')[1]
-            jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            # Token válido, pero no necesitamos hacer nada especial en este caso
-        except:
-            # Token inválido o expirado, pero permitimos continuar ya que es una ruta pública
-            pass
+    try:
+        return export_response(export_format, columns, rows(), 'suscriptores',
+                               message='Datos listos para exportación')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    db = get_db()
     
+@app.route('/api/businesses/<business_id>', methods=['GET'])
+def get_business_details_public(business_id):
+    # Ruta pública: la ficha es la misma con o sin token, así que no se
+    # verifica y se sirve desde el cache del catálogo
+    response = catalog_response(business_id, render_business_public)
+    if response is None:
+        return jsonify({'error': 'Empresa no encontrada'}), 404
+    return response
+
+def render_business_public(business_id):
     # Buscar empresa
-    business = None
-    for u in db['users']:
-        if u['id'] == business_id and u['user_type'] == 'business':
-            business = u
-            break
+    business = get_record('users', business_id)
     
-    if not business:
-        return jsonify({'error': 'Empresa no encontrada'}), 404
+    if not business or business['user_type'] != 'business':
+        return None
     
-    # Obtener planes de la empresa
-    plans = [p for p in db.get('subscription_plans', []) 
-             if p['business_id'] == business_id and p.get('estado', 'activo') == 'activo']
+    # Obtener planes activos de la empresa (sin estado cuenta como activo)
+    plans = [p for p in find_records('subscription_plans', 'business_id', business_id)
+             if p.get('estado', 'activo') == 'activo']
     
     # Formatear respuesta
     business_data = {
@@ -1386,123 +1021,95 @@ def get_business_details_public(business_id):
         } for p in plans]
     }
     
-    return jsonify({'business': business_data})
+    return app.json.dumps({'business': business_data}).encode('utf-8')
 
 # Configuración del sistema
 @app.route('/api/admin/settings', methods=['GET'])
-def get_system_settings():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+@conditional('system_settings')
+def get_system_settings(payload):
+    # Obtener o inicializar configuración del sistema
+    settings = get_settings()
+    if settings is None:
+        settings = update_settings({
+            'system_name': 'Suscridash',
+            'currency': 'CLP',
+            'logo_url': '',
+            'session_timeout': 30,  # minutos
+            'email_notifications': True,
+            'app_notifications': True,
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat()
+        })
+    
+    return jsonify({'settings': settings})
     
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        db = get_db()
-        
-        # Obtener o inicializar configuración del sistema
-        if 'system_settings' not in db:
-            db['system_settings'] = {
-                'system_name': 'Suscridash',
-                'currency': 'CLP',
-                'logo_url': '',
-                'session_timeout': 30,  # minutos
-                'email_notifications': True,
-                'app_notifications': True,
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat()
-            }
-            save_db()
-        
-        return jsonify({'settings': db['system_settings']})
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
 
 @app.route('/api/admin/settings', methods=['PUT'])
-def update_system_settings():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Token no proporcionado'}), 401
+@require_role('admin')
+def update_system_settings(payload):
+    data = request.get_json()
+    
+    # Validar datos de entrada con valores por defecto
+    if not data:
+        return jsonify({'error': 'Datos no proporcionados'}), 400
+    
+    # Establecer valores por defecto si no están presentes
+    system_name = data.get('system_name', 'Suscridash')
+    currency = data.get('currency', 'CLP')
     
-    token = auth_header.split(' ')[1]
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        if payload['user_type'] != 'admin':
-            return jsonify({'error': 'Acceso no autorizado'}), 403
-        
-        data = request.get_json()
-        
-        # Validar datos de entrada con valores por defecto
-        if not data:
-            return jsonify({'error': 'Datos no proporcionados'}), 400
-        
-        # Establecer valores por defecto si no están presentes
-        system_name = data.get('system_name', 'Suscridash')
-        currency = data.get('currency', 'CLP')
-        
-        try:
-            session_timeout = int(data.get('session_timeout', 30))
-            if session_timeout <= 0:
-                session_timeout = 30
-        except (ValueError, TypeError):
+        session_timeout = int(data.get('session_timeout', 30))
+        if session_timeout <= 0:
             session_timeout = 30
-        
-        db = get_db()
-        
-        # Inicializar si no existe
-        if 'system_settings' not in db:
-            db['system_settings'] = {
-                'system_name': 'Suscridash',
-                'currency': 'CLP',
-                'logo_url': '',
-                'session_timeout': 30,
-                'email_notifications': True,
-                'app_notifications': True,
-                'created_at': datetime.utcnow().isoformat()
-            }
-        
-        # Actualizar configuración solo con los campos proporcionados
-        updated_settings = {
-            'system_name': system_name,
-            'currency': currency,
-            'session_timeout': session_timeout,
-            'email_notifications': data.get('email_notifications', db['system_settings'].get('email_notifications', True)),
-            'app_notifications': data.get('app_notifications', db['system_settings'].get('app_notifications', True)),
-            'updated_at': datetime.utcnow().isoformat()
+    except (ValueError, TypeError):
+        session_timeout = 30
+    
+    # Inicializar si no existe
+    current_settings = get_settings()
+    if current_settings is None:
+        current_settings = {
+            'system_name': 'Suscridash',
+            'currency': 'CLP',
+            'logo_url': '',
+            'session_timeout': 30,
+            'email_notifications': True,
+            'app_notifications': True,
+            'created_at': datetime.utcnow().isoformat()
         }
-        
-        # Mantener el logo existente si no se proporciona uno nuevo
-        if 'logo_url' in data:
-            updated_settings['logo_url'] = data['logo_url']
-        elif 'logo_url' in db['system_settings']:
-            updated_settings['logo_url'] = db['system_settings']['logo_url']
-        else:
-            updated_settings['logo_url'] = ''
-        
-        # Mantener la fecha de creación original
-        if 'created_at' in db['system_settings']:
-            updated_settings['created_at'] = db['system_settings']['created_at']
-        else:
-            updated_settings['created_at'] = datetime.utcnow().isoformat()
-        
-        db['system_settings'] = updated_settings
-        save_db()
-        
-        return jsonify({
-            'message': 'Configuración actualizada correctamente',
-            'settings': db['system_settings']
-        })
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expirado'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Token inválido'}), 401
+    
+    # Actualizar configuración solo con los campos proporcionados
+    updated_settings = {
+        'system_name': system_name,
+        'currency': currency,
+        'session_timeout': session_timeout,
+        'email_notifications': data.get('email_notifications', current_settings.get('email_notifications', True)),
+        'app_notifications': data.get('app_notifications', current_settings.get('app_notifications', True)),
+        'updated_at': datetime.utcnow().isoformat()
+    }
+    
+    # Mantener el logo existente si no se proporciona uno nuevo
+    if 'logo_url' in data:
+        updated_settings['logo_url'] = data['logo_url']
+    elif 'logo_url' in current_settings:
+        updated_settings['logo_url'] = current_settings['logo_url']
+    else:
+        updated_settings['logo_url'] = ''
+    
+    # Mantener la fecha de creación original
+    if 'created_at' in current_settings:
+        updated_settings['created_at'] = current_settings['created_at']
+    else:
+        updated_settings['created_at'] = datetime.utcnow().isoformat()
+    
+    update_settings(updated_settings)
+    emit('settings_updated', system_name)
+    
+    return jsonify({
+        'message': 'Configuración actualizada correctamente',
+        'settings': updated_settings
+    })
+    
     
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -1,18 +1,34 @@
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from flask import current_app, request, jsonify
+import hashlib
+import os
+import threading
+import time
 import uuid
+import jwt
 
 # Importamos db después de definir las funciones para evitar circularidad
-from models import get_db, save_db
+from models import get_record, find_user, insert_record, subscribe
+from activity import emit
+from tracing import span
+
+# Cache de tokens ya verificados: hash del token -> payload. Los dashboards
+# disparan muchas llamadas en paralelo con el mismo token; las repetidas se
+# saltan la verificación HMAC y el parseo del payload. Es un LRU acotado, se
+# respeta el exp del token y se descartan los tokens de un usuario cuando este
+# se elimina (también si lo elimina otro worker, vía models.subscribe).
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_generation = 0
 
 def authenticate_user(email, password, user_type):
-    db = get_db()
-    
     # Buscar usuario por email y tipo
-    user = None
-    for u in db['users']:
-        if u['email'] == email and u['user_type'] == user_type:
-            user = u
-            break
+    user = find_user(email, user_type)
     
     if not user or user['password'] != password:
         return None
@@ -20,12 +36,9 @@ def authenticate_user(email, password, user_type):
     return user
 
 def register_user(user_data):
-    db = get_db()
-    
     # Verificar si el usuario ya existe
-    for user in db['users']:
-        if user['email'] == user_data['email'] and user['user_type'] == user_data['user_type']:
-            raise ValueError('El usuario ya existe')
+    if find_user(user_data['email'], user_data['user_type']):
+        raise ValueError('El usuario ya existe')
     
     # Crear nuevo usuario
     new_user = {
@@ -33,20 +46,88 @@ def register_user(user_data):
         'email': user_data['email'],
         'password': user_data['password'],  # O usar generate_password_hash para producción
         'name': user_data['name'],
-        'user_type': user_data['user_type']
+        'user_type': user_data['user_type'],
+        'created_at': datetime.utcnow().isoformat()
     }
     
     if user_data['user_type'] == 'business':
         new_user['business_name'] = user_data['business_name']
         new_user['tax_id'] = user_data['tax_id']
     
-    db['users'].append(new_user)
-    save_db()  # Guarda los cambios en el archivo
+    insert_record('users', new_user)  # Registra el cambio en el journal
+    if new_user['user_type'] == 'business':
+        emit('new_business', new_user['business_name'], business_id=new_user['id'])
+    else:
+        emit('user_signup', new_user['email'], user_id=new_user['id'])
     return new_user
 
 def get_current_user(user_id):
-    db = get_db()
-    for user in db['users']:
-        if user['id'] == user_id:
-            return user
-    return None
\ No newline at end of file
+    return get_record('users', user_id)
+
+def decode_token(token):
+    # Como jwt.decode, pero con cache. Lanza las mismas excepciones de jwt; el
+    # token de un usuario que ya no existe es inválido.
+    with span('auth.decode_token') as current:
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        with _token_cache_lock:
+            payload = _token_cache.get(key)
+            if payload is not None:
+                _token_cache.move_to_end(key)
+        if payload is not None:
+            exp = payload.get('exp')
+            if exp is None or exp > time.time():
+                current.set_attribute('cached', True)
+                return payload
+            with _token_cache_lock:
+                _token_cache.pop(key, None)
+
+        generation = _token_cache_generation
+        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        if get_record('users', payload.get('user_id')) is None:
+            raise jwt.InvalidTokenError('Usuario no encontrado')
+        with _token_cache_lock:
+            # Si se eliminó un usuario mientras tanto, no se guarda: podría ser este
+            if generation == _token_cache_generation:
+                _token_cache[key] = payload
+                if len(_token_cache) > TOKEN_CACHE_SIZE:
+                    _token_cache.popitem(last=False)
+        return payload
+
+def require_role(*roles):
+    # Exige un Bearer token válido y, si se indican roles, que su user_type sea
+    # uno de ellos. El payload del token llega al handler como payload=.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            auth_header = request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Bearer '):
+                return jsonify({'error': 'Token no proporcionado'}), 401
+
+            token = auth_header.split(' ')[1]
+            try:
+                payload = decode_token(token)
+            except jwt.ExpiredSignatureError:
+                return jsonify({'error': 'Token expirado'}), 401
+            except jwt.InvalidTokenError:
+                return jsonify({'error': 'Token inválido'}), 401
+            if roles and payload.get('user_type') not in roles:
+                return jsonify({'error': 'Acceso no autorizado'}), 403
+            return view(*args, payload=payload, **kwargs)
+        return wrapper
+    return decorator
+
+def _on_change(collection, old, new):
+    global _token_cache_generation
+    if collection == 'users' and new is None:
+        with _token_cache_lock:
+            _token_cache_generation += 1
+            for key in [k for k, p in _token_cache.items() if p.get('user_id') == old['id']]:
+                del _token_cache[key]
+
+def _on_reload():
+    global _token_cache_generation
+    with _token_cache_lock:
+        _token_cache_generation += 1
+        _token_cache.clear()
+
+subscribe(_on_change, _on_reload)
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Verificación de escrituras concurrentes entre procesos, como los workers de
+# gunicorn: --processes procesos registran --per-process usuarios cada uno
+# sobre la misma base y al final se comprueba, desde un proceso nuevo, que
+# no se perdió ninguno. Se prueba con y sin journal (DB_JOURNAL), y con y
+# sin group commit (DB_FLUSH_INTERVAL).
+#   python -m bench.concurrency
+#   python -m bench.concurrency --modes snapshot --processes 8 --per-process 100
+#
+# Termina con código 1 si en algún modo faltan usuarios.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modo -> variables de entorno
+MODES = {
+    'journal': {'DB_JOURNAL': '1'},
+    'snapshot': {'DB_JOURNAL': '0'},
+    'group-commit': {'DB_JOURNAL': '1', 'DB_FLUSH_INTERVAL': '0.05'},
+    'snapshot-group-commit': {'DB_JOURNAL': '0', 'DB_FLUSH_INTERVAL': '0.05'},
+}
+
+def worker(index, per_process, start_file):
+    # En el proceso hijo: espera la señal de inicio para que todos escriban
+    # a la vez
+    sys.path.insert(0, BACKEND_DIR)
+    import models
+    from auth import register_user
+
+    models.init_db()
+    while not os.path.exists(start_file):
+        time.sleep(0.01)
+    for i in range(per_process):
+        models.refresh_db()
+        register_user({'email': f'concurrencia{index}-{i}@ejemplo.cl', 'password': 'x',
+                       'name': 'Concurrencia', 'user_type': 'customer'})
+    models.sync_db()
+
+def count():
+    # En un proceso nuevo: usuarios creados por los workers
+    sys.path.insert(0, BACKEND_DIR)
+    import models
+
+    return sum(1 for user in models.list_records('users') if user['email'].startswith('concurrencia'))
+
+def run_mode(mode, args):
+    data_dir = tempfile.mkdtemp(prefix='suscridash-concurrency-')
+    try:
+        env = dict(os.environ, DB_FILE=os.path.join(data_dir, 'db.json'), DB_BACKEND='json', **MODES[mode])
+        start_file = os.path.join(data_dir, 'start')
+        # Una primera carga crea la base, así los workers no compiten por sembrarla
+        subprocess.run([sys.executable, '-m', 'bench.concurrency', '--count'], cwd=BACKEND_DIR, env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        started = time.perf_counter()
+        workers = [subprocess.Popen([sys.executable, '-m', 'bench.concurrency', '--worker', str(index),
+                                     '--per-process', str(args.per_process), '--start-file', start_file],
+                                    cwd=BACKEND_DIR, env=env)
+                   for index in range(args.processes)]
+        open(start_file, 'w').close()
+        failed = sum(1 for process in workers if process.wait() != 0)
+        elapsed = time.perf_counter() - started
+        output = subprocess.run([sys.executable, '-m', 'bench.concurrency', '--count'], cwd=BACKEND_DIR, env=env,
+                                check=True, stdout=subprocess.PIPE).stdout
+        return {
+            'expected': args.processes * args.per_process,
+            'found': json.loads(output),
+            'failed_workers': failed,
+            'seconds': round(elapsed, 2),
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Escrituras concurrentes desde varios procesos')
+    parser.add_argument('--modes', default=','.join(MODES), help='Modos separados por coma: ' + ', '.join(MODES))
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--per-process', type=int, default=40)
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--start-file', help=argparse.SUPPRESS)
+    parser.add_argument('--count', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        worker(args.worker, args.per_process, args.start_file)
+        return
+    if args.count:
+        print(count())
+        return
+
+    results = {}
+    for mode in args.modes.split(','):
+        results[mode] = run_mode(mode, args)
+        result = results[mode]
+        print(f'{mode:<22} {result["found"]}/{result["expected"]} usuarios en {result["seconds"]} s',
+              file=sys.stderr)
+    print(json.dumps(results, indent=2))
+    if any(r['found'] != r['expected'] or r['failed_workers'] for r in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
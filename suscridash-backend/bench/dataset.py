@@ -0,0 +1,162 @@
+import json
+import os
+import random
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+# Dataset sintético con la forma de db_simulada.json, para benchmarks. Es
+# determinista: la misma semilla da los mismos ids, emails y contraseñas
+# (empresa{i}/empresa{i}, cliente{i}/cliente{i}), que es lo que usa
+# bench.load para iniciar sesión.
+#   python -m bench.dataset --businesses 200 --customers 50000 --subscriptions 200000 > big.json
+#   python -m bench.dataset --businesses 10000 --customers 200000 --subscriptions 1000000 \
+#       --backend sqlite --output bench.sqlite3
+
+STATUSES = ['active'] * 8 + ['cancelled', 'pending']
+PAYMENT_METHODS = ['Visa **** 4242', 'Mastercard **** 5555', 'Transferencia bancaria']
+
+def generate_dataset(businesses=50, customers=5000, subscriptions=20000, plans_per_business=3, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+
+    def created_at():
+        return (start + timedelta(seconds=rng.randrange(2 * 365 * 86400))).isoformat()
+
+    def new_id():
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    users = [{
+        'id': '1',
+        'email': 'admin@suscridash.cl',
+        'password': 'admin123',
+        'name': 'Administrador',
+        'user_type': 'admin',
+        'created_at': '2023-01-01T00:00:00'
+    }]
+    business_users = []
+    for i in range(businesses):
+        business = {
+            'id': new_id(),
+            'email': f'empresa{i}@ejemplo.cl',
+            'password': f'empresa{i}',
+            'name': f'Empresa {i}',
+            'user_type': 'business',
+            'business_name': f'Empresa {i} SpA',
+            'tax_id': f'{rng.randrange(10000000, 99999999)}-{rng.randrange(10)}',
+            'subscriptions': 0,
+            'status': rng.choice(['active', 'active', 'active', 'pending', 'inactive']),
+            'created_at': created_at()
+        }
+        business_users.append(business)
+    customer_users = [{
+        'id': new_id(),
+        'email': f'cliente{i}@ejemplo.cl',
+        'password': f'cliente{i}',
+        'name': f'Cliente {i}',
+        'user_type': 'customer',
+        'created_at': created_at()
+    } for i in range(customers)]
+    users += business_users + customer_users
+
+    plans = []
+    for business in business_users:
+        for j in range(plans_per_business):
+            precio = rng.choice([4990, 9900, 19900, 29900])
+            plans.append({
+                'id': new_id(),
+                'business_id': business['id'],
+                'nombre': f'Plan {j + 1}',
+                'precio': precio,
+                'moneda': 'CLP',
+                'periodo': 'mes',
+                'descripcion': f'Plan {j + 1} de {business["business_name"]}',
+                'caracteristicas': ['Soporte por email', 'Acceso básico'][:j + 1],
+                'estado': 'activo',
+                'created_at': created_at()
+            })
+
+    subs = []
+    for _ in range(subscriptions if plans and customer_users else 0):
+        plan = rng.choice(plans)
+        start_date = start + timedelta(days=rng.randrange(2 * 365))
+        sub = {
+            'id': new_id(),
+            'business_id': plan['business_id'],
+            'customer_id': rng.choice(customer_users)['id'],
+            'plan_id': plan['id'],
+            'start_date': start_date.date().isoformat(),
+            'renewal_date': (start_date + timedelta(days=30)).date().isoformat(),
+            'status': rng.choice(STATUSES),
+            'payment_method': rng.choice(PAYMENT_METHODS),
+            'monthly_amount': plan['precio'],
+            'created_at': start_date.isoformat()
+        }
+        if sub['status'] == 'cancelled':
+            sub['cancelled_at'] = (start_date + timedelta(days=rng.randrange(1, 180))).isoformat()
+        subs.append(sub)
+
+    return {
+        'users': users,
+        'subscriptions': subs,
+        'subscription_plans': plans,
+        'system_settings': {
+            'system_name': 'Suscridash',
+            'currency': 'CLP',
+            'logo_url': '',
+            'session_timeout': 30,
+            'email_notifications': True,
+            'app_notifications': True,
+            'created_at': '2023-01-01T00:00:00',
+            'updated_at': '2023-01-01T00:00:00'
+        }
+    }
+
+def write_dataset(data, path, backend='json', fmt='compact'):
+    # Deja data como la base de datos del backend: el snapshot DB_FILE (en el
+    # formato fmt, sin journal pendiente) o la base SQLITE_FILE, reemplazando
+    # lo que hubiera en path
+    import models
+
+    if backend == 'sqlite':
+        import storage_sqlite
+
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            f.write(models.encode_snapshot(data, 'compact'))
+        try:
+            storage_sqlite.SQLITE_FILE = path
+            storage_sqlite.migrate_from_json(f.name)
+        finally:
+            os.remove(f.name)
+        return
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(models.encode_snapshot(data, fmt))
+    os.replace(tmp_file, path)
+    if os.path.exists(path + '.journal'):
+        os.remove(path + '.journal')
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Genera un dataset sintético de Suscridash')
+    parser.add_argument('--businesses', type=int, default=50)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--subscriptions', type=int, default=20000)
+    parser.add_argument('--plans-per-business', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Base de datos a crear (sin --output, JSON a stdout)')
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--format', choices=['json', 'compact', 'columnar', 'msgpack'], default='compact',
+                        help='Formato del snapshot con --backend json')
+    args = parser.parse_args()
+    data = generate_dataset(args.businesses, args.customers, args.subscriptions,
+                            args.plans_per_business, seed=args.seed)
+    if args.output:
+        write_dataset(data, args.output, args.backend, args.format)
+    else:
+        json.dump(data, sys.stdout, separators=(',', ':'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Prueba de carga: arma un dataset sintético (bench.dataset), lo carga en el
+# backend elegido y reproduce una mezcla de las rutas reales durante
+# --duration segundos con --concurrency clientes. Informa throughput y
+# latencias p50/p95/p99 por ruta en JSON.
+#   python -m bench.load --businesses 200 --customers 20000 --subscriptions 100000
+#   python -m bench.load --backend sqlite --gunicorn --workers 4 --threads 2 --output load.json
+#   python -m bench.load --url http://127.0.0.1:8000   (servidor levantado con el mismo dataset)
+#
+# Sin --gunicorn ni --url las peticiones van a app.test_client() en este
+# mismo proceso: mide la aplicación sin red ni servidor de por medio.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ruta -> peso en la mezcla. Aproxima el uso del frontend: /api/auth/me en
+# cada carga de página, los listados de los paneles de administración y de
+# empresa, la ficha pública y de vez en cuando una exportación.
+MIX = {
+    'login': 4,
+    'me': 20,
+    'admin_stats': 4,
+    'admin_recent_businesses': 4,
+    'admin_businesses': 6,
+    'admin_users': 6,
+    'admin_subscriptions': 6,
+    'business_subscribers': 10,
+    'business_subscribers_search': 12,
+    'business_plans': 8,
+    'financial_stats': 10,
+    'export': 2,
+    'public_business': 8,
+}
+
+def percentile(values, p):
+    # values ordenados; percentil por rango más cercano
+    if not values:
+        return None
+    return values[max(0, min(len(values), -(-len(values) * p // 100)) - 1)]
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers, body=None):
+        response = self.client.open(path, method=method, headers=headers, json=body)
+        return response.status_code, response.get_data()
+
+class HTTPClient:
+    # Una conexión keep-alive por cliente; se reabre si el servidor la cierra
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.conn = None
+
+    def request(self, method, path, headers, body=None):
+        headers = dict(headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            try:
+                self.conn.request(method, path, data, headers)
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+def sign_in(client, args):
+    # Tokens de acceso del admin y de las primeras --accounts empresas y
+    # clientes del dataset
+    def login(email, password, user_type):
+        status, body = client.request('POST', '/api/auth/login', {}, {
+            'email': email, 'password': password, 'userType': user_type})
+        if status != 200:
+            raise RuntimeError(f'No se pudo iniciar sesión como {email} ({status})')
+        body = json.loads(body)
+        return body['access_token'], body['user']['id']
+
+    return {
+        'admin': login('admin@suscridash.cl', 'admin123', 'admin')[0],
+        'business': [login(f'empresa{i}@ejemplo.cl', f'empresa{i}', 'business')
+                     for i in range(min(args.businesses, args.accounts))],
+        'customer': [login(f'cliente{i}@ejemplo.cl', f'cliente{i}', 'customer')[0]
+                     for i in range(min(args.customers, args.accounts))],
+    }
+
+def next_request(rng, args, tokens):
+    # (ruta, método, path, headers, body) al azar según MIX
+    route = rng.choices(list(MIX), list(MIX.values()))[0]
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+    business_token, business_id = rng.choice(tokens['business'])
+    business = dict(headers, Authorization='Bearer ' + business_token)
+    admin = dict(headers, Authorization='Bearer ' + tokens['admin'])
+
+    if route == 'login':
+        i = rng.randrange(args.customers)
+        return route, 'POST', '/api/auth/login', headers, {
+            'email': f'cliente{i}@ejemplo.cl', 'password': f'cliente{i}', 'userType': 'customer'}
+    if route == 'me':
+        token = rng.choice(tokens['customer'] + [business_token])
+        return route, 'GET', '/api/auth/me', dict(headers, Authorization='Bearer ' + token), None
+    if route == 'admin_stats':
+        return route, 'GET', '/api/admin/stats', admin, None
+    if route == 'admin_recent_businesses':
+        return route, 'GET', '/api/admin/recent-businesses', admin, None
+    if route == 'admin_businesses':
+        return route, 'GET', '/api/admin/businesses?limit=50&sort=-created_at', admin, None
+    if route == 'admin_users':
+        return route, 'GET', '/api/admin/users?limit=50&sort=-created_at', admin, None
+    if route == 'admin_subscriptions':
+        return route, 'GET', '/api/admin/subscriptions?limit=50&sort=-created_at', admin, None
+    if route == 'business_subscribers':
+        status = rng.choice(['all', 'active', 'cancelled'])
+        return route, 'GET', f'/api/business/subscribers?status={status}', business, None
+    if route == 'business_subscribers_search':
+        return route, 'GET', f'/api/business/subscribers?search=cliente%20{rng.randrange(1, 1000)}', business, None
+    if route == 'business_plans':
+        return route, 'GET', '/api/business/plans', business, None
+    if route == 'financial_stats':
+        time_range = rng.choice(['mensual', 'trimestral', 'anual'])
+        return route, 'GET', f'/api/business/financial-stats?range={time_range}', business, None
+    if route == 'export':
+        export_format = rng.choice(['csv', 'ndjson', 'json'])
+        return route, 'GET', f'/api/business/subscribers/export?format={export_format}', business, None
+    return route, 'GET', f'/api/businesses/{business_id}', headers, None
+
+def drive(make_client, tokens, args):
+    # Corre la mezcla con args.concurrency hilos. Devuelve ({ruta: [latencias
+    # en segundos]}, {ruta: errores}, segundos transcurridos)
+    latencies = {route: [] for route in MIX}
+    errors = {route: 0 for route in MIX}
+    merge_lock = threading.Lock()
+    deadline = time.perf_counter() + args.warmup + args.duration
+    measure_from = time.perf_counter() + args.warmup
+
+    def worker(number):
+        rng = random.Random(args.seed * 1000 + number)
+        client = make_client()
+        own = {route: [] for route in MIX}
+        own_errors = {route: 0 for route in MIX}
+        while True:
+            route, method, path, headers, body = next_request(rng, args, tokens)
+            start = time.perf_counter()
+            if start >= deadline:
+                break
+            try:
+                status = client.request(method, path, headers, body)[0]
+            except (http.client.HTTPException, OSError):
+                status = None
+            end = time.perf_counter()
+            if start < measure_from:
+                continue
+            own[route].append(end - start)
+            if status is None or status >= 400:
+                own_errors[route] += 1
+        with merge_lock:
+            for route in MIX:
+                latencies[route].extend(own[route])
+                errors[route] += own_errors[route]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, args.duration
+
+def report(latencies, errors, elapsed):
+    def summary(values, error_count):
+        values = sorted(values)
+        ms = lambda value: None if value is None else round(value * 1000, 3)
+        return {
+            'requests': len(values),
+            'errors': error_count,
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'p50_ms': ms(percentile(values, 50)),
+            'p95_ms': ms(percentile(values, 95)),
+            'p99_ms': ms(percentile(values, 99)),
+            'max_ms': ms(values[-1] if values else None),
+        }
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        'total': summary(everything, sum(errors.values())),
+        'routes': {route: summary(values, errors[route]) for route, values in latencies.items() if values},
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(args, port):
+    # gunicorn como en start.sh, sobre la base de datos del benchmark
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+         '--threads', str(args.threads), '--timeout', '300', '--log-level', 'warning', 'app:app'],
+        cwd=BACKEND_DIR, env=os.environ.copy())
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn terminó al arrancar ({process.returncode})')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn no respondió a tiempo')
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la API de Suscridash')
+    parser.add_argument('--businesses', type=int, default=200)
+    parser.add_argument('--customers', type=int, default=20000)
+    parser.add_argument('--subscriptions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--data-dir', help='Directorio para la base generada (por defecto uno temporal)')
+    parser.add_argument('--url', help='Servidor ya levantado con el mismo dataset (no se genera la base)')
+    parser.add_argument('--gunicorn', action='store_true', help='Levantar gunicorn en vez de ir en proceso')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--startup-timeout', type=float, default=300)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='Segundos medidos')
+    parser.add_argument('--warmup', type=float, default=5, help='Segundos iniciales sin medir')
+    parser.add_argument('--accounts', type=int, default=50, help='Empresas y clientes con sesión iniciada')
+    parser.add_argument('--accept-encoding', default='gzip')
+    parser.add_argument('--output', help='Archivo para el resultado JSON (por defecto stdout)')
+    args = parser.parse_args()
+
+    server = None
+    data_dir = None
+    if not args.url:
+        # El entorno se arma antes de importar models, que lo lee al cargarse
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix='suscridash-bench-')
+        db_file = os.path.join(data_dir, 'bench.json')
+        os.environ.update({
+            'DB_BACKEND': args.backend,
+            'DB_FILE': db_file,
+            'SQLITE_FILE': os.path.join(data_dir, 'bench.sqlite3'),
+        })
+        sys.path.insert(0, BACKEND_DIR)
+        from bench.dataset import generate_dataset, write_dataset
+
+        started = time.perf_counter()
+        data = generate_dataset(args.businesses, args.customers, args.subscriptions, seed=args.seed)
+        path = os.environ['SQLITE_FILE'] if args.backend == 'sqlite' else db_file
+        write_dataset(data, path, args.backend)
+        del data
+        print(f'Dataset en {path} ({time.perf_counter() - started:.1f} s)', file=sys.stderr)
+
+    try:
+        if args.url or args.gunicorn:
+            if args.gunicorn:
+                port = free_port()
+                server = start_gunicorn(args, port)
+                host = '127.0.0.1'
+            else:
+                url = urlsplit(args.url)
+                host, port = url.hostname, url.port or 80
+            make_client = lambda: HTTPClient(host, port)
+        else:
+            from app import app
+            make_client = lambda: InProcessClient(app)
+
+        tokens = sign_in(make_client(), args)
+        latencies, errors, elapsed = drive(make_client, tokens, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if data_dir is not None and not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    result = {
+        'config': {
+            'target': args.url or ('gunicorn' if args.gunicorn else 'in-process'),
+            'backend': args.backend,
+            'businesses': args.businesses,
+            'customers': args.customers,
+            'subscriptions': args.subscriptions,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'workers': args.workers if args.gunicorn else None,
+            'threads': args.threads if args.gunicorn else None,
+        },
+        **report(latencies, errors, elapsed),
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import gc
+import json
+import tracemalloc
+
+from bench.dataset import generate_dataset
+from records import make_record
+
+# Memoria de los registros en memoria: dicts (como quedan tras json.load)
+# contra records.Record con valores internados.
+#   python -m bench.memory --customers 50000 --subscriptions 200000
+
+COLLECTIONS = ('users', 'subscriptions', 'subscription_plans')
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara la memoria de dicts y records.Record')
+    parser.add_argument('--businesses', type=int, default=200)
+    parser.add_argument('--customers', type=int, default=50000)
+    parser.add_argument('--subscriptions', type=int, default=200000)
+    args = parser.parse_args()
+
+    # Se parte del JSON serializado para que cada string sea un objeto propio,
+    # igual que al cargar el snapshot
+    raw = json.dumps(generate_dataset(args.businesses, args.customers, args.subscriptions))
+
+    data, dict_size = measure(lambda: json.loads(raw))
+    results = {'records': {c: len(data[c]) for c in COLLECTIONS}, 'dict_bytes': dict_size}
+
+    del data
+
+    def as_records():
+        # Los dicts intermedios se liberan; quedan los registros y los strings
+        # que referencian
+        loaded = json.loads(raw)
+        return {c: [make_record(c, r) for r in loaded.pop(c)] for c in COLLECTIONS}
+
+    records, record_size = measure(as_records)
+    results['record_bytes'] = record_size
+    results['ratio'] = round(dict_size / record_size, 2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
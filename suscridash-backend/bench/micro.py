@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Micro-benchmarks de las primitivas de almacenamiento y autenticación y del
+# armado de los listados, a varios tamaños de dataset. Cada tamaño corre en
+# un proceso aparte (models lee DB_FILE al importarse y guarda estado global).
+#   python -m bench.micro --sizes 1000,10000,100000 --output micro.json
+#   python -m bench.micro --baseline bench/micro_baseline.json               compara
+#   python -m bench.micro --baseline bench/micro_baseline.json --update-baseline
+#
+# Se compara la mediana por llamada de cada caso con la del baseline; una
+# diferencia mayor que --threshold (15% por defecto) cuenta como regresión y
+# el comando termina con código 1. El baseline depende de la máquina: se
+# genera y se compara en la misma.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def dataset_scale(size):
+    # size = suscripciones; clientes y empresas en la proporción de bench.load
+    return {'businesses': max(10, size // 500), 'customers': max(100, size // 5), 'subscriptions': size}
+
+def measure(func, min_time=0.2, rounds=5, max_number=100000):
+    # Mediana y mínimo por llamada (µs) de rounds rondas, cada una con las
+    # llamadas necesarias para durar al menos min_time / rounds
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / rounds or number >= max_number:
+            break
+        number = min(max_number, number * 10 if elapsed < min_time / rounds / 10 else number * 2)
+    times = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    times.sort()
+    return {
+        'median_us': round(times[len(times) // 2] * 1e6, 3),
+        'min_us': round(times[0] * 1e6, 3),
+        'number': number,
+        'rounds': rounds,
+    }
+
+def run_size(size, args):
+    # En el proceso hijo: dataset de size suscripciones y todos los casos
+    data_dir = tempfile.mkdtemp(prefix='suscridash-micro-')
+    try:
+        return _run_cases(size, args, data_dir)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def _run_cases(size, args, data_dir):
+    os.environ['DB_FILE'] = os.path.join(data_dir, 'micro.json')
+    os.environ['SQLITE_FILE'] = os.path.join(data_dir, 'micro.sqlite3')
+    sys.path.insert(0, BACKEND_DIR)
+
+    from bench.dataset import generate_dataset, write_dataset
+
+    scale = dataset_scale(size)
+    data = generate_dataset(scale['businesses'], scale['customers'], scale['subscriptions'], seed=args.seed)
+    backend = os.getenv('DB_BACKEND', 'json')
+    write_dataset(data, os.environ['SQLITE_FILE'] if backend == 'sqlite' else os.environ['DB_FILE'], backend)
+    del data
+
+    import jwt
+    import models
+    import auth
+    from app import app
+
+    # decode_token lee la clave de current_app
+    app.app_context().push()
+    rng = random.Random(args.seed)
+    results = {}
+
+    def case(name, func, **kwargs):
+        if args.only and not any(pattern in name for pattern in args.only):
+            return
+        results[name] = measure(func, args.min_time, args.rounds, **kwargs)
+        print(f'  {size:>8} {name:<32} {results[name]["median_us"]:>14.1f} µs', file=sys.stderr)
+
+    def init_db():
+        models._db = None
+        models.init_db()
+
+    # Carga completa: lectura del snapshot, registros e índices
+    case('models.init_db', init_db, max_number=10)
+    models.init_db()
+
+    # Snapshot completo (en modo journal, la compactación que lo escribe)
+    def save_db():
+        models.update_settings(dict(models.get_settings() or {}, updated_at=str(time.time())))
+        models.save_db()
+    case('models.save_db', save_db, max_number=10)
+
+    # Escrituras de un registro: journal o fila
+    customer_ids = [u['id'] for u in models.find_records('users', 'user_type', 'customer')]
+    case('models.update_record', lambda: models.update_record(
+        'users', rng.choice(customer_ids), {'phone': str(rng.random())}))
+    case('models.list_records(users)', lambda: models.list_records('users'), max_number=100)
+    case('models.find_records(business)', lambda: models.find_records('users', 'user_type', 'business'))
+
+    customers = scale['customers']
+    def authenticate():
+        i = rng.randrange(customers)
+        assert auth.authenticate_user(f'cliente{i}@ejemplo.cl', f'cliente{i}', 'customer')
+    case('auth.authenticate_user', authenticate)
+    counter = iter(range(10 ** 9))
+    case('auth.register_user', lambda: auth.register_user({
+        'email': f'micro{next(counter)}@ejemplo.cl', 'password': 'x', 'name': 'Micro', 'user_type': 'customer'}))
+    case('auth.get_current_user', lambda: auth.get_current_user(rng.choice(customer_ids)))
+
+    secret = app.config['SECRET_KEY']
+    payload = {'user_id': customer_ids[0], 'email': 'cliente0@ejemplo.cl', 'user_type': 'customer',
+               'exp': int(time.time()) + 3600}
+    token = jwt.encode(payload, secret, algorithm='HS256')
+    case('jwt.encode', lambda: jwt.encode(payload, secret, algorithm='HS256'))
+    case('jwt.decode', lambda: jwt.decode(token, secret, algorithms=['HS256']))
+    case('auth.decode_token', lambda: auth.decode_token(token))
+
+    # Handlers de listado completos (sin red): test_client con token válido
+    client = app.test_client()
+    def login(email, password, user_type):
+        return {'Authorization': 'Bearer ' + client.post('/api/auth/login', json={
+            'email': email, 'password': password, 'userType': user_type}).get_json()['access_token']}
+    admin = login('admin@suscridash.cl', 'admin123', 'admin')
+    business = login('empresa0@ejemplo.cl', 'empresa0', 'business')
+    handlers = [
+        ('GET /api/admin/businesses', '/api/admin/businesses', admin),
+        ('GET /api/admin/businesses?limit=50', '/api/admin/businesses?limit=50', admin),
+        ('GET /api/admin/users?limit=50', '/api/admin/users?limit=50', admin),
+        ('GET /api/admin/subscriptions?limit=50', '/api/admin/subscriptions?limit=50', admin),
+        ('GET /api/admin/stats', '/api/admin/stats', admin),
+        ('GET /api/admin/recent-businesses', '/api/admin/recent-businesses', admin),
+        ('GET /api/business/subscribers', '/api/business/subscribers', business),
+        ('GET /api/business/plans', '/api/business/plans', business),
+        ('GET /api/business/financial-stats', '/api/business/financial-stats', business),
+    ]
+    for name, path, headers in handlers:
+        def request(path=path, headers=headers):
+            response = client.get(path, headers=headers)
+            assert response.status_code == 200, (path, response.status_code)
+        case(name, request, max_number=1000)
+    return results
+
+def compare(results, baseline, threshold):
+    # [(tamaño, caso, baseline µs, actual µs, cambio)] de los casos en ambos,
+    # y los que superan threshold
+    rows = []
+    for size, cases in results.items():
+        for name, result in cases.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            change = result['median_us'] / before['median_us'] - 1
+            rows.append((size, name, before['median_us'], result['median_us'], change))
+    return rows, [row for row in rows if row[4] > threshold]
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de models, auth y los listados')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Suscripciones por dataset, separadas por coma')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--min-time', type=float, default=0.5, help='Segundos mínimos por caso')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--only', action='append', help='Solo los casos que contienen este texto')
+    parser.add_argument('--output', help='Archivo para los resultados JSON (por defecto stdout)')
+    parser.add_argument('--baseline', help='Resultados anteriores con los que comparar')
+    parser.add_argument('--update-baseline', action='store_true', help='Guardar estos resultados como baseline')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Regresión aceptada (0.15 = 15%%)')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        # Proceso hijo
+        json.dump(run_size(args.size, args), sys.stdout)
+        return
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        command = [sys.executable, '-m', 'bench.micro', '--size', str(size), '--seed', str(args.seed),
+                   '--min-time', str(args.min_time), '--rounds', str(args.rounds)]
+        for pattern in args.only or []:
+            command += ['--only', pattern]
+        output = subprocess.run(command, cwd=BACKEND_DIR, check=True, stdout=subprocess.PIPE).stdout
+        results[str(size)] = json.loads(output)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': os.getenv('DB_BACKEND', 'json'),
+            'seed': args.seed,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        rows, regressions = compare(results, baseline, args.threshold)
+        for size, name, before, after, change in rows:
+            flag = '  REGRESIÓN' if change > args.threshold else ''
+            print(f'{size:>8} {name:<40} {before:>12.1f} -> {after:>12.1f} µs {change:+7.1%}{flag}',
+                  file=sys.stderr)
+        report['regressions'] = [{'size': size, 'case': name, 'baseline_us': before, 'median_us': after,
+                                  'change': round(change, 4)} for size, name, before, after, change in regressions]
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text + '\n')
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
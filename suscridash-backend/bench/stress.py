@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Prueba de carga con hilos sobre el test client de Flask, como un worker de
+# gunicorn con --threads: --writers hilos registran, actualizan y borran
+# empresas mientras --readers hilos recorren los listados de administración y
+# otro hilo escribe y lee snapshots (save_db / get_db) en bucle. Al final se
+# comprueba que ningún request falló y que la cantidad de usuarios coincide
+# en memoria y al recargar la base desde un proceso nuevo.
+#   python -m bench.stress
+#   python -m bench.stress --writers 16 --readers 16 --per-writer 200
+#
+# Termina con código 1 si hubo errores o los conteos no coinciden.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READ_PATHS = ['/api/admin/businesses', '/api/admin/users', '/api/admin/stats', '/api/admin/recent-businesses']
+
+def count():
+    # En un proceso nuevo: usuarios creados por los hilos que siguen vivos
+    sys.path.insert(0, BACKEND_DIR)
+    import models
+
+    return sum(1 for user in models.get_db()['users'] if user['email'].startswith('stress'))
+
+def run(args, data_dir):
+    os.environ.update(DB_FILE=os.path.join(data_dir, 'db.json'), DB_BACKEND='json')
+    sys.path.insert(0, BACKEND_DIR)
+    import models
+    from app import app
+
+    client = app.test_client()
+    response = client.post('/api/auth/login', json={'email': 'admin@suscridash.cl', 'password': 'admin123',
+                                                     'userType': 'admin'})
+    admin = {'Authorization': 'Bearer ' + response.get_json()['access_token']}
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    def check(response, what):
+        if response.status_code != 200:
+            raise AssertionError(f'{what}: {response.status_code} {response.get_data(as_text=True)[:200]}')
+
+    def writer(index):
+        client = app.test_client()
+        rng = random.Random(index)
+        try:
+            for i in range(args.per_writer):
+                response = client.post('/api/auth/register', json={
+                    'email': f'stress{index}-{i}@ejemplo.cl', 'password': 'x', 'confirmPassword': 'x',
+                    'fullName': 'Stress', 'userType': 'business', 'businessName': 'Stress', 'taxId': '1'})
+                check(response, 'registro')
+                user_id = response.get_json()['user']['id']
+                check(client.put(f'/api/admin/businesses/{user_id}', headers=admin, json={
+                    'status': rng.choice(['active', 'pending']), 'business_name': f'Stress {i}'}), 'actualización')
+                if i % 3 == 0:
+                    check(client.delete(f'/api/admin/users/{user_id}', headers=admin), 'borrado')
+        except Exception as e:
+            errors.append(f'writer {index}: {e!r}')
+
+    def reader(index):
+        client = app.test_client()
+        try:
+            while writing.is_set():
+                for path in READ_PATHS:
+                    check(client.get(path, headers=admin), path)
+        except Exception as e:
+            errors.append(f'reader {index}: {e!r}')
+
+    def snapshotter():
+        try:
+            while writing.is_set():
+                models.save_db()
+                models.get_db()
+        except Exception as e:
+            errors.append(f'snapshot: {e!r}')
+
+    writers = [threading.Thread(target=writer, args=(index,)) for index in range(args.writers)]
+    others = [threading.Thread(target=reader, args=(index,)) for index in range(args.readers)]
+    others.append(threading.Thread(target=snapshotter))
+    started = time.perf_counter()
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writing.clear()
+    for thread in others:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    models.save_db()
+    output = subprocess.run([sys.executable, '-m', 'bench.stress', '--count'], cwd=BACKEND_DIR, env=os.environ,
+                            check=True, stdout=subprocess.PIPE).stdout
+    return {
+        'expected': args.writers * (args.per_writer - len(range(0, args.per_writer, 3))),
+        'in_memory': sum(1 for user in models.list_records('users') if user['email'].startswith('stress')),
+        'reloaded': json.loads(output),
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Escrituras y lecturas concurrentes desde varios hilos')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--per-writer', type=int, default=60)
+    parser.add_argument('--count', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.count:
+        print(count())
+        return
+
+    data_dir = tempfile.mkdtemp(prefix='suscridash-stress-')
+    try:
+        result = run(args, data_dir)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(f'{result["in_memory"]}/{result["expected"]} usuarios en memoria, {result["reloaded"]} al recargar, '
+          f'{len(result["errors"])} errores en {result["seconds"]} s', file=sys.stderr)
+    print(json.dumps(result, indent=2))
+    if result['errors'] or not result['in_memory'] == result['reloaded'] == result['expected']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
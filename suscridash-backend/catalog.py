@@ -0,0 +1,62 @@
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, request
+
+from models import get_version
+from compress import negotiate, compress_body
+
+# Cache de la ficha pública de cada empresa (/api/businesses/<id>), con el
+# JSON ya serializado. Cada entrada guarda las versiones de la empresa y de
+# sus planes con las que se armó (models.get_version por empresa), así que
+# deja de valer justo cuando cambia alguno de los dos, también por
+# escrituras de otros workers. Se conservan las CATALOG_CACHE_SIZE fichas
+# más pedidas recientemente, junto con sus versiones comprimidas (se comprime
+# una vez por codificación, no en cada respuesta).
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '1000'))
+# Tiempo que un navegador o CDN puede reutilizar la ficha sin preguntar
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', '60'))
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _versions(business_id):
+    return get_version('users', business_id)[0], get_version('subscription_plans', business_id)[0]
+
+def catalog_response(business_id, render):
+    # render(business_id) devuelve el cuerpo JSON en bytes, o None si la
+    # empresa no existe (no se guarda). Las versiones se leen antes de armar
+    # la ficha para no guardar una vieja con versiones nuevas.
+    versions = _versions(business_id)
+    with _cache_lock:
+        entry = _cache.get(business_id)
+        if entry is not None and entry[0] == versions:
+            _cache.move_to_end(business_id)
+    if entry is None or entry[0] != versions:
+        body = render(business_id)
+        if body is None:
+            return None
+        entry = (versions, body, '-'.join(versions), {})
+        with _cache_lock:
+            _cache[business_id] = entry
+            _cache.move_to_end(business_id)
+            if len(_cache) > CATALOG_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    _, body, etag, compressed = entry
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        encoding = negotiate(len(body))
+        if encoding is None:
+            response = Response(body, mimetype='application/json')
+        else:
+            if encoding not in compressed:
+                # Carrera benigna: dos hilos pueden comprimir lo mismo
+                compressed[encoding] = compress_body(body, encoding)
+            response = Response(compressed[encoding], mimetype='application/json')
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = (
+        f'public, max-age={CATALOG_MAX_AGE}, stale-while-revalidate={CATALOG_MAX_AGE}')
+    return response
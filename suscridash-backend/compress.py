@@ -0,0 +1,79 @@
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Sin brotli se ofrece solo gzip (pip install brotli)
+    brotli = None
+
+# Compresión de respuestas según Accept-Encoding: br si está disponible y el
+# cliente lo acepta, si no gzip. Las respuestas de menos de COMPRESS_MIN_SIZE
+# bytes se envían tal cual; las de streaming (exportaciones) se comprimen a
+# medida que salen, con un flush por bloque para no retener filas. Quien
+# cachea un cuerpo ya serializado puede guardar también su versión
+# comprimida (compress_body) y responder con Content-Encoding puesto; esas
+# respuestas no se vuelven a comprimir.
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+COMPRESS_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'}
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def negotiate(size=None):
+    # Codificación a usar para un cuerpo de size bytes (None: tamaño
+    # desconocido, streaming), o None si no conviene o el cliente no acepta
+    if size is not None and size < COMPRESS_MIN_SIZE:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+def _compressor(encoding):
+    # (comprimir bloque, terminar) para encoding
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        return lambda data: compressor.process(data) + compressor.flush(), compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+def _stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compress(chunk)
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+def compress_response(response):
+    # after_request de la app
+    if response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+
+    if response.is_streamed:
+        encoding = negotiate()
+        if encoding is None:
+            return response
+        response.response = _stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        encoding = negotiate(len(body))
+        if encoding is None:
+            return response
+        response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from flask import Response
+
+try:
+    import openpyxl
+except ImportError:  # Solo se necesita para ?format=xlsx
+    openpyxl = None
+
+# Exportaciones en streaming: las filas llegan de un generador y se escriben
+# en bloques de EXPORT_CHUNK_ROWS, así la memoria de cada descarga no depende
+# de la cantidad de filas y el primer byte sale sin esperar a la última.
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '500'))
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para que Excel abra el archivo como UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in _chunks(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([[row.get(column, '') for column in columns] for row in chunk])
+        yield buffer.getvalue()
+
+def stream_ndjson(rows):
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in chunk)
+
+def stream_json(rows, **fields):
+    # {**fields, "data": [...], "count": n}, con data escrito a medida que
+    # llegan las filas
+    head = json.dumps(fields, ensure_ascii=False)[:-1]
+    yield head + (', ' if fields else '') + '"data": ['
+    count = 0
+    for chunk in _chunks(rows):
+        yield (',' if count else '') + ','.join(json.dumps(row, ensure_ascii=False) for row in chunk)
+        count += len(chunk)
+    yield f'], "count": {count}}}'
+
+def stream_xlsx(columns, rows):
+    # En modo write_only openpyxl va escribiendo las filas a disco; el
+    # archivo terminado se envía en bloques desde un temporal
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in rows:
+        sheet.append([row.get(column, '') for column in columns])
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        yield from iter(lambda: f.read(64 * 1024), b'')
+
+def export_response(export_format, columns, rows, filename, **fields):
+    # Lanza ValueError si el formato no existe o no está disponible. fields
+    # se agregan al objeto de la respuesta JSON.
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Formato no válido. Debe ser uno de: {", ".join(EXPORT_FORMATS)}')
+    if export_format == 'xlsx' and openpyxl is None:
+        raise ValueError('Formato xlsx no disponible (pip install openpyxl)')
+
+    headers = {'X-Accel-Buffering': 'no'}
+    if export_format == 'json':
+        body = stream_json(rows, format='json', **fields)
+    else:
+        headers['Content-Disposition'] = f'attachment; filename={filename}.{export_format}'
+        if export_format == 'csv':
+            body = stream_csv(columns, rows)
+        elif export_format == 'ndjson':
+            body = stream_ndjson(rows)
+        else:
+            body = stream_xlsx(columns, rows)
+    return Response(body, content_type=EXPORT_FORMATS[export_format], headers=headers)
@@ -0,0 +1,214 @@
+import threading
+from collections import Counter
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:  # Solo acelera el recálculo completo de los acumulados
+    numpy = None
+
+import models
+
+# Series de ingresos y suscripciones por empresa para
+# /api/business/financial-stats, calculadas desde las suscripciones reales.
+#
+# Cada empresa tiene un acumulado por mes (índice año * 12 + mes - 1) con las
+# variaciones de [ingresos, activas, nuevas, bajas]: una suscripción activa o
+# cancelada suma monthly_amount y una activa desde el mes de start_date, y si
+# está cancelada los resta desde el mes siguiente a cancelled_at. Así cada
+# escritura toca uno o tres meses (vía models.subscribe, también los cambios
+# de otros workers) y una consulta recorre los meses con movimiento de la
+# empresa y los buckets pedidos, sin leer sus suscripciones. Los meses se
+# agrupan en trimestres y años al consultar.
+#
+# Con DB_BACKEND=sqlite los mismos acumulados los mantienen triggers en la
+# base (storage_sqlite).
+PERIODS = {'mensual': 12, 'trimestral': 4, 'anual': 3}
+BUCKET_MONTHS = {'mensual': 1, 'trimestral': 3, 'anual': 12}
+MONTH_NAMES = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+
+# business_id -> ({mes: [ingresos, activas, nuevas, bajas]}, Counter de
+# 'status:<estado>' y 'plan:<nombre>' (solo activas))
+_rollups = None
+_rollups_lock = threading.Lock()
+
+def month_index(value):
+    # 'YYYY-MM...' -> año * 12 + mes - 1, o None si no es una fecha
+    if not isinstance(value, str) or len(value) < 7 or not value[:4].isdigit() or not value[5:7].isdigit():
+        return None
+    return int(value[:4]) * 12 + int(value[5:7]) - 1
+
+def _points(sub):
+    # Variaciones que aporta una suscripción: (mes, ingresos, activas, nuevas, bajas)
+    status = sub.get('status')
+    start = month_index(sub.get('start_date'))
+    if status not in ('active', 'cancelled') or start is None:
+        return ()
+    amount = sub.get('monthly_amount') or 0
+    points = [(start, amount, 1, 1, 0)]
+    if status == 'cancelled':
+        end = max(start, month_index(sub.get('cancelled_at') or sub.get('start_date')) or start)
+        points.append((end + 1, -amount, -1, 0, 0))
+        points.append((end, 0, 0, 0, 1))
+    return points
+
+def _counts(sub):
+    names = ['status:' + (sub.get('status') or '')]
+    if sub.get('status') == 'active':
+        names.append('plan:' + (sub.get('plan_name') or 'Sin plan'))
+    return names
+
+def _account(rollups, sub, sign):
+    business_id = sub.get('business_id')
+    if not business_id:
+        return
+    rollup = rollups.get(business_id)
+    if rollup is None:
+        rollup = rollups[business_id] = ({}, Counter())
+    months, counts = rollup
+    for month, *values in _points(sub):
+        bucket = months.get(month)
+        if bucket is None:
+            bucket = months[month] = [0, 0, 0, 0]
+        for i, value in enumerate(values):
+            bucket[i] += value * sign
+    for name in _counts(sub):
+        counts[name] += sign
+        if not counts[name]:
+            del counts[name]
+
+def compute_rollups(subscriptions):
+    # Recálculo completo. Con numpy las sumas por (empresa, mes) se hacen
+    # en bloque sobre columnas; sin numpy, registro por registro.
+    subscriptions = [sub for sub in subscriptions if sub.get('business_id')]
+    if numpy is None:
+        rollups = {}
+        for sub in subscriptions:
+            _account(rollups, sub, 1)
+        return rollups
+    return _compute_rollups_numpy(subscriptions)
+
+def _compute_rollups_numpy(subscriptions):
+    rollups = {}
+    for sub in subscriptions:
+        rollup = rollups.get(sub['business_id'])
+        if rollup is None:
+            rollup = rollups[sub['business_id']] = ({}, Counter())
+        rollup[1].update(_counts(sub))
+
+    subs = [sub for sub in subscriptions if sub.get('status') in ('active', 'cancelled')
+            and month_index(sub.get('start_date')) is not None]
+    if not subs:
+        return rollups
+    businesses, codes = numpy.unique(numpy.array([sub['business_id'] for sub in subs]), return_inverse=True)
+    start = numpy.array([month_index(sub['start_date']) for sub in subs], dtype=numpy.int64)
+    end = numpy.array([month_index(sub.get('cancelled_at') or sub['start_date']) or 0 for sub in subs],
+                      dtype=numpy.int64)
+    end = numpy.maximum(start, end)
+    amount = numpy.array([sub.get('monthly_amount') or 0 for sub in subs])
+    cancelled = numpy.array([sub['status'] == 'cancelled' for sub in subs])
+
+    # Los mismos puntos que _points, como columnas
+    n, c = len(subs), int(cancelled.sum())
+    ones, zeros = numpy.ones(n, dtype=numpy.int64), numpy.zeros(c, dtype=numpy.int64)
+    month = numpy.concatenate([start, end[cancelled] + 1, end[cancelled]])
+    code = numpy.concatenate([codes, codes[cancelled], codes[cancelled]])
+    revenue = numpy.concatenate([amount, -amount[cancelled], numpy.zeros(c, dtype=amount.dtype)])
+    counters = numpy.stack([
+        numpy.concatenate([ones, -ones[:c], zeros]),         # activas
+        numpy.concatenate([ones, zeros, zeros]),             # nuevas
+        numpy.concatenate([numpy.zeros(n, dtype=numpy.int64), zeros, ones[:c]]),  # bajas
+    ])
+
+    low = int(month.min())
+    span = int(month.max()) - low + 1
+    keys = code.astype(numpy.int64) * span + (month - low)
+    order = numpy.argsort(keys, kind='stable')
+    keys, first = numpy.unique(keys[order], return_index=True)
+    revenue = numpy.add.reduceat(revenue[order], first).tolist()
+    counters = numpy.add.reduceat(counters[:, order], first, axis=1).tolist()
+    for key, values in zip(keys.tolist(), zip(revenue, *counters)):
+        business_id = str(businesses[key // span])
+        rollups[business_id][0][key % span + low] = list(values)
+    return rollups
+
+def _on_change(collection, old, new):
+    if collection != 'subscriptions' or _rollups is None:
+        return
+    with _rollups_lock:
+        if old is not None:
+            _account(_rollups, old, -1)
+        if new is not None:
+            _account(_rollups, new, 1)
+
+def _on_reload():
+    global _rollups
+    # Se recalcula en la próxima consulta
+    with _rollups_lock:
+        _rollups = None
+
+def _rollup(business_id):
+    # Copia de los acumulados de una empresa: ({mes: valores}, {nombre: n})
+    global _rollups
+    if models._backend is not None:
+        return models._backend.get_financial_rollup(business_id)
+    if _rollups is None:
+        with models._lock:
+            rollups = compute_rollups(models.list_records('subscriptions'))
+            with _rollups_lock:
+                _rollups = rollups
+    with _rollups_lock:
+        months, counts = _rollups.get(business_id, ({}, {}))
+        return {month: list(values) for month, values in months.items()}, dict(counts)
+
+def _label(month, time_range):
+    year = month // 12
+    if time_range == 'mensual':
+        return f'{MONTH_NAMES[month % 12]} {year}'
+    if time_range == 'trimestral':
+        return f'Q{month % 12 // 3 + 1} {year}'
+    return str(year)
+
+def get_financial_stats(business_id, time_range):
+    # Series de los últimos PERIODS[time_range] meses, trimestres o años hasta
+    # el actual. Lanza KeyError si el rango no existe.
+    periods, size = PERIODS[time_range], BUCKET_MONTHS[time_range]
+    months, counts = _rollup(business_id)
+
+    now = month_index(datetime.utcnow().date().isoformat())
+    first = now - now % size - (periods - 1) * size
+    revenue = active = 0
+    for month, values in months.items():
+        if month < first:
+            revenue += values[0]
+            active += values[1]
+
+    labels = [_label(first + i * size, time_range) for i in range(periods)]
+    ingresos, tendencia, nuevas, bajas = [0] * periods, [0] * periods, [0] * periods, [0] * periods
+    for month in range(first, now + 1):
+        values = months.get(month)
+        if values is not None:
+            revenue += values[0]
+            active += values[1]
+        bucket = (month - first) // size
+        ingresos[bucket] += revenue
+        tendencia[bucket] = active
+        if values is not None:
+            nuevas[bucket] += values[2]
+            bajas[bucket] += values[3]
+
+    previous = tendencia[-2] if periods > 1 else 0
+    return {
+        'labels': labels,
+        'ingresos': ingresos,
+        'tendencia': tendencia,
+        'nuevas': nuevas,
+        'bajas': bajas,
+        'total': sum(v for name, v in counts.items() if name.startswith('status:')),
+        'activas': counts.get('status:active', 0),
+        'canceladas': counts.get('status:cancelled', 0),
+        'crecimiento': round((tendencia[-1] - previous) / previous * 100, 1) if previous else 0,
+        'planes': {name[5:]: v for name, v in counts.items() if name.startswith('plan:') and v},
+    }
+
+models.subscribe(_on_change, _on_reload)
@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+
+# Tareas de mantenimiento de la base de datos:
+#   python manage.py migrate-sqlite [--json db_simulada.json] [--sqlite suscridash.sqlite3]
+#   python manage.py convert --to msgpack [--input db_simulada.json] [--output db_simulada.msgpack]
+
+def fold_journal(path):
+    # Si path es el snapshot en uso, se le incorporan los cambios que aún estén
+    # en el journal (con cualquier DB_BACKEND)
+    import models
+
+    if os.path.abspath(path) == os.path.abspath(models.DB_FILE):
+        models.fold_journal()
+
+def migrate_sqlite(args):
+    import storage_sqlite
+
+    fold_journal(args.json)
+    if args.sqlite:
+        storage_sqlite.SQLITE_FILE = args.sqlite
+    counts = storage_sqlite.migrate_from_json(args.json)
+    for collection, count in counts.items():
+        print(f'{collection}: {count} registros')
+    print(f'Migración completa en {storage_sqlite.SQLITE_FILE}')
+
+def convert(args):
+    # Cambia el formato de un snapshot (en cualquier dirección). Sin --output
+    # se reescribe el mismo archivo.
+    import models
+
+    fold_journal(args.input)
+    output = args.output or args.input
+    try:
+        data = models.encode_snapshot(models.read_snapshot(args.input), args.to)
+    except (RuntimeError, ValueError) as e:
+        # Sin el paquete msgpack o un snapshot que no se puede leer
+        sys.exit(f'Error: {e}')
+    tmp_file = output + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, output)
+    print(f'{output}: {len(data)} bytes ({args.to})')
+
+def main():
+    from models import DB_FILE, DB_FORMATS
+
+    parser = argparse.ArgumentParser(description='Tareas de mantenimiento de Suscridash')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate = commands.add_parser('migrate-sqlite', help='Migra el archivo JSON a la base SQLite')
+    migrate.add_argument('--json', default=DB_FILE, help='Archivo JSON de origen')
+    migrate.add_argument('--sqlite', help='Base SQLite de destino (por defecto SQLITE_FILE)')
+    migrate.set_defaults(func=migrate_sqlite)
+
+    conv = commands.add_parser('convert', help='Convierte el snapshot a otro formato')
+    conv.add_argument('--to', required=True, choices=DB_FORMATS, help='Formato de destino')
+    conv.add_argument('--input', default=DB_FILE, help='Snapshot de origen (formato detectado)')
+    conv.add_argument('--output', help='Archivo de destino (por defecto el mismo de origen)')
+    conv.set_defaults(func=convert)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+import jwt
+from flask import Response, request
+
+import models
+from auth import decode_token
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso (servidor de desarrollo)
+    fcntl = None
+
+# Métricas de la API en formato de texto de Prometheus (/metrics): latencia y
+# tamaño de respuesta por endpoint (histogramas), requests por código de
+# estado, requests en curso y el trabajo de almacenamiento de models
+# (storage_metrics y cantidad de registros por colección).
+#
+# Cada hilo de cada worker acumula sus métricas en memoria en sus propios
+# contadores (_Counters): registrar un request es una búsqueda en un dict y
+# unas pocas sumas, sin locks (~1.6 µs por request entre los dos hooks); los
+# de todos los hilos se suman al leerlos. Un hilo las escribe cada
+# METRICS_FLUSH_INTERVAL segundos en METRICS_DIR/<pid>-<id>.json (el id es
+# por proceso: un pid reutilizado no pisa el archivo de un worker anterior),
+# y el worker que atiende /metrics suma los archivos de los demás a las
+# suyas. Los archivos de procesos que ya no existen se suman a
+# retired.json y se borran, así los contadores no retroceden y el
+# directorio no crece con cada reinicio. Los gauges solo cuentan workers que
+# escribieron hace poco.
+#
+# La latencia va de before_request a after_request: en las respuestas de
+# streaming (exportaciones) no incluye el envío del cuerpo.
+METRICS_DIR = os.getenv('METRICS_DIR', models.DB_FILE + '.metrics')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# /metrics pide Authorization: Bearer con METRICS_TOKEN (si está definido) o
+# con el token de un administrador; nunca es público
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Fila de cada (método, endpoint, status) en _Counters.requests: conteos por
+# bucket de latencia (con +Inf) y su suma, luego lo mismo para el tamaño
+_LATENCY_SUM = len(LATENCY_BUCKETS) + 1
+_SIZE_START = _LATENCY_SUM + 1
+_SIZE_SUM = _SIZE_START + len(SIZE_BUCKETS) + 1
+
+class _Counters:
+    # Métricas de un hilo. Solo ese hilo las modifica; al leerlas desde otro
+    # se copian (una fila puede verse con el bucket ya sumado y la suma no,
+    # lo que se corrige en la siguiente lectura).
+    __slots__ = ('requests', 'started', 'completed', 'request_bytes', 'request', 'start')
+
+    def __init__(self):
+        # (método, endpoint, status) -> fila (ver _LATENCY_SUM): una sola
+        # búsqueda por request
+        self.requests = {}
+        self.started = 0
+        self.completed = 0
+        self.request_bytes = 0
+        # Request en curso en el hilo (lo deja before_request)
+        self.request = None
+        self.start = 0
+
+_local = threading.local()
+# _Counters de todos los hilos de este proceso que atendieron requests
+_threads = []
+_threads_pid = None
+_lock = threading.Lock()
+_writer_pid = None
+_state_file = None  # <pid>-<id>.json de este proceso
+
+RETIRED_FILE = 'retired.json'
+
+def before_request():
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _register_thread()
+    counters.started += 1
+    # El request se resuelve una sola vez por request, aquí; after_request
+    # lo toma de los contadores del hilo
+    counters.request = request._get_current_object()
+    counters.start = time.perf_counter()
+
+def after_request(response):
+    counters = getattr(_local, 'counters', None)
+    req = counters.request if counters is not None else None
+    if req is None:
+        # before_request no corrió (lo cortó un hook anterior)
+        return response
+    elapsed = time.perf_counter() - counters.start
+    counters.request = None
+    rule = req.url_rule
+    key = (req.method, rule.rule if rule is not None else '<sin ruta>', response.status_code)
+    row = counters.requests.get(key)
+    if row is None:
+        row = counters.requests[key] = [0] * (_SIZE_SUM + 1)
+    row[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+    row[_LATENCY_SUM] += elapsed
+    size = response.headers.get('Content-Length')
+    if size is not None:
+        size = int(size)
+        row[_SIZE_START + bisect_left(SIZE_BUCKETS, size)] += 1
+        row[_SIZE_SUM] += size
+    # Directo del environ: el header lo manda el cliente y puede no ser un número
+    received = req.environ.get('CONTENT_LENGTH')
+    if received and received.isdigit():
+        counters.request_bytes += int(received)
+    counters.completed += 1
+    return response
+
+def _register_thread():
+    # Primer request del hilo. Los contadores heredados de un fork (la app
+    # se importa en el master de gunicorn) se descartan.
+    global _threads, _threads_pid
+    counters = _local.counters = _Counters()
+    with _lock:
+        if _threads_pid != os.getpid():
+            _threads, _threads_pid = [], os.getpid()
+        _threads.append(counters)
+    _start_writer()
+    return counters
+
+def init_app(app):
+    # Flask llama los after_request en orden inverso al registro: como se
+    # registra justo antes que compress_response, corre después de la
+    # compresión y mide el cuerpo comprimido. Los hooks registrados antes
+    # (CORS, tracing, profiler) quedan fuera de la latencia: sus
+    # before_request corren antes de este y sus after_request después.
+    app.before_request(before_request)
+    app.after_request(after_request)
+
+def _add_row(table, key, row):
+    if key in table:
+        table[key] = [a + b for a, b in zip(table[key], row)]
+    else:
+        table[key] = row
+
+def _state():
+    with _lock:
+        threads = list(_threads) if _threads_pid == os.getpid() else []
+    latency, response_size, status = {}, {}, {}
+    for counters in threads:
+        for (method, endpoint, code), row in list(counters.requests.items()):
+            row = list(row)
+            count = sum(row[:_LATENCY_SUM])
+            _add_row(latency, (method, endpoint), row[:_SIZE_START])
+            if any(row[_SIZE_START:_SIZE_SUM]):
+                _add_row(response_size, (method, endpoint), row[_SIZE_START:])
+            status[method, endpoint, code] = status.get((method, endpoint, code), 0) + count
+    return {
+        'latency': [list(key) + row for key, row in latency.items()],
+        'response_size': [list(key) + row for key, row in response_size.items()],
+        'status': [list(key) + [count] for key, count in status.items()],
+        'in_flight': sum(counters.started - counters.completed for counters in threads),
+        'request_bytes': sum(counters.request_bytes for counters in threads),
+        'storage': dict(models.storage_metrics),
+        'time': time.time(),
+    }
+
+def _write_state():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(os.path.join(METRICS_DIR, _state_file), _state())
+
+def _write_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            _write_state()
+        except OSError:
+            pass
+
+def _start_writer():
+    # Una vez por proceso: los hilos no sobreviven al fork de gunicorn
+    global _writer_pid, _state_file
+    with _lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+        _state_file = f'{_writer_pid}-{uuid.uuid4().hex[:12]}.json'
+    threading.Thread(target=_write_loop, name='metrics-writer', daemon=True).start()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _add_state(total, state):
+    # Suma los contadores de state a total (gauges aparte)
+    for field, width in (('latency', 2), ('response_size', 2), ('status', 3)):
+        merged = _merge_histograms([(None, total, False), (None, state, False)], field, width)
+        total[field] = [list(key) + values for key, values in merged.items()]
+    total['request_bytes'] += state['request_bytes']
+    for name, value in state['storage'].items():
+        if name != 'load_seconds':
+            total['storage'][name] = total['storage'].get(name, 0) + value
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def _worker_states():
+    # [(pid, estado, vigente)] de todos los workers, con el propio en vivo, y
+    # el acumulado de los que terminaron (pid None). Se lee con el flock de
+    # METRICS_DIR tomado: otro worker podría estar pasando archivos a
+    # retired.json.
+    own = os.getpid()
+    states = [(own, _state(), True)]
+    if not os.path.isdir(METRICS_DIR):
+        return states
+    with open(os.path.join(METRICS_DIR, '.lock'), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(METRICS_DIR, RETIRED_FILE)
+        retired = _read_json(retired_path) or {
+            'latency': [], 'response_size': [], 'status': [], 'request_bytes': 0, 'storage': {}, 'files': []}
+        names = sorted(name for name in os.listdir(METRICS_DIR)
+                       if name.endswith('.json') and name not in (RETIRED_FILE, _state_file))
+        now = time.time()
+        dead = []
+        for name in names:
+            state = _read_json(os.path.join(METRICS_DIR, name))
+            if state is None:
+                continue
+            pid = int(name.split('-')[0].split('.')[0])
+            # Sin fcntl (Windows) no se puede saber si el pid sigue vivo
+            if fcntl is None or (pid != own and _alive(pid)):
+                states.append((pid, state, now - state['time'] < 3 * METRICS_FLUSH_INTERVAL))
+                continue
+            # El proceso terminó (o su pid es ahora el de este proceso)
+            if name not in retired['files']:
+                _add_state(retired, state)
+            dead.append(name)
+        if dead or retired['files']:
+            # retired.json recuerda qué archivos ya sumó hasta borrarlos: si
+            # el worker se corta en medio no se cuentan dos veces
+            retired['files'] = dead
+            _write_json(retired_path, retired)
+            for name in dead:
+                try:
+                    os.remove(os.path.join(METRICS_DIR, name))
+                except FileNotFoundError:
+                    pass
+            retired['files'] = []
+            _write_json(retired_path, retired)
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    states.append((None, retired, False))
+    return states
+
+def _merge_histograms(states, field, width):
+    merged = {}
+    for _, state, _ in states:
+        for row in state[field]:
+            key, values = tuple(row[:width]), row[width:]
+            if key in merged:
+                merged[key] = [a + b for a, b in zip(merged[key], values)]
+            else:
+                merged[key] = values
+    return merged
+
+def _labels(**labels):
+    text = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+    return '{' + text + '}' if text else ''
+
+def _histogram(lines, name, help_text, merged, buckets):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for (method, endpoint), row in sorted(merged.items()):
+        cumulative = 0
+        for bound, count in zip(list(buckets) + ['+Inf'], row[:-1]):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(method=method, endpoint=endpoint, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(method=method, endpoint=endpoint)} {row[-1]}')
+        lines.append(f'{name}_count{_labels(method=method, endpoint=endpoint)} {cumulative}')
+
+def _metric(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(**labels)} {value}')
+
+def render():
+    states = _worker_states()
+    live = [(pid, state) for pid, state, fresh in states if fresh]
+    storage = lambda field: sum(state['storage'].get(field, 0) for _, state, _ in states)
+    lines = []
+    _histogram(lines, 'suscridash_http_request_duration_seconds', 'Latencia de los requests por endpoint.',
+               _merge_histograms(states, 'latency', 2), LATENCY_BUCKETS)
+    _histogram(lines, 'suscridash_http_response_size_bytes', 'Tamaño de las respuestas (sin streaming).',
+               _merge_histograms(states, 'response_size', 2), SIZE_BUCKETS)
+    status = _merge_histograms(states, 'status', 3)
+    _metric(lines, 'suscridash_http_requests_total', 'counter', 'Requests por endpoint y código de estado.',
+            [({'method': m, 'endpoint': e, 'status': s}, count[0]) for (m, e, s), count in sorted(status.items())])
+    _metric(lines, 'suscridash_http_requests_in_flight', 'gauge', 'Requests en curso.',
+            [({}, sum(state['in_flight'] for _, state in live))])
+    _metric(lines, 'suscridash_http_request_bytes_total', 'counter', 'Bytes recibidos en cuerpos de requests.',
+            [({}, sum(state['request_bytes'] for _, state, _ in states))])
+    _metric(lines, 'suscridash_workers', 'gauge', 'Workers que informaron métricas recientemente.',
+            [({}, len(live))])
+    _metric(lines, 'suscridash_db_load_seconds', 'gauge', 'Duración de la carga inicial (init_db) por worker.',
+            [({'worker': pid}, state['storage'].get('load_seconds', 0)) for pid, state in sorted(live)])
+    _metric(lines, 'suscridash_db_snapshot_writes_total', 'counter', 'Snapshots completos escritos.',
+            [({}, storage('snapshot_writes'))])
+    _metric(lines, 'suscridash_db_snapshot_seconds_total', 'counter', 'Tiempo escribiendo snapshots.',
+            [({}, storage('snapshot_seconds'))])
+    _metric(lines, 'suscridash_db_snapshot_bytes_total', 'counter', 'Bytes escritos en snapshots.',
+            [({}, storage('snapshot_bytes'))])
+    _metric(lines, 'suscridash_db_journal_appends_total', 'counter', 'Escrituras al journal.',
+            [({}, storage('journal_appends'))])
+    _metric(lines, 'suscridash_db_journal_bytes_total', 'counter', 'Bytes agregados al journal.',
+            [({}, storage('journal_bytes'))])
+    _metric(lines, 'suscridash_db_records', 'gauge', 'Registros por colección.',
+            [({'collection': collection}, count) for collection, count in sorted(models.collection_sizes().items())])
+    return '\n'.join(lines) + '\n'
+
+def _authorized():
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+    token = auth_header[len('Bearer '):]
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return True
+    try:
+        return decode_token(token).get('user_type') == 'admin'
+    except jwt.InvalidTokenError:
+        return False
+
+def metrics_response():
+    if not _authorized():
+        return Response('No autorizado\n', status=401, mimetype='text/plain')
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -1,167 +1,1287 @@
+import atexit
+import gc
 import json
 import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from inspect import isgeneratorfunction
 from werkzeug.security import generate_password_hash
+from records import make_record, make_records, to_json
+import tracing
+from tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos (servidor de desarrollo)
+    fcntl = None
+
+try:
+    import msgpack
+except ImportError:  # Solo se necesita con DB_FORMAT=msgpack
+    msgpack = None
 
 _db = None
-DB_FILE = 'db_simulada.json'
+DB_FILE = os.getenv('DB_FILE', 'db_simulada.json')
+
+# Backend de almacenamiento: 'json' (en memoria + journal, este módulo) o
+# 'sqlite' (storage_sqlite). Las funciones públicas marcadas con @_pluggable
+# se atienden en el backend elegido.
+DB_BACKEND = os.getenv('DB_BACKEND', 'json')
+_backend = None
+if DB_BACKEND == 'sqlite':
+    import storage_sqlite as _backend
+
+# Modo journal: cada mutación se agrega como una línea al journal en vez de
+# reescribir todo DB_FILE. Un hilo en segundo plano compacta el journal en el
+# snapshot cada cierto tiempo o cuando acumula demasiadas entradas.
+#
+# El journal también es el canal entre los workers de gunicorn: cada proceso
+# lee de forma incremental lo que otros agregaron (refresh_db), y las
+# escrituras y compactaciones se serializan con un flock sobre LOCK_FILE.
+DB_JOURNAL = os.getenv('DB_JOURNAL', '1') == '1'
+JOURNAL_FILE = DB_FILE + '.journal'
+LOCK_FILE = DB_FILE + '.lock'
+JOURNAL_COMPACT_THRESHOLD = int(os.getenv('DB_JOURNAL_COMPACT_THRESHOLD', '1000'))
+JOURNAL_COMPACT_INTERVAL = float(os.getenv('DB_JOURNAL_COMPACT_INTERVAL', '300'))
+
+# Sin journal (DB_JOURNAL=0) cada escritura reescribe DB_FILE con el flock
+# tomado, después de recargarlo si otro worker lo reescribió desde la última
+# lectura o escritura de este proceso; refresh_db hace lo mismo antes de cada
+# request. _snapshot_stamp es el (inodo, mtime) de esa última vez.
+_snapshot_stamp = None
+
+# Group commit: con DB_FLUSH_INTERVAL > 0 las mutaciones se aplican en memoria
+# y quedan pendientes; un hilo las escribe juntas cada DB_FLUSH_INTERVAL
+# segundos o al acumular DB_FLUSH_MAX_PENDING cambios, y al cerrar el proceso.
+# El request ya no espera al disco; quien necesite durabilidad llama a
+# sync_db(). Con 0 (por defecto) cada mutación se escribe antes de responder.
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '0'))
+DB_FLUSH_MAX_PENDING = int(os.getenv('DB_FLUSH_MAX_PENDING', '100'))
+
+# Snapshots: se escriben en un archivo temporal, fsync y rename, así que
+# DB_FILE nunca queda a medio escribir. Se conservan las DB_SNAPSHOT_KEEP
+# versiones anteriores (DB_FILE.1 es la más nueva) junto con sus journals
+# (JOURNAL_FILE.1, ...). Si DB_FILE no se puede leer, init_db parte de la copia
+# válida más nueva y le vuelve a aplicar los journals que la siguieron.
+DB_SNAPSHOT_KEEP = int(os.getenv('DB_SNAPSHOT_KEEP', '3'))
+
+# Formato del snapshot:
+#   json      JSON indentado (el de siempre, cómodo para revisar a mano)
+#   compact   JSON sin espacios: ~25% menos bytes y algo más rápido de leer
+#   columnar  JSON sin espacios; cada colección se guarda como columnas y
+#             filas en vez de repetir las claves en cada registro. Es el más
+#             chico, pero armar los dicts en Python hace que cargue más lento.
+#   msgpack   binario (paquete msgpack, en requirements.txt); el que carga
+#             más rápido
+# Por defecto se deduce de la extensión de DB_FILE (.msgpack o json). Al leer
+# se detecta el formato del archivo, así que cambiar DB_FORMAT no requiere
+# convertir antes: el siguiente snapshot ya sale en el formato nuevo.
+DB_FORMATS = ('json', 'compact', 'columnar', 'msgpack')
+DB_FORMAT = os.getenv('DB_FORMAT') or ('msgpack' if DB_FILE.endswith('.msgpack') else 'json')
+
+# Índices secundarios por colección: nombre -> función que obtiene la clave.
+# Cada índice agrupa los registros como {clave: {id: registro}}, además del
+# índice primario por id que tienen todas las colecciones y que es donde viven
+# los registros una vez cargados.
+#
+# Concurrencia (gunicorn --threads): los registros nunca se modifican en su
+# lugar (records.Record es de solo lectura). Una actualización crea un
+# registro nuevo y lo reemplaza en los índices (copy-on-write), así que las
+# lecturas no toman locks y nunca ven un registro a medio actualizar. Las
+# escrituras se serializan con _lock, y un snapshot es solo una copia de
+# referencias tomada con _lock.
+INDEXES = {
+    'users': {
+        'user_type': lambda r: r['user_type'],
+        'email': lambda r: r['email'],
+        'login': lambda r: (r['email'], r['user_type']),
+    },
+    'subscriptions': {
+        'business_id': lambda r: r.get('business_id'),
+        'customer_id': lambda r: r.get('customer_id'),
+    },
+    'subscription_plans': {
+        'business_id': lambda r: r.get('business_id'),
+    },
+}
+
+# Órdenes para paginar con page_records: colección -> (índice que la
+# particiona o None, {orden: clave}). Cada grupo del índice mantiene sus
+# registros ordenados por cada clave; las claves terminan en el id para que
+# sean únicas y un cursor (la clave del último registro entregado) siga siendo
+# válido aunque se agreguen o borren registros.
+SORTS = {
+    'users': ('user_type', {
+        'created_at': lambda r: (r.get('created_at') or '', r['id']),
+        'email': lambda r: (r['email'], r['id']),
+        'name': lambda r: (r.get('name') or '', r['id']),
+        'business_name': lambda r: (r.get('business_name') or '', r['id']),
+    }),
+    'subscriptions': (None, {
+        'created_at': lambda r: (r.get('created_at') or '', r['id']),
+        'renewal_date': lambda r: (r.get('renewal_date') or '', r['id']),
+    }),
+}
+
+# Versiones de los datos para las respuestas condicionales (ETag): un
+# contador por colección y otro por colección y empresa
+# ('subscriptions:<business_id>'; en users la empresa es el propio usuario),
+# cada uno con la hora del último cambio. Se guardan en _meta del snapshot y
+# cada worker las avanza al aplicar cada entrada, así todos llegan a los
+# mismos valores (con DB_FLUSH_INTERVAL, con el mismo retraso que los datos).
+TENANT_FIELDS = {'users': 'id', 'subscriptions': 'business_id', 'subscription_plans': 'business_id'}
+
+_indexes = {}
+_sorted = {}
+
+_lock = threading.RLock()
+_lock_file = None
+_lock_depth = 0
+_journal = None
+_journal_reader = None
+_journal_ino = None
+_journal_id = None
+_journal_header = {}
+_journal_offset = 0
+_journal_entries = 0
+_compact_requested = threading.Event()
+_compactor = None
+_pending = []
+_dirty = False
+_flush_requested = threading.Event()
+_flusher = None
+_listeners = []
+
+# Trabajo de almacenamiento de este proceso, para metrics.py: carga inicial,
+# snapshots completos escritos (save_db, compactaciones) y bytes agregados al
+# journal
+storage_metrics = {
+    'load_seconds': 0.0,
+    'snapshot_writes': 0,
+    'snapshot_seconds': 0.0,
+    'snapshot_bytes': 0,
+    'journal_appends': 0,
+    'journal_bytes': 0,
+}
 
+def _pluggable(func):
+    # Dentro de un request trazado cada llamada es un span (ver tracing), con
+    # la colección y la cantidad de registros devueltos. Los generadores no:
+    # su trabajo ocurre después, al recorrerlos.
+    name = 'models.' + func.__name__
+    traced = not isgeneratorfunction(func)
+    by_collection = func.__code__.co_varnames[:1] == ('collection',)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        target = getattr(_backend, func.__name__) if _backend is not None else func
+        if not traced or tracing._current.get() is None:
+            return target(*args, **kwargs)
+        with span(name, collection=args[0] if by_collection and args else None) as current:
+            result = target(*args, **kwargs)
+            if isinstance(result, list):
+                current.set_attribute('records', len(result))
+            return result
+    return wrapper
+
+@_pluggable
 def init_db():
-    global _db
+    with _file_lock():
+        _init_db()
+
+def default_data():
+    # Datos de ejemplo de una base nueva (también los usa storage_sqlite)
+    return {
+        'users': [
+            {
+                'id': '1',
+                'email': 'admin@suscridash.cl',
+                'password': 'admin123',
+                'name': 'Administrador',
+                'user_type': 'admin',
+                'created_at': '2023-01-01T00:00:00'
+            },
+            {
+                'id': '2',
+                'email': 'empresa@ejemplo.cl',
+                'password': 'empresa123',
+                'name': 'Empresa Ejemplo',
+                'user_type': 'business',
+                'business_name': 'Mi Empresa SA',
+                'tax_id': '12345678-9',
+                'subscriptions': 8,
+                'status': 'active',
+                'created_at': '2023-05-15T10:30:00'
+            },
+            {
+                'id': '3',
+                'email': 'cliente@ejemplo.cl',
+                'password': 'cliente123',
+                'name': 'Cliente Ejemplo',
+                'user_type': 'customer',
+                'created_at': '2023-06-20T14:15:00'
+            },
+            {
+                'id': '4',
+                'email': 'tech@solutions.cl',
+                'password': 'tech123',
+                'name': 'Tech Solutions',
+                'user_type': 'business',
+                'business_name': 'Tech Solutions SA',
+                'tax_id': '76543210-1',
+                'subscriptions': 12,
+                'status': 'active',
+                'created_at': '2023-07-10T09:45:00'
+            },
+            {
+                'id': '5',
+                'email': 'marketing@digital.cl',
+                'password': 'marketing123',
+                'name': 'Marketing Digital',
+                'user_type': 'business',
+                'business_name': 'Digital Marketing SpA',
+                'tax_id': '98765432-1',
+                'subscriptions': 5,
+                'status': 'pending',
+                'created_at': '2023-08-05T16:20:00'
+            },
+            {
+                'id': '6',
+                'email': 'cloud@services.cl',
+                'password': 'cloud123',
+                'name': 'Cloud Services',
+                'user_type': 'business',
+                'business_name': 'Cloud Services Ltda',
+                'tax_id': '54321678-9',
+                'subscriptions': 3,
+                'status': 'active',
+                'created_at': '2023-09-12T11:10:00'
+        }
+    ],
+    'subscriptions': [
+        {
+            'id': '1',
+            'business_id': '2',  # Empresa Ejemplo
+            'customer_id': '3',  # Cliente Ejemplo
+            'plan_id': '1',      # Plan Básico
+            'start_date': '2023-05-15',
+            'renewal_date': '2023-06-15',
+            'status': 'active',
+            'payment_method': 'Visa **** 4242',
+            'monthly_amount': 9900,
+            'created_at': '2023-05-15T10:30:00'
+        },
+        {
+            'id': '2',
+            'business_id': '2',  # Empresa Ejemplo
+            'customer_id': '6',  # Otro cliente (agregar a users si no existe)
+            'plan_id': '2',      # Plan Premium
+            'start_date': '2023-04-10',
+            'renewal_date': '2023-06-10',
+            'status': 'active',
+            'payment_method': 'Mastercard **** 5555',
+            'monthly_amount': 19900,
+            'created_at': '2023-04-10T14:15:00'
+        },
+        {
+            'id': '3',
+            'business_id': '2',  # Empresa Ejemplo
+            'customer_id': '7',  # Otro cliente (agregar a users si no existe)
+            'plan_id': '1',      # Plan Básico
+            'start_date': '2023-01-20',
+            'renewal_date': '2023-07-20',
+            'status': 'cancelled',
+            'payment_method': 'Transferencia bancaria',
+            'monthly_amount': 9900,
+            'created_at': '2023-01-20T09:45:00'
+        }
+    ],
+        # En la función init_db(), agregar esto al diccionario _db:
+    'subscription_plans': [
+            {
+                'id': '1',
+                'business_id': '2',  # Empresa Ejemplo
+                'nombre': "Plan Básico",
+                'precio': 9900,
+                'moneda': "CLP",
+                'periodo': "mes",
+                'descripcion': "Acceso básico a las funcionalidades",
+                'caracteristicas': ["Soporte por email", "Acceso básico"],
+                'estado': "activo",
+                'created_at': '2023-01-01T00:00:00'
+            },
+            {
+                'id': '2',
+                'business_id': '2',  # Empresa Ejemplo
+                'nombre': "Plan Premium",
+                'precio': 19900,
+                'moneda': "CLP",
+                'periodo': "mes",
+                'descripcion': "Acceso completo con soporte prioritario",
+                'caracteristicas': ["Soporte 24/7", "Acceso completo", "Actualizaciones"],
+                'estado': "activo",
+                'created_at': '2023-01-01T00:00:00'
+            }
+        ],
+        'system_settings': {
+            'system_name': 'Suscridash',
+            'currency': 'CLP',
+            'logo_url': '',
+            'session_timeout': 30,  # minutos
+            'email_notifications': True,
+            'app_notifications': True,
+            'created_at': '2023-01-01T00:00:00',
+            'updated_at': '2023-01-01T00:00:00'
+        }
+    }
+
+def _init_db(background=True):
+    # background=False: sin los hilos de compactación y group commit (para
+    # leer el JSON desde un proceso que usa otro backend, ver fold_journal)
+    global _db, _snapshot_stamp
     if _db is None:
-        if os.path.exists(DB_FILE):
-            with open(DB_FILE, 'r') as f:
-                _db = json.load(f)
+        started = time.perf_counter()
+        seeded = False
+        backup = _load_snapshot()
+        if _db is None:
+            seeded = True
+            _db = default_data()
+
+        _rebuild_indexes()
+        if DB_JOURNAL:
+            if backup:
+                _recover_from_backup(backup)
+            else:
+                _load_journal()
+            if background:
+                _start_compactor()
         else:
-            _db = {
-                'users': [
-                    {
-                        'id': '1',
-                        'email': 'admin@suscridash.cl',
-                        'password': 'admin123',
-                        'name': 'Administrador',
-                        'user_type': 'admin',
-                        'created_at': '2023-01-01T00:00:00'
-                    },
-                    {
-                        'id': '2',
-                        'email': 'empresa@ejemplo.cl',
-                        'password': 'empresa123',
-                        'name': 'Empresa Ejemplo',
-                        'user_type': 'business',
-                        'business_name': 'Mi Empresa SA',
-                        'tax_id': '12345678-9',
-                        'subscriptions': 8,
-                        'status': 'active',
-                        'created_at': '2023-05-15T10:30:00'
-                    },
-                    {
-                        'id': '3',
-                        'email': 'cliente@ejemplo.cl',
-                        'password': 'cliente123',
-                        'name': 'Cliente Ejemplo',
-                        'user_type': 'customer',
-                        'created_at': '2023-06-20T14:15:00'
-                    },
-                    {
-                        'id': '4',
-                        'email': 'tech@solutions.cl',
-                        'password': 'tech123',
-                        'name': 'Tech Solutions',
-                        'user_type': 'business',
-                        'business_name': 'Tech Solutions SA',
-                        'tax_id': '76543210-1',
-                        'subscriptions': 12,
-                        'status': 'active',
-                        'created_at': '2023-07-10T09:45:00'
-                    },
-                    {
-                        'id': '5',
-                        'email': 'marketing@digital.cl',
-                        'password': 'marketing123',
-                        'name': 'Marketing Digital',
-                        'user_type': 'business',
-                        'business_name': 'Digital Marketing SpA',
-                        'tax_id': '98765432-1',
-                        'subscriptions': 5,
-                        'status': 'pending',
-                        'created_at': '2023-08-05T16:20:00'
-                    },
-                    {
-                        'id': '6',
-                        'email': 'cloud@services.cl',
-                        'password': 'cloud123',
-                        'name': 'Cloud Services',
-                        'user_type': 'business',
-                        'business_name': 'Cloud Services Ltda',
-                        'tax_id': '54321678-9',
-                        'subscriptions': 3,
-                        'status': 'active',
-                        'created_at': '2023-09-12T11:10:00'
-                }
-            ],
-            'subscriptions': [
-                {
-                    'id': '1',
-                    'business_id': '2',  # Empresa Ejemplo
-                    'customer_id': '3',  # Cliente Ejemplo
-                    'plan_id': '1',      # Plan Básico
-                    'start_date': '2023-05-15',
-                    'renewal_date': '2023-06-15',
-                    'status': 'active',
-                    'payment_method': 'Visa **** 4242',
-                    'monthly_amount': 9900,
-                    'created_at': '2023-05-15T10:30:00'
-                },
-                {
-                    'id': '2',
-                    'business_id': '2',  # Empresa Ejemplo
-                    'customer_id': '6',  # Otro cliente (agregar a users si no existe)
-                    'plan_id': '2',      # Plan Premium
-                    'start_date': '2023-04-10',
-                    'renewal_date': '2023-06-10',
-                    'status': 'active',
-                    'payment_method': 'Mastercard **** 5555',
-                    'monthly_amount': 19900,
-                    'created_at': '2023-04-10T14:15:00'
-                },
-                {
-                    'id': '3',
-                    'business_id': '2',  # Empresa Ejemplo
-                    'customer_id': '7',  # Otro cliente (agregar a users si no existe)
-                    'plan_id': '1',      # Plan Básico
-                    'start_date': '2023-01-20',
-                    'renewal_date': '2023-07-20',
-                    'status': 'cancelled',
-                    'payment_method': 'Transferencia bancaria',
-                    'monthly_amount': 9900,
-                    'created_at': '2023-01-20T09:45:00'
-                }
-            ],
-                # En la función init_db(), agregar esto al diccionario _db:
-            'subscription_plans': [
-                    {
-                        'id': '1',
-                        'business_id': '2',  # Empresa Ejemplo
-                        'nombre': "Plan Básico",
-                        'precio': 9900,
-                        'moneda': "CLP",
-                        'periodo': "mes",
-                        'descripcion': "Acceso básico a las funcionalidades",
-                        'caracteristicas': ["Soporte por email", "Acceso básico"],
-                        'estado': "activo",
-                        'created_at': '2023-01-01T00:00:00'
-                    },
-                    {
-                        'id': '2',
-                        'business_id': '2',  # Empresa Ejemplo
-                        'nombre': "Plan Premium",
-                        'precio': 19900,
-                        'moneda': "CLP",
-                        'periodo': "mes",
-                        'descripcion': "Acceso completo con soporte prioritario",
-                        'caracteristicas': ["Soporte 24/7", "Acceso completo", "Actualizaciones"],
-                        'estado': "activo",
-                        'created_at': '2023-01-01T00:00:00'
-                    }
-                ],
-                'system_settings': {
-                    'system_name': 'Suscridash',
-                    'currency': 'CLP',
-                    'logo_url': '',
-                    'session_timeout': 30,  # minutos
-                    'email_notifications': True,
-                    'app_notifications': True,
-                    'created_at': '2023-01-01T00:00:00',
-                    'updated_at': '2023-01-01T00:00:00'
-                }
-            }
-            save_db()   
+            _snapshot_stamp = _stat_snapshot()
+            if seeded:
+                save_db()
+        if DB_FLUSH_INTERVAL > 0 and background:
+            _start_flusher()
+        storage_metrics['load_seconds'] = time.perf_counter() - started
 
+@_pluggable
 def save_db():
-    with open(DB_FILE, 'w') as f:
-        json.dump(_db, f, indent=2)
+    # Snapshot completo. En modo journal el snapshot se escribe como parte de
+    # una compactación, para que snapshot y journal sigan siendo coherentes
+    # para todos los workers.
+    _ensure_db()
+    with _file_lock():
+        _flush_pending()
+        if DB_JOURNAL:
+            _catch_up()
+            _rotate_journal()
+        else:
+            _sync_snapshot()
+            _write_snapshot()
+
+@_pluggable
+def sync_db():
+    # Escribe ya los cambios pendientes del group commit y los fuerza a disco
+    if _db is None:
+        return
+    with _file_lock():
+        _flush_pending()
+        if DB_JOURNAL:
+            os.fsync(_journal.fileno())
 
+@_pluggable
+def refresh_db():
+    # Incorpora lo que otros workers agregaron al journal. Si no hubo cambios
+    # cuesta un solo stat, así que se puede llamar en cada request.
+    if _db is None:
+        return
+    if not DB_JOURNAL:
+        if _stat_snapshot() != _snapshot_stamp:
+            with _file_lock():
+                _sync_snapshot()
+        return
+    try:
+        st = os.stat(JOURNAL_FILE)
+    except FileNotFoundError:
+        return
+    if st.st_ino != _journal_ino:
+        # Hubo una compactación: el cambio de archivo se hace con el flock
+        # tomado para no saltarse un journal intermedio
+        with _file_lock():
+            _catch_up()
+    elif st.st_size != _journal_offset:
+        with _lock:
+            _read_journal()
+
+@_pluggable
 def get_db():
+    # Foto consistente del dataset con la forma del JSON (registros como dict)
+    _ensure_db()
+    with _lock:
+        snapshot = _snapshot()
+    for collection in _indexes:
+        snapshot[collection] = [record.to_dict() for record in snapshot[collection]]
+    return snapshot
+
+@_pluggable
+def get_record(collection, record_id):
+    _ensure_db()
+    return _indexes.get(collection, {}).get('id', {}).get(record_id)
+
+@_pluggable
+def find_records(collection, index, key, **filters):
+    # Copia de la lista para que el llamador pueda iterar mientras otros
+    # escriben. filters son igualdades extra sobre campos del registro.
+    _ensure_db()
+    group = _indexes.get(collection, {}).get(index, {}).get(key)
+    if not group:
+        return []
+    if not filters:
+        return list(group.values())
+    return [r for r in group.values() if all(r.get(f) == v for f, v in filters.items())]
+
+@_pluggable
+def iter_records(collection, index, key, **filters):
+    # Como find_records, pero entrega los registros de a uno: para recorrer
+    # grupos grandes sin armar más que la lista de referencias del grupo
+    _ensure_db()
+    group = _indexes.get(collection, {}).get(index, {}).get(key)
+    if not group:
+        return
+    for record in list(group.values()):
+        if all(record.get(f) == v for f, v in filters.items()):
+            yield record
+
+@_pluggable
+def count_records(collection, index, key):
+    _ensure_db()
+    return len(_indexes.get(collection, {}).get(index, {}).get(key, ()))
+
+@_pluggable
+def list_records(collection):
+    _ensure_db()
+    return list(_indexes.get(collection, {}).get('id', {}).values())
+
+@_pluggable
+def collection_sizes():
+    # {colección: cantidad de registros}
+    _ensure_db()
+    return {collection: len(indexes['id']) for collection, indexes in _indexes.items()}
+
+@_pluggable
+def page_records(collection, sort, after=None, limit=None, descending=False, key=None):
+    # Registros en el orden sort (ver SORTS) a partir del siguiente a la clave
+    # after; key es el grupo del índice que particiona la colección. Cuesta
+    # O(log n + limit). Devuelve (registros, clave para pedir la página
+    # siguiente o None si no hay más).
+    _ensure_db()
+    if sort not in SORTS[collection][1]:
+        raise KeyError(sort)
+    index = _sorted_index(collection, sort, key)
+    if index is None:
+        return [], None
+    return index.page(tuple(after) if after is not None else None, limit, descending)
+
+def recent_records(collection, n, key=None):
+    # Los n registros más nuevos por created_at (del grupo key del índice que
+    # particiona la colección, ej. 'business' en users). Se leen del extremo
+    # del índice ordenado: O(log n + n), sin ordenar el grupo.
+    return page_records(collection, 'created_at', limit=n, descending=True, key=key)[0]
+
+@_pluggable
+def find_user(email, user_type):
+    users = find_records('users', 'login', (email, user_type))
+    return users[0] if users else None
+
+@_pluggable
+def insert_record(collection, record):
+    _commit({'op': 'insert', 'collection': collection, 'record': record})
+    return record
+
+@_pluggable
+def update_record(collection, record_id, changes):
+    with _lock:
+        if get_record(collection, record_id) is None:
+            return None
+        _commit({'op': 'update', 'collection': collection, 'id': record_id, 'changes': changes})
+        return get_record(collection, record_id)
+
+@_pluggable
+def delete_record(collection, record_id):
+    with _lock:
+        record = get_record(collection, record_id)
+        if record is None:
+            return None
+        _commit({'op': 'delete', 'collection': collection, 'id': record_id})
+        return record
+
+@_pluggable
+def get_settings():
+    _ensure_db()
+    return _db.get('system_settings')
+
+@_pluggable
+def update_settings(settings):
+    _commit({'op': 'settings', 'settings': settings})
+    return settings
+
+@_pluggable
+def subscribe(on_change, on_reload=None):
+    # on_change(collection, old, new) se llama por cada cambio aplicado, sea de
+    # este worker o leído del journal de otro: old es None en una inserción y
+    # new es None en un borrado ('system_settings' llega como una colección
+    # más). on_reload() se llama cuando se recargan todos los registros desde
+    # el snapshot. Ambos corren con _lock tomado: deben ser rápidos y no
+    # escribir en models.
+    _listeners.append((on_change, on_reload))
+
+@_pluggable
+def get_version(collection, tenant=None):
+    # (versión, hora del último cambio o 0) de una colección, o de la parte de
+    # una empresa si se indica tenant. La versión es un string opaco.
+    _ensure_db()
+    versions = _db.get('_meta', {}).get('versions', {})
+    version, modified = versions.get(collection if tenant is None else f'{collection}:{tenant}', (0, 0))
+    return f"{versions.get('_epoch', '')}.{version}", modified
+
+@_pluggable
+def compact_journal():
+    # Sin journal (DB_JOURNAL=0) cada escritura ya reescribe el snapshot
+    if not DB_JOURNAL or _db is None:
+        return
+    with _file_lock():
+        # Lo pendiente va al journal actual antes de pasar al snapshot, o
+        # quedaría en ambos
+        _flush_pending()
+        _catch_up()
+        if _journal_entries:
+            _rotate_journal()
+
+def fold_journal():
+    # Pasa a DB_FILE los cambios que aún estén en su journal, con cualquier
+    # DB_BACKEND. Para quien lee DB_FILE directamente (importación a SQLite,
+    # conversión de formato): sin esto perdería las últimas escrituras.
+    global _db
+    if not DB_JOURNAL or not os.path.exists(JOURNAL_FILE):
+        return
+    with _file_lock():
+        loaded = _db is None
+        if loaded:
+            _init_db(background=False)
+        _flush_pending()
+        _catch_up()
+        if _journal_entries:
+            _rotate_journal()
+        if loaded and _backend is not None:
+            # Este proceso no usa el JSON en memoria
+            _db = None
+            _indexes.clear()
+
+@contextmanager
+def _file_lock():
+    # Exclusión entre hilos (_lock) y entre procesos (flock). Es reentrante
+    # dentro del mismo hilo porque el flock se toma una sola vez.
+    global _lock_file, _lock_depth
+    with _lock:
+        if _lock_depth == 0 and fcntl is not None:
+            if _lock_file is None:
+                _lock_file = open(LOCK_FILE, 'a')
+            fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if _lock_depth == 0 and fcntl is not None:
+                fcntl.flock(_lock_file, fcntl.LOCK_UN)
+
+def _ensure_db():
     if _db is None:
         init_db()
-    return _db
\ No newline at end of file
+
+def _snapshot():
+    # Se llama con _lock tomado. Basta copiar las referencias porque los
+    # registros son inmutables (copy-on-write).
+    snapshot = dict(_db)
+    for collection, indexes in _indexes.items():
+        snapshot[collection] = list(indexes['id'].values())
+    if 'versions' in _db.get('_meta', {}):
+        # Las versiones sí cambian en el lugar
+        snapshot['_meta'] = {**_db['_meta'], 'versions': dict(_db['_meta']['versions'])}
+    return snapshot
+
+def _write_snapshot():
+    global _snapshot_stamp
+    started = time.perf_counter()
+    tmp_file = DB_FILE + '.tmp'
+    with span('models.write_snapshot') as current, open(tmp_file, 'wb') as f:
+        data = encode_snapshot(_snapshot(), DB_FORMAT)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        current.set_attribute('bytes', len(data))
+    _replace_keeping_backup(tmp_file, DB_FILE)
+    _snapshot_stamp = _stat_snapshot()
+    storage_metrics['snapshot_writes'] += 1
+    storage_metrics['snapshot_bytes'] += len(data)
+    storage_metrics['snapshot_seconds'] += time.perf_counter() - started
+
+def encode_snapshot(data, fmt):
+    if fmt == 'json':
+        return json.dumps(data, indent=2, default=to_json).encode('utf-8')
+    if fmt == 'compact':
+        return json.dumps(data, separators=(',', ':'), default=to_json).encode('utf-8')
+    if fmt == 'columnar':
+        return json.dumps(_to_columnar(data), separators=(',', ':'), default=to_json).encode('utf-8')
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError('DB_FORMAT=msgpack requiere el paquete msgpack')
+        return msgpack.packb(data, default=to_json)
+    raise ValueError(f'Formato de snapshot desconocido: {fmt}')
+
+def decode_snapshot(data):
+    # Cualquiera de los formatos; los JSON empiezan con '{'
+    if data.lstrip()[:1] == b'{':
+        snapshot = json.loads(data)
+    elif msgpack is not None:
+        try:
+            snapshot = msgpack.unpackb(data)
+        except Exception as e:
+            # Archivo truncado o dañado: mismo error que un JSON inválido
+            raise ValueError(f'Snapshot msgpack inválido: {e}') from e
+    else:
+        raise ValueError('Snapshot binario y el paquete msgpack no está instalado')
+    return _from_columnar(snapshot)
+
+def read_snapshot(path):
+    with open(path, 'rb') as f:
+        return decode_snapshot(f.read())
+
+def _to_columnar(data):
+    # Cada forma distinta de registro (conjunto ordenado de claves) se guarda
+    # una vez en columns; cada fila es [forma, valor, valor, ...]
+    result = dict(data)
+    for collection in INDEXES:
+        if collection not in data:
+            continue
+        shapes = {}
+        rows = []
+        for record in data[collection]:
+            shape = shapes.setdefault(tuple(record), len(shapes))
+            rows.append([shape, *record.values()])
+        result[collection] = {'columns': [list(shape) for shape in shapes], 'rows': rows}
+    return result
+
+def _from_columnar(data):
+    for collection in INDEXES:
+        table = data.get(collection)
+        if not isinstance(table, dict):
+            continue
+        columns = table['columns']
+        data[collection] = [dict(zip(columns[row[0]], row[1:])) for row in table['rows']]
+    return data
+
+def _backup_name(path, number):
+    return path if number == 0 else f'{path}.{number}'
+
+def _replace_keeping_backup(tmp_file, path):
+    # Corre las copias (.1 -> .2, ...), deja la versión actual como .1 y pone
+    # la nueva en su lugar. La actual se enlaza en vez de renombrarse para que
+    # path exista en todo momento.
+    if DB_SNAPSHOT_KEEP > 0 and os.path.exists(path):
+        for number in range(DB_SNAPSHOT_KEEP - 1, 0, -1):
+            older = _backup_name(path, number)
+            if os.path.exists(older):
+                os.replace(older, _backup_name(path, number + 1))
+        backup = _backup_name(path, 1)
+        if os.path.exists(backup):
+            os.remove(backup)
+        try:
+            os.link(path, backup)
+        except OSError:
+            # Sistemas de archivos sin enlaces duros
+            shutil.copyfile(path, backup)
+    os.replace(tmp_file, path)
+    _fsync_dir(path)
+
+def _fsync_dir(path):
+    # El rename solo es durable cuando se sincroniza el directorio
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:  # Windows no permite abrir directorios
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _load_snapshot():
+    # Carga DB_FILE o, si falta o está dañado, la copia anterior válida más
+    # nueva. Devuelve el número de la copia usada (0 = DB_FILE) o None si no
+    # hay ninguna.
+    global _db
+    for number in range(DB_SNAPSHOT_KEEP + 1):
+        try:
+            _db = read_snapshot(_backup_name(DB_FILE, number))
+            return number
+        except (OSError, ValueError):
+            continue
+    return None
+
+def _index_add(collection, record):
+    record = make_record(collection, record)
+    indexes = _indexes.setdefault(collection, {'id': {}})
+    indexes['id'][record['id']] = record
+    for name, key_func in INDEXES.get(collection, {}).items():
+        indexes.setdefault(name, {}).setdefault(key_func(record), {})[record['id']] = record
+    for index in _sorted_group(collection, record).values():
+        index.add(record)
+    return record
+
+def _index_remove(collection, record):
+    indexes = _indexes[collection]
+    del indexes['id'][record['id']]
+    for name, key_func in INDEXES.get(collection, {}).items():
+        _group_remove(indexes[name], key_func(record), record['id'])
+    for index in _sorted_group(collection, record).values():
+        index.remove(record)
+
+def _index_replace(collection, old, new):
+    # Reemplaza la versión anterior de un registro conservando su posición en
+    # cada índice cuya clave no cambió
+    indexes = _indexes[collection]
+    indexes['id'][new['id']] = new
+    for name, key_func in INDEXES.get(collection, {}).items():
+        old_key, new_key = key_func(old), key_func(new)
+        if old_key == new_key:
+            indexes[name][new_key][new['id']] = new
+        else:
+            _group_remove(indexes[name], old_key, old['id'])
+            indexes[name].setdefault(new_key, {})[new['id']] = new
+    old_group = _sorted_group(collection, old)
+    new_group = _sorted_group(collection, new)
+    if old_group is new_group:
+        for index in new_group.values():
+            index.replace(old, new)
+    else:
+        for index in old_group.values():
+            index.remove(old)
+        for index in new_group.values():
+            index.add(new)
+
+def _group_remove(index, key, record_id):
+    group = index[key]
+    del group[record_id]
+    if not group:
+        del index[key]
+
+class SortedIndex:
+    # Registros ordenados por key_func, en bloques de a lo más 2 * CHUNK. Es
+    # copy-on-write como los demás índices: una escritura copia solo el bloque
+    # que cambia y la lista de bloques, así que una lectura recorre la versión
+    # que tomó sin lock y sin ver una inserción a medias.
+    CHUNK = 512
+
+    __slots__ = ('key_func', 'chunks')
+
+    def __init__(self, key_func, records=()):
+        self.key_func = key_func
+        records = sorted(records, key=key_func)
+        self.chunks = [records[i:i + self.CHUNK] for i in range(0, len(records), self.CHUNK)]
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def _bisect(self, items, key, right, key_func):
+        # bisect sobre key_func (bisect recién acepta key= desde Python 3.10)
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = key_func(items[mid])
+            if mid_key < key or (right and mid_key == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _locate(self, chunks, key, right=False):
+        # (bloque, posición) del primer registro con clave >= key (> si right)
+        key_func = self.key_func
+        ci = self._bisect(chunks, key, right, lambda chunk: key_func(chunk[-1]))
+        if ci == len(chunks):
+            return ci, 0
+        return ci, self._bisect(chunks[ci], key, right, key_func)
+
+    def add(self, record):
+        chunks = self.chunks
+        if not chunks:
+            self.chunks = [[record]]
+            return
+        ci, i = self._locate(chunks, self.key_func(record))
+        if ci == len(chunks):
+            ci, i = ci - 1, len(chunks[-1])
+        chunk = chunks[ci][:i] + [record] + chunks[ci][i:]
+        if len(chunk) > 2 * self.CHUNK:
+            replacement = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+        else:
+            replacement = [chunk]
+        self.chunks = chunks[:ci] + replacement + chunks[ci + 1:]
+
+    def remove(self, record):
+        chunks = self.chunks
+        ci, i = self._locate(chunks, self.key_func(record))
+        if ci == len(chunks) or chunks[ci][i]['id'] != record['id']:
+            return
+        chunk = chunks[ci][:i] + chunks[ci][i + 1:]
+        self.chunks = chunks[:ci] + ([chunk] if chunk else []) + chunks[ci + 1:]
+
+    def replace(self, old, new):
+        key = self.key_func(old)
+        if key != self.key_func(new):
+            self.remove(old)
+            self.add(new)
+            return
+        chunks = self.chunks
+        ci, i = self._locate(chunks, key)
+        chunk = list(chunks[ci])
+        chunk[i] = new
+        self.chunks = chunks[:ci] + [chunk] + chunks[ci + 1:]
+
+    def page(self, after=None, limit=None, descending=False):
+        chunks = self.chunks
+        page = []
+        if descending:
+            if after is None:
+                ci, i = len(chunks) - 1, len(chunks[-1]) if chunks else 0
+            else:
+                ci, i = self._locate(chunks, after)
+                if ci == len(chunks):
+                    ci, i = ci - 1, len(chunks[-1]) if chunks else 0
+            # Se recorre hacia atrás desde el registro anterior a (ci, i)
+            while ci >= 0 and (limit is None or len(page) < limit):
+                take = chunks[ci][:i]
+                if limit is not None:
+                    take = take[max(0, len(take) - (limit - len(page))):]
+                page.extend(reversed(take))
+                i = i - len(take)
+                if i == 0:
+                    ci -= 1
+                    i = len(chunks[ci]) if ci >= 0 else 0
+            more = ci >= 0 and (i > 0 or ci > 0)
+        else:
+            ci, i = (0, 0) if after is None else self._locate(chunks, after, right=True)
+            while ci < len(chunks) and (limit is None or len(page) < limit):
+                take = chunks[ci][i:] if limit is None else chunks[ci][i:i + limit - len(page)]
+                page.extend(take)
+                i += len(take)
+                if i >= len(chunks[ci]):
+                    ci, i = ci + 1, 0
+            more = ci < len(chunks)
+        return page, (self.key_func(page[-1]) if more and page else None)
+
+def _sorted_group(collection, record):
+    # Índices ordenados ya armados ({orden: SortedIndex}) del grupo del
+    # registro; los que todavía no se pidieron no hay que mantenerlos
+    groups = _sorted.get(collection)
+    if not groups:
+        return {}
+    partition = SORTS[collection][0]
+    return groups.get(INDEXES[collection][partition](record) if partition else None, {})
+
+def _sorted_index(collection, sort, key):
+    # Cada índice ordenado se arma en el primer page_records que lo usa (y de
+    # nuevo después de recargar el snapshot): ordenar todos los grupos por
+    # todas las claves al arrancar costaba más que la carga misma. Se arma
+    # con _lock tomado para que ningún cambio quede entre medio.
+    index = _sorted.get(collection, {}).get(key, {}).get(sort)
+    if index is not None:
+        return index
+    partition, sorts = SORTS[collection]
+    with _lock:
+        records = _indexes[collection]['id'] if partition is None else _indexes[collection][partition].get(key)
+        if records is None:
+            return None
+        group = _sorted.setdefault(collection, {}).setdefault(key, {})
+        if sort not in group:
+            group[sort] = SortedIndex(sorts[sort], records.values())
+        return group[sort]
+
+def _build_index(rows, records, key_func):
+    # Carga completa: un índice secundario en una sola pasada. La clave se
+    # calcula sobre el dict cargado, que es más rápido de leer que el Record.
+    index = {}
+    for row, record in zip(rows, records):
+        key = key_func(row)
+        group = index.get(key)
+        if group is None:
+            group = index[key] = {}
+        group[row['id']] = record
+    return index
+
+def _rebuild_indexes():
+    # Los registros pasan de las listas de _db a los índices. El GC se
+    # suspende mientras tanto y después los registros pasan a la generación
+    # permanente (gc.freeze): cada tanda de objetos nuevos dispararía una
+    # pasada que los recorre todos y no encuentra nada, porque los registros
+    # no forman ciclos. Igual se liberan por conteo de referencias.
+    _indexes.clear()
+    _sorted.clear()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for collection in INDEXES:
+            rows = _db.pop(collection, [])
+            records = make_records(collection, rows)
+            indexes = _indexes[collection] = {'id': dict(zip([row['id'] for row in rows], records))}
+            for name, key_func in INDEXES[collection].items():
+                indexes[name] = _build_index(rows, records, key_func)
+    finally:
+        gc.freeze()
+        if gc_enabled:
+            gc.enable()
+    for _, on_reload in _listeners:
+        if on_reload is not None:
+            on_reload()
+
+def _apply(entry):
+    # Se llama con _lock tomado
+    op = entry['op']
+    if op == 'settings':
+        old = _db.get('system_settings')
+        _db['system_settings'] = entry['settings']
+        _bump_versions('system_settings', old, entry['settings'], entry.get('ts'))
+        _notify('system_settings', old, entry['settings'])
+        return
+
+    collection = entry['collection']
+    if op == 'insert':
+        record = _index_add(collection, entry['record'])
+        _bump_versions(collection, None, record, entry.get('ts'))
+        _notify(collection, None, record)
+        return
+
+    record = _indexes.get(collection, {}).get('id', {}).get(entry['id'])
+    if record is None:
+        return
+    if op == 'update':
+        new = make_record(collection, {**record, **entry['changes']})
+        _index_replace(collection, record, new)
+        _bump_versions(collection, record, new, entry.get('ts'))
+        _notify(collection, record, new)
+    elif op == 'delete':
+        _index_remove(collection, record)
+        _bump_versions(collection, record, None, entry.get('ts'))
+        _notify(collection, record, None)
+
+def _bump_versions(collection, old, new, ts):
+    # Se llama con _lock tomado. Las entradas escritas antes de guardar la
+    # hora (ts) conservan la hora anterior.
+    versions = _db.setdefault('_meta', {}).setdefault('versions', {})
+    if '_epoch' not in versions:
+        # Distingue estas versiones de las de otra base que empiece de cero.
+        # Sale de la entrada para que todos los workers lleguen al mismo valor.
+        versions['_epoch'] = str(ts or 0)
+    scopes = {collection}
+    field = TENANT_FIELDS.get(collection)
+    for record in (old, new):
+        if field is not None and record is not None and record.get(field):
+            scopes.add(f'{collection}:{record.get(field)}')
+    for scope in scopes:
+        version, modified = versions.get(scope, (0, 0))
+        versions[scope] = [version + 1, ts or modified]
+
+def _notify(collection, old, new):
+    for on_change, _ in _listeners:
+        on_change(collection, old, new)
+
+def _commit(entry):
+    global _dirty
+    _ensure_db()
+    entry['ts'] = round(time.time(), 3)
+    if DB_FLUSH_INTERVAL > 0:
+        # Group commit: solo memoria; el hilo de escritura hace el resto. Los
+        # cambios de otros workers que lleguen antes del flush se aplican
+        # después de estos, aunque en el journal queden antes.
+        with _lock:
+            _apply(entry)
+            _pending.append(entry)
+            _dirty = True
+            if len(_pending) >= DB_FLUSH_MAX_PENDING:
+                _flush_requested.set()
+        return
+
+    if not DB_JOURNAL:
+        with _file_lock():
+            _sync_snapshot()
+            _apply(entry)
+            _write_snapshot()
+        return
+
+    with _file_lock():
+        # Primero lo que escribieron otros workers, para aplicar en el mismo
+        # orden en que queda el journal
+        _catch_up()
+        _append([entry])
+        _apply(entry)
+
+def _append(entries):
+    global _journal_offset, _journal_entries
+    if os.fstat(_journal.fileno()).st_size > _journal_offset:
+        # Cola truncada por un worker que murió a mitad de escritura: se
+        # descarta para que estas entradas no queden pegadas a ella
+        _journal.truncate(_journal_offset)
+
+    data = ''.join(json.dumps(entry, default=to_json) + '\n' for entry in entries).encode('utf-8')
+    with span('models.journal_append', bytes=len(data)):
+        _journal.write(data)
+        _journal.flush()
+    _journal_offset += len(data)
+    storage_metrics['journal_appends'] += 1
+    storage_metrics['journal_bytes'] += len(data)
+    _journal_entries += len(entries)
+    if _journal_entries >= JOURNAL_COMPACT_THRESHOLD:
+        _compact_requested.set()
+
+def _flush_pending():
+    # Se llama con el flock tomado
+    global _pending, _dirty
+    if not _dirty:
+        return
+    if DB_JOURNAL:
+        _catch_up()
+        _append(_pending)
+    else:
+        _sync_snapshot()
+        _write_snapshot()
+    _pending = []
+    _dirty = False
+
+def _load_journal():
+    # Se llama con el flock tomado. El journal empieza con una cabecera cuyo
+    # journal_id debe coincidir con el del snapshot; si no coincide es un
+    # journal que ya quedó incluido en el snapshot (caída durante una
+    # compactación) y se descarta.
+    snapshot_id = _db.get('_meta', {}).get('journal_id')
+    if os.path.exists(JOURNAL_FILE):
+        _open_journal()
+        if _journal_follows(_journal_header, snapshot_id, DB_FILE) or (_journal_id is None and snapshot_id is None):
+            _read_journal()
+            if _journal_id is not None:
+                return
+    elif _stat_snapshot() is not None:
+        _start_journal(snapshot_id)
+        return
+    # No corresponde al snapshot o es del formato anterior sin cabecera (que
+    # ya se aplicó): se parte uno nuevo
+    _rotate_journal()
+
+def _journal_follows(header, snapshot_id, path):
+    # Si el journal con esa cabecera parte del snapshot path: tiene su
+    # journal_id o, si el snapshot nunca se compactó (no tiene journal_id),
+    # el inodo y mtime que tenía path al crear el journal
+    if snapshot_id is not None:
+        return header.get('journal_id') == snapshot_id
+    return header.get('snapshot') is not None and tuple(header['snapshot']) == _stat_snapshot(path)
+
+def _start_journal(snapshot_id):
+    # Primer arranque sobre un snapshot sin journal: se crea un journal vacío
+    # que lo sigue en vez de compactar, que reescribiría el snapshot completo
+    # sin que haya cambiado nada. Se llama con el flock tomado.
+    header = {'journal_id': snapshot_id or uuid.uuid4().hex, 'previous_id': None}
+    if snapshot_id is None:
+        header['snapshot'] = _stat_snapshot()
+    tmp_file = JOURNAL_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, JOURNAL_FILE)
+    _fsync_dir(JOURNAL_FILE)
+    _open_journal()
+
+def _open_journal():
+    # Abre el journal actual y lee su cabecera. Devuelve el journal_id del
+    # journal anterior según la cabecera.
+    global _journal, _journal_reader, _journal_ino, _journal_id, _journal_header, _journal_offset, _journal_entries
+    for f in (_journal, _journal_reader):
+        if f is not None:
+            f.close()
+    _journal_reader = open(JOURNAL_FILE, 'rb')
+    _journal = open(JOURNAL_FILE, 'ab')
+    _journal_ino = os.fstat(_journal_reader.fileno()).st_ino
+    _journal_entries = 0
+
+    first_line = _journal_reader.readline()
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        header = {}
+    if first_line.endswith(b'\n') and 'journal_id' in header:
+        _journal_id = header['journal_id']
+        _journal_header = header
+        _journal_offset = len(first_line)
+        return header.get('previous_id')
+    # Formato anterior sin cabecera: todo el archivo son entradas
+    _journal_id = None
+    _journal_header = {}
+    _journal_offset = 0
+    return None
+
+def _rotate_journal():
+    # Compactación: el estado en memoria pasa al snapshot y se reemplaza el
+    # journal por uno vacío. Se llama con el flock tomado.
+    journal_id = uuid.uuid4().hex
+    tmp_file = JOURNAL_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'journal_id': journal_id, 'previous_id': _journal_id}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    _db.setdefault('_meta', {})['journal_id'] = journal_id
+    _write_snapshot()
+    # El journal retirado queda como copia junto al snapshot que lo precede
+    _replace_keeping_backup(tmp_file, JOURNAL_FILE)
+    _open_journal()
+
+def _recover_from_backup(number):
+    # Se llama con el flock tomado, después de cargar DB_FILE.<number>. Ese
+    # snapshot fue seguido por JOURNAL_FILE.<number>, luego .<number - 1>,
+    # ..., .1 y por último el journal actual; se aplican en orden mientras la
+    # cadena de cabeceras esté completa y se escribe un snapshot nuevo.
+    global _journal_id
+    expected = _db.get('_meta', {}).get('journal_id')
+    previous = None
+    for k in range(number, -1, -1):
+        header, entries = _read_journal_file(_backup_name(JOURNAL_FILE, k))
+        if header is None:
+            break
+        if previous is None:
+            if not _journal_follows(header, expected, _backup_name(DB_FILE, number)):
+                break
+        elif header.get('previous_id') != previous:
+            break
+        for entry in entries:
+            _apply(entry)
+        previous = header['journal_id']
+    _journal_id = previous
+    _rotate_journal()
+
+def _read_journal_file(path):
+    # Cabecera y entradas completas de un journal que no está en uso
+    try:
+        with open(path, 'rb') as f:
+            lines = f.read().split(b'\n')[:-1]
+    except OSError:
+        return None, []
+    try:
+        header = json.loads(lines[0]) if lines else {}
+    except ValueError:
+        header = {}
+    if 'journal_id' not in header:
+        return None, []
+    entries = []
+    for line in lines[1:]:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return header, entries
+
+def _catch_up():
+    # Se llama con el flock tomado
+    if not DB_JOURNAL:
+        return
+    if os.stat(JOURNAL_FILE).st_ino != _journal_ino:
+        # Otro worker compactó: se termina de leer el journal anterior (sigue
+        # abierto) y se continúa con el nuevo, que parte donde termina el
+        # snapshot que escribió ese worker
+        _read_journal()
+        previous_id = _journal_id
+        if _open_journal() != previous_id:
+            # Hubo más de una compactación desde la última lectura y el
+            # journal intermedio ya no existe: se recarga el snapshot
+            _reload_snapshot()
+    _read_journal()
+
+def _stat_snapshot(path=None):
+    try:
+        st = os.stat(path or DB_FILE)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+def _sync_snapshot():
+    # Se llama con el flock tomado, sin journal: recarga DB_FILE si otro
+    # worker lo reescribió
+    global _snapshot_stamp
+    stamp = _stat_snapshot()
+    if stamp is not None and stamp != _snapshot_stamp:
+        _reload_snapshot()
+        _snapshot_stamp = stamp
+
+def _reload_snapshot():
+    global _db
+    _db = read_snapshot(DB_FILE)
+    _rebuild_indexes()
+    # Los cambios locales del group commit todavía no están en el snapshot
+    for entry in _pending:
+        _apply(entry)
+
+def _read_journal():
+    global _journal_offset, _journal_entries
+    _journal_reader.seek(_journal_offset)
+    data = _journal_reader.read()
+    # Solo líneas completas; una línea a medias es una escritura en curso o
+    # la cola de un worker que murió
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        _apply(entry)
+        _journal_entries += 1
+    _journal_offset += end
+
+def _compaction_loop():
+    while True:
+        _compact_requested.wait(JOURNAL_COMPACT_INTERVAL)
+        _compact_requested.clear()
+        try:
+            compact_journal()
+        except OSError:
+            # Se reintenta en el siguiente ciclo; el journal sigue intacto
+            pass
+
+def _start_compactor():
+    global _compactor
+    if _compactor is None:
+        _compactor = threading.Thread(target=_compaction_loop, name='db-compactor', daemon=True)
+        _compactor.start()
+
+def _flush_loop():
+    while True:
+        _flush_requested.wait(DB_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        try:
+            with _file_lock():
+                _flush_pending()
+        except OSError:
+            # Los cambios siguen pendientes; se reintenta en el siguiente ciclo
+            pass
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, name='db-flusher', daemon=True)
+        _flusher.start()
+        # Al terminar el worker (SIGTERM de gunicorn) se escribe lo pendiente
+        atexit.register(sync_db)
\ No newline at end of file
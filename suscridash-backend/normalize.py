@@ -0,0 +1,6 @@
+import unicodedata
+
+def fold(text):
+    # Texto para búsquedas: sin mayúsculas ni tildes ('Núñez' -> 'nunez')
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
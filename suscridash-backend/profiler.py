@@ -0,0 +1,138 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+import jwt
+from flask import request
+
+from models import DB_FILE
+from auth import decode_token
+
+# Perfilado estadístico de requests en vivo. Se activa para una fracción
+# PROFILE_SAMPLE_RATE de los requests (0 = ninguno) o para uno solo con el
+# header X-Profile: 1 y un token de administrador. Mientras haya requests
+# perfilados, un hilo toma cada PROFILE_INTERVAL segundos la pila de cada uno
+# (sys._current_frames) y cuenta cuántas veces aparece cada pila. Al terminar
+# el request se escribe en PROFILE_DIR en formato "folded" (una línea
+# "marco;marco;... muestras" por pila), que leen flamegraph.pl, speedscope e
+# inferno. Se conservan los últimos PROFILE_MAX_FILES archivos.
+#
+# El hilo necesita el GIL para tomar cada muestra, así que con handlers que
+# no lo sueltan la frecuencia real queda limitada por sys.getswitchinterval()
+# (5 ms por defecto): sirve para requests de decenas de ms en adelante.
+#
+# Sin requests perfilados el hilo espera en un Event: lo único que cuesta es
+# la comprobación en before_request. El perfil cubre desde before_request
+# hasta el último after_request; en las respuestas de streaming no incluye el
+# envío del cuerpo.
+PROFILE_DIR = os.getenv('PROFILE_DIR', DB_FILE + '.profiles')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_HEADER = 'X-Profile'
+
+_HEADER_KEY = 'HTTP_' + PROFILE_HEADER.upper().replace('-', '_')
+
+# id del hilo -> {pila: muestras} de los requests que se están perfilando
+_active = {}
+_profiling = threading.Event()
+_lock = threading.Lock()
+_sampler_pid = None
+
+def _requested(environ):
+    # X-Profile: 1 con un Bearer token de administrador válido
+    if environ.get(_HEADER_KEY) != '1':
+        return False
+    auth_header = environ.get('HTTP_AUTHORIZATION', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+    try:
+        return decode_token(auth_header[len('Bearer '):]).get('user_type') == 'admin'
+    except jwt.InvalidTokenError:
+        return False
+
+def before_request():
+    environ = request.environ
+    if not ((PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE)
+            or (_HEADER_KEY in environ and _requested(environ))):
+        return
+    if _sampler_pid != os.getpid():
+        _start_sampler()
+    environ['profiler.start'] = time.perf_counter()
+    with _lock:
+        _active[threading.get_ident()] = {}
+        _profiling.set()
+
+def after_request(response):
+    environ = request.environ
+    start = environ.get('profiler.start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    with _lock:
+        stacks = _active.pop(threading.get_ident(), {})
+        if not _active:
+            _profiling.clear()
+    rule = request.url_rule
+    name = '{}-{}-{}-{}-{}ms.folded'.format(
+        time.strftime('%Y%m%dT%H%M%S'), os.getpid(), request.method,
+        re.sub(r'[^A-Za-z0-9]+', '_', rule.rule if rule is not None else 'sin_ruta').strip('_'),
+        int(elapsed * 1000))
+    try:
+        _write_profile(name, stacks)
+    except OSError:
+        return response
+    if environ.get(_HEADER_KEY) == '1':
+        response.headers[PROFILE_HEADER + '-File'] = name
+    return response
+
+def init_app(app):
+    # Se registra primero: su before_request corre antes que los demás y su
+    # after_request después, así el perfil cubre todo el request
+    app.before_request(before_request)
+    app.after_request(after_request)
+
+def _stack(frame):
+    # 'módulo:función;...' desde la raíz hasta el marco actual
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def _sample_loop():
+    while True:
+        _profiling.wait()
+        time.sleep(PROFILE_INTERVAL)
+        frames = sys._current_frames()
+        with _lock:
+            for ident, stacks in _active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = _stack(frame)
+                    stacks[stack] = stacks.get(stack, 0) + 1
+        del frames
+
+def _start_sampler():
+    # Una vez por proceso: los hilos no sobreviven al fork de gunicorn
+    global _sampler_pid
+    with _lock:
+        if _sampler_pid == os.getpid():
+            return
+        _sampler_pid = os.getpid()
+    threading.Thread(target=_sample_loop, name='profiler-sampler', daemon=True).start()
+
+def _write_profile(name, stacks):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), 'w') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f'{stack} {count}\n')
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.folded'))
+    for old in names[:-PROFILE_MAX_FILES] if PROFILE_MAX_FILES > 0 else []:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except FileNotFoundError:
+            # Lo borró otro worker
+            pass
@@ -0,0 +1,99 @@
+import sys
+from collections.abc import Mapping
+
+# Representación compacta de los registros en memoria. Un dict por registro
+# repite las claves y reserva espacio de sobra en cada uno; con cientos de
+# miles de suscripciones por worker eso domina el RSS. Un Record guarda sus
+# valores en una tupla y las posiciones de las claves en un dict compartido
+# por todos los registros con las mismas claves en el mismo orden (la forma
+# del registro, casi siempre una o dos por colección). Se comporta como un
+# Mapping de solo lectura (record['x'], record.get('x'), {**record}), así que
+# el código que lee registros no cambia, y se convierte a dict recién al
+# serializar (jsonify, journal, snapshot).
+#
+# Armar uno cuesta poco más que copiar los valores del dict, lo que importa
+# al arrancar, cuando se arma uno por cada registro del snapshot.
+#
+# Los valores de campos que se repiten entre registros (estados, tipos, ids
+# de empresa, cliente o plan) se internan para que todos los registros
+# compartan el mismo string.
+INTERNED_FIELDS = frozenset({
+    'status', 'user_type', 'estado', 'business_id', 'customer_id', 'plan_id',
+    'business_name', 'plan_name', 'payment_method', 'moneda', 'periodo'
+})
+
+# Formas conocidas: claves -> ({clave: posición}, posiciones a internar)
+_shapes = {}
+
+def _shape(keys):
+    positions = {key: i for i, key in enumerate(keys)}
+    interned = tuple(i for i, key in enumerate(keys) if key in INTERNED_FIELDS)
+    return _shapes.setdefault(keys, (positions, interned))
+
+class Record(Mapping):
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, data):
+        keys = tuple(data)
+        keys, interned = _shapes.get(keys) or _shape(keys)
+        values = list(data.values())
+        for i in interned:
+            value = values[i]
+            if type(value) is str:
+                values[i] = sys.intern(value)
+        self._keys = keys
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        return self._values[self._keys[key]]
+
+    def get(self, key, default=None):
+        i = self._keys.get(key)
+        return default if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def to_dict(self):
+        return dict(zip(self._keys, self._values))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+class User(Record):
+    __slots__ = ()
+
+class Subscription(Record):
+    __slots__ = ()
+
+class SubscriptionPlan(Record):
+    __slots__ = ()
+
+RECORD_CLASSES = {
+    'users': User,
+    'subscriptions': Subscription,
+    'subscription_plans': SubscriptionPlan,
+}
+
+def make_record(collection, data):
+    if isinstance(data, Record):
+        return data
+    cls = RECORD_CLASSES.get(collection)
+    return cls(data) if cls is not None else data
+
+def make_records(collection, rows):
+    # Carga completa: las filas son los dicts recién leídos del snapshot
+    cls = RECORD_CLASSES.get(collection)
+    return [cls(row) for row in rows] if cls is not None else list(rows)
+
+def to_json(obj):
+    # Para el parámetro default de json.dumps / msgpack.packb
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+
+import models
+from normalize import fold
+
+# Búsqueda de suscriptores por nombre y email del cliente dentro de una
+# empresa. Cada empresa tiene un índice de trigramas del texto normalizado
+# (normalize.fold) de sus suscriptores: trigrama -> ids de suscripción. Una
+# búsqueda intersecta los conjuntos de los trigramas de la consulta,
+# empezando por el más chico, y confirma los candidatos con una comparación
+# de substring, así cuesta según los candidatos y no según el total de
+# suscripciones. Las consultas de menos de tres letras recorren los textos de
+# la empresa.
+#
+# El índice de una empresa se arma en su primera búsqueda y se mantiene al día
+# con models.subscribe (cambios de suscripciones y de nombre o email de los
+# clientes); se conservan los de las SEARCH_INDEX_BUSINESSES empresas usadas
+# más recientemente.
+#
+# Con DB_BACKEND=sqlite se usa una tabla FTS5 con tokenizer trigram
+# mantenida por triggers (storage_sqlite).
+SEARCH_INDEX_BUSINESSES = int(os.getenv('SEARCH_INDEX_BUSINESSES', '200'))
+
+# business_id -> ({sub_id: texto}, {trigrama: set de sub_id})
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _text(sub):
+    user = models.get_record('users', sub.get('customer_id'))
+    if user is None:
+        return None
+    return fold(user.get('name')) + '\n' + fold(user.get('email'))
+
+def _add(index, sub_id, text):
+    texts, grams = index
+    texts[sub_id] = text
+    for gram in _trigrams(text):
+        grams.setdefault(gram, set()).add(sub_id)
+
+def _remove(index, sub_id):
+    texts, grams = index
+    text = texts.pop(sub_id, None)
+    if text is None:
+        return
+    for gram in _trigrams(text):
+        ids = grams[gram]
+        ids.discard(sub_id)
+        if not ids:
+            del grams[gram]
+
+def _reindex(sub, removed=False):
+    # Con _indexes_lock tomado
+    index = _indexes.get(sub.get('business_id'))
+    if index is None:
+        return
+    _remove(index, sub['id'])
+    text = None if removed else _text(sub)
+    if text is not None:
+        _add(index, sub['id'], text)
+
+def _on_change(collection, old, new):
+    if collection == 'subscriptions':
+        with _indexes_lock:
+            if old is not None:
+                _reindex(old, removed=True)
+            if new is not None:
+                _reindex(new)
+    elif collection == 'users':
+        before = old and (old.get('name'), old.get('email'))
+        after = new and (new.get('name'), new.get('email'))
+        if before == after:
+            return
+        user_id = (new or old)['id']
+        with _indexes_lock:
+            for sub in models.find_records('subscriptions', 'customer_id', user_id):
+                _reindex(sub)
+
+def _on_reload():
+    with _indexes_lock:
+        _indexes.clear()
+
+def _business_index(business_id):
+    with _indexes_lock:
+        if business_id in _indexes:
+            _indexes.move_to_end(business_id)
+            return _indexes[business_id]
+    # Se arma con _lock tomado para que ningún cambio quede entre medio
+    with models._lock:
+        index = ({}, {})
+        for sub in models.find_records('subscriptions', 'business_id', business_id):
+            text = _text(sub)
+            if text is not None:
+                _add(index, sub['id'], text)
+        with _indexes_lock:
+            _indexes[business_id] = index
+            if len(_indexes) > SEARCH_INDEX_BUSINESSES:
+                _indexes.popitem(last=False)
+    return index
+
+def search_subscribers(business_id, query, status=None):
+    # Suscripciones de la empresa cuyo cliente tiene query en el nombre o el
+    # email, sin distinguir mayúsculas ni tildes; status filtra por estado
+    query = fold(query)
+    if models._backend is not None:
+        return models._backend.search_subscribers(business_id, query, status)
+    index = _business_index(business_id)
+    with _indexes_lock:
+        texts, grams = index
+        if len(query) >= 3:
+            postings = sorted((grams.get(gram, ()) for gram in _trigrams(query)), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            candidates = texts
+        ids = [sub_id for sub_id in candidates if query in texts[sub_id]]
+    records = [models.get_record('subscriptions', sub_id) for sub_id in ids]
+    return [r for r in records if r is not None and (status is None or r.get('status') == status)]
+
+models.subscribe(_on_change, _on_reload)
@@ -0,0 +1,112 @@
+import math
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import models
+
+# Agregados para /api/admin/stats mantenidos en O(1) por cada cambio (vía
+# models.subscribe, así que también cuentan los cambios de otros workers):
+# empresas por estado, suscripciones activas, MRR (suma de monthly_amount de
+# las activas) y clientes nuevos en los últimos STATS_NEW_CUSTOMERS_DAYS días.
+# Los clientes se cuentan por día de alta, así que la ventana móvil cuesta
+# O(días) al consultar y no depende de la cantidad de registros.
+#
+# Con DB_BACKEND=sqlite los mismos contadores los mantienen triggers en la
+# base (storage_sqlite), compartidos por todos los workers.
+NEW_CUSTOMERS_DAYS = int(os.getenv('STATS_NEW_CUSTOMERS_DAYS', '30'))
+
+_counters = None
+_counters_lock = threading.Lock()
+
+def _empty():
+    return {
+        'businesses_by_status': Counter(),
+        'active_subscriptions': 0,
+        'mrr': 0,
+        'customers_by_day': Counter(),
+    }
+
+def _account(counters, collection, record, sign):
+    if collection == 'users':
+        user_type = record.get('user_type')
+        if user_type == 'business':
+            _add(counters['businesses_by_status'], record.get('status') or 'active', sign)
+        elif user_type == 'customer':
+            day = (record.get('created_at') or '')[:10]
+            if day:
+                _add(counters['customers_by_day'], day, sign)
+    elif collection == 'subscriptions' and record.get('status') == 'active':
+        counters['active_subscriptions'] += sign
+        counters['mrr'] += (record.get('monthly_amount') or 0) * sign
+
+def _add(counter, key, sign):
+    counter[key] += sign
+    if not counter[key]:
+        del counter[key]
+
+def _compute():
+    counters = _empty()
+    for collection in ('users', 'subscriptions'):
+        for record in models.list_records(collection):
+            _account(counters, collection, record, 1)
+    return counters
+
+def _on_change(collection, old, new):
+    if _counters is None:
+        return
+    with _counters_lock:
+        if old is not None:
+            _account(_counters, collection, old, -1)
+        if new is not None:
+            _account(_counters, collection, new, 1)
+
+def _on_reload():
+    global _counters
+    # Se recalcula en el próximo get_stats
+    with _counters_lock:
+        _counters = None
+
+def _summary(counters, days):
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    by_day = counters['customers_by_day']
+    new_customers = sum(by_day.get((since + timedelta(days=i)).isoformat(), 0) for i in range(days + 1))
+    return {
+        'total_businesses': sum(counters['businesses_by_status'].values()),
+        'businesses_by_status': dict(counters['businesses_by_status']),
+        'active_subscriptions': counters['active_subscriptions'],
+        'mrr': counters['mrr'],
+        'new_customers': new_customers,
+        'new_customers_days': days,
+    }
+
+def get_stats():
+    global _counters
+    if models._backend is not None:
+        return models._backend.get_stats(NEW_CUSTOMERS_DAYS)
+    if _counters is None:
+        # Primer uso (o después de recargar el snapshot): recorrido completo
+        # con _lock tomado para que ningún cambio quede entre medio
+        with models._lock:
+            counters = _compute()
+            with _counters_lock:
+                _counters = counters
+    with _counters_lock:
+        return _summary(_counters, NEW_CUSTOMERS_DAYS)
+
+def check_stats():
+    # Compara los contadores incrementales con un recálculo completo.
+    # Devuelve {nombre: (incremental, recalculado)} con las diferencias.
+    if models._backend is not None:
+        return models._backend.check_stats(NEW_CUSTOMERS_DAYS)
+    with models._lock:
+        incremental = get_stats()
+        expected = _summary(_compute(), NEW_CUSTOMERS_DAYS)
+    return {
+        name: (incremental[name], value) for name, value in expected.items()
+        if not (incremental[name] == value or
+                (name == 'mrr' and math.isclose(incremental[name], value)))
+    }
+
+models.subscribe(_on_change, _on_reload)
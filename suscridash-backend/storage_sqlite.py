@@ -0,0 +1,735 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from normalize import fold
+
+# Backend SQLite para models (DB_BACKEND=sqlite). Expone las mismas funciones
+# públicas que models, así los handlers no cambian según el backend.
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'suscridash.sqlite3')
+ITER_CHUNK_SIZE = 500
+# Empresas con hasta SEARCH_SCAN_MAX suscripciones se buscan recorriendo sus
+# filas (por el índice de business_id); las más grandes, con el índice FTS5
+SEARCH_SCAN_MAX = int(os.getenv('SEARCH_SCAN_MAX', '5000'))
+
+# Columnas reales de cada tabla. Los campos de un registro que no tienen
+# columna propia se guardan como JSON en la columna extra.
+TABLES = {
+    'users': [
+        'id', 'email', 'password', 'name', 'user_type', 'business_name',
+        'tax_id', 'subscriptions', 'status', 'phone', 'created_at'
+    ],
+    'subscriptions': [
+        'id', 'business_id', 'customer_id', 'plan_id', 'business_name',
+        'plan_name', 'start_date', 'renewal_date', 'status', 'payment_method',
+        'monthly_amount', 'created_at'
+    ],
+    'subscription_plans': [
+        'id', 'business_id', 'nombre', 'precio', 'moneda', 'periodo',
+        'descripcion', 'caracteristicas', 'estado', 'created_at'
+    ],
+}
+JSON_COLUMNS = {'caracteristicas'}
+
+# Índices lógicos de models.INDEXES expresados como columnas
+INDEX_COLUMNS = {
+    'users': {
+        'user_type': ('user_type',),
+        'email': ('email',),
+        'login': ('email', 'user_type'),
+    },
+    'subscriptions': {
+        'business_id': ('business_id',),
+        'customer_id': ('customer_id',),
+    },
+    'subscription_plans': {
+        'business_id': ('business_id',),
+    },
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    password TEXT,
+    name TEXT,
+    user_type TEXT NOT NULL,
+    business_name TEXT,
+    tax_id TEXT,
+    subscriptions INTEGER,
+    status TEXT,
+    phone TEXT,
+    created_at TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_login ON users (email, user_type);
+-- Uno por cada orden de models.SORTS, con la misma expresión que ORDER BY en
+-- page_records, así las páginas (y los "más recientes") se leen del índice
+-- sin ordenar todo el grupo
+CREATE INDEX IF NOT EXISTS idx_users_type_created ON users (user_type, COALESCE(created_at, ''), id);
+CREATE INDEX IF NOT EXISTS idx_users_type_email ON users (user_type, COALESCE(email, ''), id);
+CREATE INDEX IF NOT EXISTS idx_users_type_name ON users (user_type, COALESCE(name, ''), id);
+CREATE INDEX IF NOT EXISTS idx_users_type_business_name ON users (user_type, COALESCE(business_name, ''), id);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id TEXT PRIMARY KEY,
+    business_id TEXT,
+    customer_id TEXT,
+    plan_id TEXT,
+    business_name TEXT,
+    plan_name TEXT,
+    start_date TEXT,
+    renewal_date TEXT,
+    status TEXT,
+    payment_method TEXT,
+    monthly_amount NUMERIC,
+    created_at TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_business ON subscriptions (business_id, status);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_customer ON subscriptions (customer_id, status);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_recent ON subscriptions (COALESCE(created_at, ''), id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_renewal ON subscriptions (COALESCE(renewal_date, ''), id);
+
+CREATE TABLE IF NOT EXISTS subscription_plans (
+    id TEXT PRIMARY KEY,
+    business_id TEXT,
+    nombre TEXT,
+    precio NUMERIC,
+    moneda TEXT,
+    periodo TEXT,
+    descripcion TEXT,
+    caracteristicas TEXT,
+    estado TEXT,
+    created_at TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_plans_business ON subscription_plans (business_id, estado);
+
+CREATE TABLE IF NOT EXISTS system_settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Contadores de stats.py mantenidos por triggers: empresas por estado
+# ('businesses:<estado>'), suscripciones activas, MRR y clientes por día de
+# alta. Así todos los workers leen los mismos valores en tiempo constante.
+def _users_stats_sql(row, sign):
+    return f"""
+    INSERT INTO stats (name, value)
+        SELECT 'businesses:' || COALESCE(NULLIF({row}.status, ''), 'active'), {sign}
+        WHERE {row}.user_type = 'business'
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+    INSERT INTO stats_customers_by_day (day, count)
+        SELECT substr({row}.created_at, 1, 10), {sign}
+        WHERE {row}.user_type = 'customer' AND COALESCE({row}.created_at, '') != ''
+        ON CONFLICT (day) DO UPDATE SET count = count + excluded.count;"""
+
+def _subscriptions_stats_sql(row, sign):
+    return f"""
+    INSERT INTO stats (name, value)
+        SELECT 'active_subscriptions', {sign} WHERE {row}.status = 'active'
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+    INSERT INTO stats (name, value)
+        SELECT 'mrr', {sign} * COALESCE({row}.monthly_amount, 0) WHERE {row}.status = 'active'
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;"""
+
+STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value NUMERIC NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats_customers_by_day (
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+    {_users_stats_sql('NEW', 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+    {_users_stats_sql('OLD', -1)}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_update AFTER UPDATE ON users BEGIN
+    {_users_stats_sql('OLD', -1)}
+    {_users_stats_sql('NEW', 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_subscriptions_insert AFTER INSERT ON subscriptions BEGIN
+    {_subscriptions_stats_sql('NEW', 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_subscriptions_delete AFTER DELETE ON subscriptions BEGIN
+    {_subscriptions_stats_sql('OLD', -1)}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_subscriptions_update AFTER UPDATE ON subscriptions BEGIN
+    {_subscriptions_stats_sql('OLD', -1)}
+    {_subscriptions_stats_sql('NEW', 1)}
+END;
+"""
+
+# Acumulados de finance.py por empresa y mes (variaciones de ingresos,
+# activas, nuevas y bajas) y contadores por estado y plan, mantenidos por
+# triggers con las mismas reglas que finance._points y finance._counts.
+def _month_sql(date):
+    return f"(CAST(substr({date}, 1, 4) AS INTEGER) * 12 + CAST(substr({date}, 6, 2) AS INTEGER) - 1)"
+
+def _finance_points_sql(row):
+    # (mes, ingresos, activas, nuevas, bajas, condición) de cada punto
+    start = _month_sql(f'{row}.start_date')
+    cancelled_at = f"COALESCE(json_extract({row}.extra, '$.cancelled_at'), {row}.start_date)"
+    end = f'MAX({start}, {_month_sql(cancelled_at)})'
+    valid = (f"{row}.business_id != '' AND {row}.status IN ('active', 'cancelled') "
+             f"AND substr({row}.start_date, 1, 4) GLOB '[0-9][0-9][0-9][0-9]' "
+             f"AND substr({row}.start_date, 6, 2) GLOB '[0-9][0-9]'")
+    amount = f'COALESCE({row}.monthly_amount, 0)'
+    cancelled = f"{valid} AND {row}.status = 'cancelled'"
+    return [
+        (start, amount, '1', '1', '0', valid),
+        (f'{end} + 1', f'-{amount}', '-1', '0', '0', cancelled),
+        (end, '0', '0', '0', '1', cancelled),
+    ]
+
+def _finance_counts_sql(row):
+    # (nombre, condición) de cada contador
+    return [
+        (f"'status:' || COALESCE({row}.status, '')", f"{row}.business_id != ''"),
+        (f"'plan:' || COALESCE(NULLIF({row}.plan_name, ''), 'Sin plan')",
+         f"{row}.business_id != '' AND {row}.status = 'active'"),
+    ]
+
+def _subscriptions_finance_sql(row, sign):
+    statements = []
+    for month, revenue, active, new, cancelled, where in _finance_points_sql(row):
+        statements.append(f"""
+    INSERT INTO finance_months (business_id, month, revenue, active, new, cancelled)
+        SELECT {row}.business_id, {month}, {sign} * {revenue}, {sign} * {active}, {sign} * {new}, {sign} * {cancelled}
+        WHERE {where}
+        ON CONFLICT (business_id, month) DO UPDATE SET
+            revenue = revenue + excluded.revenue, active = active + excluded.active,
+            new = new + excluded.new, cancelled = cancelled + excluded.cancelled;""")
+    for name, where in _finance_counts_sql(row):
+        statements.append(f"""
+    INSERT INTO finance_counts (business_id, name, value)
+        SELECT {row}.business_id, {name}, {sign} WHERE {where}
+        ON CONFLICT (business_id, name) DO UPDATE SET value = value + excluded.value;""")
+    return ''.join(statements)
+
+FINANCE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS finance_months (
+    business_id TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    revenue NUMERIC NOT NULL,
+    active INTEGER NOT NULL,
+    new INTEGER NOT NULL,
+    cancelled INTEGER NOT NULL,
+    PRIMARY KEY (business_id, month)
+);
+CREATE TABLE IF NOT EXISTS finance_counts (
+    business_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (business_id, name)
+);
+CREATE TRIGGER IF NOT EXISTS finance_subscriptions_insert AFTER INSERT ON subscriptions BEGIN
+    {_subscriptions_finance_sql('NEW', 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS finance_subscriptions_delete AFTER DELETE ON subscriptions BEGIN
+    {_subscriptions_finance_sql('OLD', -1)}
+END;
+CREATE TRIGGER IF NOT EXISTS finance_subscriptions_update AFTER UPDATE ON subscriptions BEGIN
+    {_subscriptions_finance_sql('OLD', -1)}
+    {_subscriptions_finance_sql('NEW', 1)}
+END;
+"""
+
+# Índice de búsqueda de search.py: texto normalizado (fold) de nombre y email
+# del cliente de cada suscripción, con el mismo rowid que la suscripción. Lo
+# mantienen triggers con la función fold registrada en cada conexión. El
+# tokenizer trigram de FTS5 necesita SQLite 3.34 o posterior.
+def _search_text_sql(user):
+    return f"fold({user}.name) || char(10) || fold({user}.email)"
+
+SEARCH_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS subscriber_search USING fts5(
+    text, business_id, tokenize = 'trigram'
+);
+CREATE TRIGGER IF NOT EXISTS search_subscriptions_insert AFTER INSERT ON subscriptions BEGIN
+    INSERT INTO subscriber_search (rowid, text, business_id)
+        SELECT NEW.rowid, {_search_text_sql('users')}, NEW.business_id FROM users WHERE users.id = NEW.customer_id;
+END;
+CREATE TRIGGER IF NOT EXISTS search_subscriptions_delete AFTER DELETE ON subscriptions BEGIN
+    DELETE FROM subscriber_search WHERE rowid = OLD.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS search_subscriptions_update AFTER UPDATE ON subscriptions
+WHEN OLD.business_id IS NOT NEW.business_id OR OLD.customer_id IS NOT NEW.customer_id BEGIN
+    DELETE FROM subscriber_search WHERE rowid = OLD.rowid;
+    INSERT INTO subscriber_search (rowid, text, business_id)
+        SELECT NEW.rowid, {_search_text_sql('users')}, NEW.business_id FROM users WHERE users.id = NEW.customer_id;
+END;
+CREATE TRIGGER IF NOT EXISTS search_users_insert AFTER INSERT ON users BEGIN
+    INSERT INTO subscriber_search (rowid, text, business_id)
+        SELECT rowid, {_search_text_sql('NEW')}, business_id FROM subscriptions WHERE customer_id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS search_users_delete AFTER DELETE ON users BEGIN
+    DELETE FROM subscriber_search WHERE rowid IN (SELECT rowid FROM subscriptions WHERE customer_id = OLD.id);
+END;
+CREATE TRIGGER IF NOT EXISTS search_users_update AFTER UPDATE ON users
+WHEN OLD.name IS NOT NEW.name OR OLD.email IS NOT NEW.email BEGIN
+    DELETE FROM subscriber_search WHERE rowid IN (SELECT rowid FROM subscriptions WHERE customer_id = OLD.id);
+    INSERT INTO subscriber_search (rowid, text, business_id)
+        SELECT rowid, {_search_text_sql('NEW')}, business_id FROM subscriptions WHERE customer_id = NEW.id;
+END;
+"""
+
+# Versiones de models.get_version, avanzadas por triggers en cada escritura
+# (también las de otros workers). _epoch distingue una base de otra.
+TENANT_COLUMNS = {'users': 'id', 'subscriptions': 'business_id', 'subscription_plans': 'business_id'}
+
+def _bump_version_sql(scope, where='1'):
+    return f"""
+    INSERT INTO versions (scope, version, modified)
+        SELECT {scope}, 1, (julianday('now') - 2440587.5) * 86400.0 WHERE {where}
+        ON CONFLICT (scope) DO UPDATE SET version = version + 1, modified = excluded.modified;"""
+
+def _versions_triggers_sql():
+    triggers = []
+    for collection, column in TENANT_COLUMNS.items():
+        for event, rows in (('INSERT', ['NEW']), ('DELETE', ['OLD']), ('UPDATE', ['OLD', 'NEW'])):
+            body = _bump_version_sql(f"'{collection}'")
+            for row in rows:
+                body += _bump_version_sql(f"'{collection}:' || {row}.{column}",
+                                          f"COALESCE({row}.{column}, '') != ''")
+            triggers.append(f"""
+CREATE TRIGGER IF NOT EXISTS versions_{collection}_{event.lower()} AFTER {event} ON {collection} BEGIN
+    {body}
+END;""")
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        triggers.append(f"""
+CREATE TRIGGER IF NOT EXISTS versions_system_settings_{event.lower()} AFTER {event} ON system_settings BEGIN
+    {_bump_version_sql("'system_settings'")}
+END;""")
+    return ''.join(triggers)
+
+VERSIONS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS versions (
+    scope TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+INSERT OR IGNORE INTO versions (scope, version, modified) VALUES ('_epoch', abs(random() % 100000000), 0);
+{_versions_triggers_sql()}
+"""
+
+_local = threading.local()
+_listeners = []
+
+def _connection():
+    # Una conexión por hilo de cada worker; se reabre si el proceso cambió
+    # (fork de gunicorn después de importar la app)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(SQLITE_FILE, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.create_function('fold', 1, fold, deterministic=True)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+@contextmanager
+def _transaction():
+    conn = _connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _to_record(collection, row):
+    record = {}
+    for column in TABLES[collection]:
+        value = row[column]
+        if value is None:
+            continue
+        record[column] = json.loads(value) if column in JSON_COLUMNS else value
+    if row['extra']:
+        record.update(json.loads(row['extra']))
+    return record
+
+def _to_row(collection, record):
+    columns = TABLES[collection]
+    row = []
+    for column in columns:
+        value = record.get(column)
+        if column in JSON_COLUMNS and value is not None:
+            value = json.dumps(value)
+        row.append(value)
+    extra = {k: v for k, v in record.items() if k not in columns}
+    row.append(json.dumps(extra) if extra else None)
+    return row
+
+def _insert_sql(collection):
+    columns = TABLES[collection] + ['extra']
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        collection, ', '.join(columns), ', '.join('?' * len(columns)))
+
+def _where(collection, index, key, filters):
+    # Los filtros sobre columnas reales se resuelven en SQL; los que caen en
+    # la columna extra se devuelven aparte para filtrarlos en Python
+    columns = INDEX_COLUMNS[collection][index]
+    values = list(key) if len(columns) > 1 else [key]
+    clauses = [f'{column} = ?' for column in columns]
+    leftover = {}
+    for field, value in filters.items():
+        if field in TABLES[collection]:
+            clauses.append(f'{field} = ?')
+            values.append(value)
+        else:
+            leftover[field] = value
+    return ' AND '.join(clauses), values, leftover
+
+def init_db():
+    from models import DB_FILE, read_snapshot, fold_journal, default_data, storage_metrics
+
+    started = time.perf_counter()
+    conn = _connection()
+    conn.executescript(SCHEMA + STATS_SCHEMA + FINANCE_SCHEMA + SEARCH_SCHEMA + VERSIONS_SCHEMA)
+    # Primer arranque: se importa el JSON existente una sola vez, con lo que
+    # quede en su journal, o si no hay JSON los mismos datos de ejemplo que el
+    # backend JSON. BEGIN IMMEDIATE evita que dos workers lo importen a la vez.
+    with _transaction() as conn:
+        _ensure_stats(conn)
+        _ensure_finance(conn)
+        _ensure_search(conn)
+        empty = conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() is None
+        if empty and os.path.exists(DB_FILE):
+            fold_journal()
+            _load(conn, read_snapshot(DB_FILE))
+        elif empty:
+            _load(conn, default_data())
+    storage_metrics['load_seconds'] = time.perf_counter() - started
+
+def refresh_db():
+    # Todos los workers leen la misma base; no hay nada que sincronizar
+    pass
+
+def save_db():
+    # Cada escritura ya quedó confirmada; solo se traspasa el WAL a la base
+    _connection().execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+def sync_db():
+    # Las escrituras ya están confirmadas; el checkpoint FULL las deja en el
+    # archivo principal de la base
+    _connection().execute('PRAGMA wal_checkpoint(FULL)')
+
+def compact_journal():
+    _connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+def subscribe(on_change, on_reload=None):
+    # Igual que models.subscribe, pero solo se notifican las escrituras de este
+    # proceso: los cambios de otros workers van directo a la base
+    _listeners.append((on_change, on_reload))
+
+def get_version(collection, tenant=None):
+    # Mismo contrato que models.get_version
+    rows = dict((row[0], (row[1], row[2])) for row in _connection().execute(
+        'SELECT scope, version, modified FROM versions WHERE scope IN (?, ?)',
+        ('_epoch', collection if tenant is None else f'{collection}:{tenant}')))
+    epoch = rows.pop('_epoch', (0, 0))[0]
+    version, modified = next(iter(rows.values()), (0, 0))
+    return f'{epoch}.{version}', modified
+
+def _notify(collection, old, new):
+    for on_change, _ in _listeners:
+        on_change(collection, old, new)
+
+def get_db():
+    # Vista completa con la forma del JSON, para herramientas y exportaciones
+    db = {collection: list_records(collection) for collection in TABLES}
+    settings = get_settings()
+    if settings is not None:
+        db['system_settings'] = settings
+    return db
+
+def get_record(collection, record_id):
+    row = _connection().execute(
+        f'SELECT * FROM {collection} WHERE id = ?', (record_id,)).fetchone()
+    return _to_record(collection, row) if row else None
+
+def find_records(collection, index, key, **filters):
+    where, values, leftover = _where(collection, index, key, filters)
+    rows = _connection().execute(
+        f'SELECT * FROM {collection} WHERE {where} ORDER BY rowid', values)
+    records = [_to_record(collection, row) for row in rows]
+    if leftover:
+        records = [r for r in records if all(r.get(f) == v for f, v in leftover.items())]
+    return records
+
+def iter_records(collection, index, key, **filters):
+    # Recorre el cursor de a ITER_CHUNK_SIZE filas: la memoria no depende
+    # del tamaño del grupo
+    where, values, leftover = _where(collection, index, key, filters)
+    cursor = _connection().execute(
+        f'SELECT * FROM {collection} WHERE {where} ORDER BY rowid', values)
+    while True:
+        rows = cursor.fetchmany(ITER_CHUNK_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            record = _to_record(collection, row)
+            if all(record.get(f) == v for f, v in leftover.items()):
+                yield record
+
+def count_records(collection, index, key):
+    where, values, _ = _where(collection, index, key, {})
+    return _connection().execute(
+        f'SELECT COUNT(*) FROM {collection} WHERE {where}', values).fetchone()[0]
+
+def list_records(collection):
+    rows = _connection().execute(f'SELECT * FROM {collection} ORDER BY rowid')
+    return [_to_record(collection, row) for row in rows]
+
+def collection_sizes():
+    conn = _connection()
+    return {collection: conn.execute(f'SELECT COUNT(*) FROM {collection}').fetchone()[0]
+            for collection in TABLES}
+
+def page_records(collection, sort, after=None, limit=None, descending=False, key=None):
+    # Paginación por keyset con el mismo orden y cursor que models.SORTS: la
+    # clave es (valor o '', id)
+    from models import SORTS
+
+    partition, sorts = SORTS[collection]
+    if sort not in sorts:
+        raise KeyError(sort)
+    clauses, values = [], []
+    if partition:
+        for column in INDEX_COLUMNS[collection][partition]:
+            clauses.append(f'{column} = ?')
+            values.append(key)
+    sort_key = f"COALESCE({sort}, ''), id"
+    if after is not None:
+        # La primera condición es redundante, pero SQLite solo la usa (y no la
+        # comparación de filas) para saltar directo al cursor en el índice
+        clauses.append(f"COALESCE({sort}, '') {'<=' if descending else '>='} ?")
+        clauses.append(f"({sort_key}) {'<' if descending else '>'} (?, ?)")
+        values.append(after[0])
+        values.extend(after)
+    order = 'DESC' if descending else 'ASC'
+    sql = f"SELECT * FROM {collection}{' WHERE ' + ' AND '.join(clauses) if clauses else ''} " \
+          f"ORDER BY COALESCE({sort}, '') {order}, id {order}"
+    if limit is not None:
+        # Una fila de más para saber si hay página siguiente
+        sql += ' LIMIT ?'
+        values.append(limit + 1)
+    records = [_to_record(collection, row) for row in _connection().execute(sql, values)]
+    if limit is None or len(records) <= limit:
+        return records, None
+    records = records[:limit]
+    return records, sorts[sort](records[-1])
+
+def find_user(email, user_type):
+    users = find_records('users', 'login', (email, user_type))
+    return users[0] if users else None
+
+def insert_record(collection, record):
+    with _transaction() as conn:
+        conn.execute(_insert_sql(collection), _to_row(collection, record))
+    _notify(collection, None, record)
+    return record
+
+def update_record(collection, record_id, changes):
+    with _transaction() as conn:
+        row = conn.execute(f'SELECT * FROM {collection} WHERE id = ?', (record_id,)).fetchone()
+        if row is None:
+            return None
+        old = _to_record(collection, row)
+        record = {**old, **changes}
+        columns = TABLES[collection][1:] + ['extra']
+        conn.execute(
+            'UPDATE {} SET {} WHERE id = ?'.format(collection, ', '.join(f'{c} = ?' for c in columns)),
+            _to_row(collection, record)[1:] + [record_id])
+    _notify(collection, old, record)
+    return record
+
+def delete_record(collection, record_id):
+    with _transaction() as conn:
+        row = conn.execute(f'SELECT * FROM {collection} WHERE id = ?', (record_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(f'DELETE FROM {collection} WHERE id = ?', (record_id,))
+    record = _to_record(collection, row)
+    _notify(collection, record, None)
+    return record
+
+def get_settings():
+    rows = _connection().execute('SELECT name, value FROM system_settings').fetchall()
+    if not rows:
+        return None
+    return {row['name']: json.loads(row['value']) for row in rows}
+
+def update_settings(settings):
+    old = get_settings()
+    with _transaction() as conn:
+        conn.execute('DELETE FROM system_settings')
+        conn.executemany('INSERT INTO system_settings (name, value) VALUES (?, ?)',
+                         [(name, json.dumps(value)) for name, value in settings.items()])
+    _notify('system_settings', old, settings)
+    return settings
+
+def migrate_from_json(json_file):
+    # Migración de una sola vez desde db_simulada.json: reemplaza el contenido
+    # de la base SQLite por el del snapshot (en cualquiera de sus formatos)
+    from models import read_snapshot
+
+    data = read_snapshot(json_file)
+    _connection().executescript(SCHEMA + STATS_SCHEMA + FINANCE_SCHEMA + SEARCH_SCHEMA + VERSIONS_SCHEMA)
+    with _transaction() as conn:
+        _ensure_stats(conn)
+        _ensure_finance(conn)
+        _ensure_search(conn)
+        for collection in TABLES:
+            conn.execute(f'DELETE FROM {collection}')
+        conn.execute('DELETE FROM system_settings')
+        _load(conn, data)
+    return {collection: len(data.get(collection, [])) for collection in TABLES}
+
+def _load(conn, data):
+    for collection in TABLES:
+        conn.executemany(_insert_sql(collection),
+                         [_to_row(collection, record) for record in data.get(collection, [])])
+    conn.executemany('INSERT INTO system_settings (name, value) VALUES (?, ?)',
+                     [(name, json.dumps(value)) for name, value in data.get('system_settings', {}).items()])
+
+def get_stats(days):
+    conn = _connection()
+    since = (datetime.utcnow() - timedelta(days=days)).date().isoformat()
+    stats = {row['name']: row['value'] for row in conn.execute('SELECT name, value FROM stats')}
+    new_customers = conn.execute(
+        'SELECT COALESCE(SUM(count), 0) FROM stats_customers_by_day WHERE day >= ? AND day <= ?',
+        (since, datetime.utcnow().date().isoformat())).fetchone()[0]
+    return _stats_summary(stats, new_customers, days)
+
+def check_stats(days):
+    # Mismo contrato que stats.check_stats: diferencias contra un recálculo
+    with _transaction() as conn:
+        incremental = get_stats(days)
+        stats, by_day = _aggregate_stats(conn)
+    since = (datetime.utcnow() - timedelta(days=days)).date().isoformat()
+    today = datetime.utcnow().date().isoformat()
+    expected = _stats_summary(stats, sum(c for d, c in by_day if since <= d <= today), days)
+    return {name: (incremental[name], value) for name, value in expected.items()
+            if incremental[name] != value}
+
+def _stats_summary(stats, new_customers, days):
+    by_status = {name.split(':', 1)[1]: value for name, value in stats.items()
+                 if name.startswith('businesses:') and value}
+    return {
+        'total_businesses': sum(by_status.values()),
+        'businesses_by_status': by_status,
+        'active_subscriptions': stats.get('active_subscriptions', 0),
+        'mrr': stats.get('mrr', 0),
+        'new_customers': new_customers,
+        'new_customers_days': days,
+    }
+
+def _aggregate_stats(conn):
+    # Los mismos contadores calculados desde las tablas
+    stats = {'businesses:' + row[0]: row[1] for row in conn.execute(
+        "SELECT COALESCE(NULLIF(status, ''), 'active'), COUNT(*) FROM users "
+        "WHERE user_type = 'business' GROUP BY 1")}
+    count, mrr = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(monthly_amount), 0) FROM subscriptions WHERE status = 'active'").fetchone()
+    stats['active_subscriptions'] = count
+    stats['mrr'] = mrr
+    by_day = conn.execute(
+        "SELECT substr(created_at, 1, 10), COUNT(*) FROM users "
+        "WHERE user_type = 'customer' AND COALESCE(created_at, '') != '' GROUP BY 1").fetchall()
+    return stats, [tuple(row) for row in by_day]
+
+def _ensure_stats(conn):
+    # Bases creadas antes de los triggers: se cargan los contadores una vez
+    if conn.execute("SELECT 1 FROM stats WHERE name = '_initialized'").fetchone():
+        return
+    stats, by_day = _aggregate_stats(conn)
+    conn.execute('DELETE FROM stats')
+    conn.execute('DELETE FROM stats_customers_by_day')
+    conn.executemany('INSERT INTO stats (name, value) VALUES (?, ?)',
+                     list(stats.items()) + [('_initialized', 1)])
+    conn.executemany('INSERT INTO stats_customers_by_day (day, count) VALUES (?, ?)', by_day)
+
+def get_financial_rollup(business_id):
+    # Mismo contrato que finance._rollup
+    conn = _connection()
+    months = {row[0]: list(row[1:]) for row in conn.execute(
+        'SELECT month, revenue, active, new, cancelled FROM finance_months WHERE business_id = ?',
+        (business_id,))}
+    counts = {row[0]: row[1] for row in conn.execute(
+        'SELECT name, value FROM finance_counts WHERE business_id = ? AND value != 0', (business_id,))}
+    return months, counts
+
+def _ensure_finance(conn):
+    # Bases creadas antes de los triggers: se cargan los acumulados una vez,
+    # con los mismos puntos que usan los triggers
+    if conn.execute("SELECT 1 FROM stats WHERE name = '_finance_initialized'").fetchone():
+        return
+    conn.execute('DELETE FROM finance_months')
+    conn.execute('DELETE FROM finance_counts')
+    points = ' UNION ALL '.join(
+        f'SELECT business_id, {month} AS month, {revenue} AS revenue, {active} AS active, '
+        f'{new} AS new, {cancelled} AS cancelled FROM subscriptions WHERE {where}'
+        for month, revenue, active, new, cancelled, where in _finance_points_sql('subscriptions'))
+    conn.execute(
+        'INSERT INTO finance_months (business_id, month, revenue, active, new, cancelled) '
+        'SELECT business_id, month, SUM(revenue), SUM(active), SUM(new), SUM(cancelled) '
+        f'FROM ({points}) GROUP BY business_id, month')
+    counts = ' UNION ALL '.join(
+        f'SELECT business_id, {name} AS name FROM subscriptions WHERE {where}'
+        for name, where in _finance_counts_sql('subscriptions'))
+    conn.execute(
+        'INSERT INTO finance_counts (business_id, name, value) '
+        f'SELECT business_id, name, COUNT(*) FROM ({counts}) GROUP BY business_id, name')
+    conn.execute("INSERT INTO stats (name, value) VALUES ('_finance_initialized', 1)")
+
+def search_subscribers(business_id, query, status=None):
+    # Mismo contrato que search.search_subscribers; query ya normalizado
+    conn = _connection()
+    status_sql = ' AND s.status = ?' if status is not None else ''
+    # Solo hace falta saber si pasa de SEARCH_SCAN_MAX: el conteo se corta
+    # ahí (idx_subscriptions_business)
+    size = conn.execute(
+        'SELECT COUNT(*) FROM (SELECT 1 FROM subscriptions WHERE business_id = ? LIMIT ?)',
+        (business_id, SEARCH_SCAN_MAX + 1)).fetchone()[0]
+    if len(query) >= 3 and size > SEARCH_SCAN_MAX:
+        # Frases entre comillas: con el tokenizer trigram equivalen a buscar
+        # el substring (si tienen al menos tres caracteres). CROSS JOIN fija
+        # el orden: con JOIN el planificador puede recorrer las suscripciones
+        # de la empresa y evaluar el MATCH una vez por fila.
+        match = 'text : "{}"'.format(query.replace('"', '""'))
+        rows = conn.execute(
+            'SELECT s.* FROM subscriber_search f CROSS JOIN subscriptions s ON s.rowid = f.rowid '
+            f'WHERE subscriber_search MATCH ? AND s.business_id = ?{status_sql}',
+            [match, business_id] + ([status] if status is not None else []))
+    else:
+        rows = conn.execute(
+            'SELECT s.* FROM subscriptions s JOIN subscriber_search f ON f.rowid = s.rowid '
+            f'WHERE s.business_id = ? AND instr(f.text, ?) > 0{status_sql}',
+            [business_id, query] + ([status] if status is not None else []))
+    return [_to_record('subscriptions', row) for row in rows]
+
+def _ensure_search(conn):
+    # Bases creadas antes del índice de búsqueda: se carga una vez
+    if conn.execute("SELECT 1 FROM stats WHERE name = '_search_initialized'").fetchone():
+        return
+    conn.execute('DELETE FROM subscriber_search')
+    conn.execute(
+        'INSERT INTO subscriber_search (rowid, text, business_id) '
+        f"SELECT s.rowid, {_search_text_sql('u')}, s.business_id FROM subscriptions s "
+        'JOIN users u ON u.id = s.customer_id')
+    conn.execute("INSERT INTO stats (name, value) VALUES ('_search_initialized', 1)")
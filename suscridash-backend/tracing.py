@@ -0,0 +1,306 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from flask import request
+
+# Trazas por request: cada request recibe un trace id (el del header W3C
+# traceparent si viene, si no uno nuevo, devuelto en X-Trace-Id) y un span
+# raíz; dentro, span() abre spans hijos: decodificación del JWT, cada llamada
+# al almacenamiento (models), escrituras al journal y snapshots, y la
+# serialización JSON. El span actual va en una ContextVar, así cada hilo de
+# gunicorn lleva el suyo; fuera de un request span() no hace nada.
+#
+# Al terminar el request la traza se exporta en el formato JSON de
+# OpenTelemetry (OTLP/JSON, una línea ExportTraceServiceRequest por traza) a
+# TRACE_FILE o a stdout según TRACE_EXPORTER, y si duró más de TRACE_SLOW_MS
+# el árbol completo de spans se escribe en stderr. Se trazan TRACE_SAMPLE_RATE
+# de los requests y como máximo TRACE_MAX_SPANS spans por traza: los handlers
+# que leen registro por registro no generan miles de spans; los descartados se
+# cuentan en el span raíz.
+#
+# Registrar spans cuesta un 5-10% en los requests que leen mucho del
+# almacenamiento, así que por defecto se traza el 1%. Los demás requests solo
+# reciben el trace id y se les mide la duración: si son lentos igual quedan
+# en el log, en una línea sin árbol de spans.
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', '')  # '', 'file' o 'stdout'
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.ndjson')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '500'))
+# 0 desactiva el log de requests lentos
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '1000'))
+SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'suscridash-backend')
+
+# SpanKind de OpenTelemetry
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+
+_current = ContextVar('tracing_span', default=None)
+_export_lock = threading.Lock()
+
+class _Trace:
+    __slots__ = ('trace_id', 'spans', 'dropped', 'wall_ns', 'perf_ns', 'id_base')
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self.dropped = 0
+        # Los spans se miden con perf_counter_ns y se pasan a hora Unix
+        # con este origen
+        self.wall_ns = time.time_ns()
+        self.perf_ns = time.perf_counter_ns()
+        # El span id es id_base + posición en spans: se arma al exportar
+        self.id_base = random.getrandbits(63) + 1
+
+    def span_id(self, index):
+        return format(self.id_base + index, '016x')
+
+class Span:
+    __slots__ = ('trace', 'index', 'parent', 'name', 'kind', 'key', 'attributes', 'start', 'end', 'error',
+                 'calls', 'busy', '_entered', '_token')
+
+    def __init__(self, trace, parent, name, attributes, kind=KIND_INTERNAL):
+        # parent: el Span padre, o el span id (hex) del padre remoto en el
+        # span raíz
+        self.trace = trace
+        self.index = None
+        self.parent = parent
+        self.name = name
+        self.kind = kind
+        # key: los atributos con que se abrió, para juntar llamadas iguales en
+        # span(); set_attribute trabaja sobre una copia
+        self.key = attributes
+        self.attributes = attributes
+        self.start = self.end = None
+        self.error = None
+        # Un span puede cubrir varias llamadas seguidas iguales (ver span())
+        self.calls = 0
+        self.busy = 0
+        self._entered = None
+        self._token = None
+
+    @property
+    def span_id(self):
+        return self.trace.span_id(self.index)
+
+    @property
+    def parent_id(self):
+        if isinstance(self.parent, Span):
+            return self.parent.span_id
+        return self.parent
+
+    def set_attribute(self, key, value):
+        if self.attributes is self.key:
+            self.attributes = dict(self.key)
+        self.attributes[key] = value
+
+    def __enter__(self):
+        now = time.perf_counter_ns()
+        if self.index is None:
+            spans = self.trace.spans
+            self.index = len(spans)
+            spans.append(self)
+            self.start = now
+        self.calls += 1
+        self._entered = now
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter_ns()
+        self.busy += self.end - self._entered
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f'{exc_type.__name__}: {exc}'
+        return False
+
+    def all_attributes(self):
+        if self.calls < 2:
+            return self.attributes
+        return dict(self.attributes, calls=self.calls, busy_ms=round(self.busy / 1e6, 3))
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopSpan()
+
+def active():
+    # True dentro de un request que se está trazando
+    return _current.get() is not None
+
+def span(name, **attributes):
+    # with span('nombre', clave=valor) as s: ... ; s.set_attribute(...)
+    # Las llamadas seguidas con el mismo nombre y atributos, sin hijos ni
+    # errores (una búsqueda por registro dentro de un bucle), se juntan en un
+    # solo span con calls y busy_ms: de inicio de la primera a fin de la
+    # última.
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    trace = parent.trace
+    last = trace.spans[-1]
+    if (last.parent is parent and last.name == name and last.end is not None and last.error is None
+            and last.key == attributes):
+        return last
+    if len(trace.spans) >= TRACE_MAX_SPANS:
+        trace.dropped += 1
+        return _NOOP
+    return Span(trace, parent, name, attributes)
+
+def _parse_traceparent(value):
+    # (trace id, span id del padre) de un header traceparent válido
+    parts = (value or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == '0' * 32:
+        return None, None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None, None
+    return parts[1].lower(), parts[2].lower()
+
+def before_request():
+    environ = request.environ
+    trace_id, parent_id = _parse_traceparent(environ.get('HTTP_TRACEPARENT'))
+    if trace_id is None:
+        trace_id = random.getrandbits(128).to_bytes(16, 'big').hex()
+    environ['tracing.trace_id'] = trace_id
+    if not TRACE_SAMPLE_RATE or (TRACE_SAMPLE_RATE < 1 and random.random() >= TRACE_SAMPLE_RATE):
+        if TRACE_SLOW_MS:
+            environ['tracing.start'] = time.perf_counter_ns()
+        return
+    rule = request.url_rule
+    root = Span(_Trace(trace_id), parent_id, f'{request.method} {rule.rule if rule is not None else request.path}',
+                {'http.method': request.method, 'http.target': request.path}, KIND_SERVER)
+    root.__enter__()
+    environ['tracing.root'] = root
+
+def after_request(response):
+    environ = request.environ
+    trace_id = environ.get('tracing.trace_id')
+    if trace_id is not None:
+        response.headers['X-Trace-Id'] = trace_id
+    root = environ.get('tracing.root')
+    if root is not None:
+        root.attributes['http.status_code'] = response.status_code
+    return response
+
+def teardown_request(exc):
+    environ = request.environ
+    root = environ.pop('tracing.root', None)
+    if root is None:
+        # Sin muestrear: solo la duración, para el log de requests lentos
+        start = environ.pop('tracing.start', None)
+        elapsed = (time.perf_counter_ns() - start) / 1e6 if start is not None else 0
+        if TRACE_SLOW_MS and elapsed >= TRACE_SLOW_MS:
+            try:
+                sys.stderr.write(f'Request lento ({elapsed:.1f} ms) trace_id={environ["tracing.trace_id"]} '
+                                 f'{request.method} {request.path} (sin muestrear, sin spans)\n')
+                sys.stderr.flush()
+            except OSError:
+                pass
+        return
+    root.__exit__(type(exc) if exc is not None else None, exc, None)
+    # Por si algún span quedó abierto (generador sin consumir, etc.)
+    _current.set(None)
+    trace = root.trace
+    if trace.dropped:
+        root.attributes['suscridash.dropped_spans'] = trace.dropped
+    try:
+        if TRACE_EXPORTER:
+            _export(trace)
+        if TRACE_SLOW_MS and (root.end - root.start) / 1e6 >= TRACE_SLOW_MS:
+            sys.stderr.write(format_tree(trace))
+            sys.stderr.flush()
+    except OSError:
+        pass
+
+def init_app(app):
+    # Se registra primero para que el span raíz cubra los demás hooks
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+
+def _value(value):
+    # AnyValue de OTLP/JSON (los enteros van como string)
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _attributes(attributes):
+    return [{'key': key, 'value': _value(value)} for key, value in attributes.items() if value is not None]
+
+def to_otlp(trace):
+    # ExportTraceServiceRequest (OTLP/JSON) con los spans de la traza
+    spans = []
+    for span in trace.spans:
+        end = span.end if span.end is not None else time.perf_counter_ns()
+        data = {
+            'traceId': trace.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': span.kind,
+            'startTimeUnixNano': str(trace.wall_ns + span.start - trace.perf_ns),
+            'endTimeUnixNano': str(trace.wall_ns + end - trace.perf_ns),
+            'attributes': _attributes(span.all_attributes()),
+        }
+        if span.parent_id:
+            data['parentSpanId'] = span.parent_id
+        if span.error is not None:
+            data['status'] = {'code': 2, 'message': span.error}
+        spans.append(data)
+    return {'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': SERVICE_NAME, 'process.pid': os.getpid()})},
+        'scopeSpans': [{'scope': {'name': 'suscridash.tracing'}, 'spans': spans}],
+    }]}
+
+def _export(trace):
+    line = (json.dumps(to_otlp(trace), separators=(',', ':')) + '\n').encode('utf-8')
+    if TRACE_EXPORTER == 'stdout':
+        with _export_lock:
+            sys.stdout.buffer.write(line)
+            sys.stdout.flush()
+        return
+    # Una escritura O_APPEND por traza: los workers no se intercalan
+    fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def format_tree(trace):
+    # Árbol de spans indentado, con duración y atributos de cada uno
+    children = {}
+    for span in trace.spans[1:]:
+        children.setdefault(span.parent.index, []).append(span)
+    root = trace.spans[0]
+    lines = [f'Request lento ({(root.end - root.start) / 1e6:.1f} ms) trace_id={trace.trace_id}'
+             + (f' spans_descartados={trace.dropped}' if trace.dropped else '')]
+
+    def walk(span, depth):
+        end = span.end if span.end is not None else root.end
+        attributes = ' '.join(f'{key}={value}' for key, value in span.all_attributes().items() if value is not None)
+        lines.append('{}{} {:.3f} ms{}{}'.format(
+            '  ' * depth, span.name, (end - span.start) / 1e6,
+            ' ' + attributes if attributes else '', f' error={span.error}' if span.error else ''))
+        for child in children.get(span.index, ()):
+            walk(child, depth + 1)
+
+    walk(root, 1)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import json
+from functools import wraps
+from flask import request, make_response
+
+from models import SORTS, page_records, get_version
+
+# Paginación de los listados: ?limit=50&sort=-created_at&cursor=...&fields=id,email
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(sort, descending, after):
+    data = json.dumps([sort, descending, list(after)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    # [orden, descendente, [valor, id]]; cualquier otra cosa es ValueError
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(data, list) or len(data) != 3:
+        raise ValueError('Cursor inválido')
+    sort, descending, after = data
+    # Las claves de orden (models.SORTS) son (texto, id)
+    if (not isinstance(sort, str) or not isinstance(after, list) or len(after) != 2
+            or not all(isinstance(value, str) for value in after)):
+        raise ValueError('Cursor inválido')
+    return sort, bool(descending), after
+
+def fetch_page(collection, key=None):
+    # Registros según limit, cursor y sort de la query. Devuelve
+    # (registros, next_cursor), o (None, None) si no se pidió ninguno de los
+    # tres y el handler debe responder la colección completa como siempre.
+    # Lanza ValueError si algún parámetro no es válido.
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    sort = request.args.get('sort')
+    if limit is None and cursor is None and sort is None:
+        return None, None
+
+    if cursor:
+        # El cursor ya trae el orden de la primera página
+        sort, descending, after = decode_cursor(cursor)
+    else:
+        sort = sort or 'created_at'
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        after = None
+    if sort not in SORTS[collection][1]:
+        raise ValueError(f'Orden no válido: {sort}')
+
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE if cursor else None
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit debe ser un número')
+        if limit < 1:
+            raise ValueError('limit debe ser mayor que 0')
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    try:
+        records, last = page_records(collection, sort, after, limit, descending, key)
+    except TypeError:
+        # Cursor con un valor de otro tipo que la clave de orden
+        raise ValueError('Cursor inválido')
+    next_cursor = encode_cursor(sort, descending, last) if last is not None else None
+    return records, next_cursor
+
+def project(items):
+    # Solo los campos pedidos en ?fields=
+    fields = request.args.get('fields')
+    if not fields:
+        return items
+    fields = [f for f in fields.split(',') if f]
+    return [{f: item[f] for f in fields if f in item} for item in items]
+
+def conditional(*scopes):
+    # Respuestas condicionales para GETs que cambian poco. scopes son las
+    # colecciones que lee el handler; 'colección:tenant' se limita a la
+    # empresa del token. Si el cliente ya tiene la versión actual (If-None-Match
+    # o If-Modified-Since) se responde 304 sin ejecutar el handler. Va debajo
+    # de require_role para que el payload ya esté verificado.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            payload = kwargs.get('payload')
+            user_id = payload['user_id'] if payload else ''
+            versions = []
+            for scope in scopes:
+                collection, _, tenant = scope.partition(':')
+                versions.append(get_version(collection, user_id if tenant else None))
+            # La URL y el usuario también forman parte: la misma versión de
+            # los datos da respuestas distintas según los parámetros y el token
+            key = '|'.join([request.full_path, user_id] + [version for version, _ in versions])
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+            modified = int(max(m for _, m in versions)) or None
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(since and modified and modified <= since.timestamp())
+            response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                if modified:
+                    response.last_modified = modified
+                # El navegador guarda la respuesta pero vuelve a validarla
+                # en cada uso
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator